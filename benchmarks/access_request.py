@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    access_request
+
+    Measures the CPU time saved per request by serializing the access
+    request once per client instead of on every call, and by serializing
+    the request compactly to UTF-8 bytes in a single pass.
+
+    Run from the root of the repository::
+
+        python benchmarks/access_request.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import sys
+import timeit
+
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ups.rating_package import RatingService  # noqa
+
+
+def pretty_build_request(api, request_element):
+    """How every request was serialized before the prefix was cached and the
+    serialization made compact, including the encoding before sending
+    """
+    return '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8" ?>',
+        etree.tostring(api.access_request, pretty_print=True),
+        '<?xml version="1.0" encoding="UTF-8" ?>',
+        etree.tostring(request_element, pretty_print=True),
+    ]).encode('utf-8')
+
+
+def uncached_build_request(api, request_element):
+    "The compact serialization, with the access request serialized again"
+    api.password = api.password
+    return api.build_request(request_element)
+
+
+def main(number=20000):
+    api = RatingService('license_no', 'user_id', 'password', True)
+    request_element = RatingService.rating_request_type(
+        RatingService.ship_to_type(CompanyName='Apple')
+    )
+    timings = [
+        ('pretty', lambda: pretty_build_request(api, request_element)),
+        ('uncached', lambda: uncached_build_request(api, request_element)),
+        ('cached', lambda: api.build_request(request_element)),
+    ]
+    results = {}
+    for name, function in timings:
+        seconds = min(timeit.repeat(function, number=number, repeat=5))
+        results[name] = seconds / number * 1e6
+        print '%-10s %8.2f us/request' % (name, results[name])
+    print '%-10s %8.2f us/request (%.0f%%)' % (
+        'saved', results['pretty'] - results['cached'],
+        100 * (1 - results['cached'] / results['pretty']),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+    decoder
+
+    Compares the typed decoders of :mod:`ups.decoder` with objectifying the
+    recorded responses of the test suite and reading the same fields.
+
+    Run from the root of the repository::
+
+        python benchmarks/decoder.py
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import sys
+import timeit
+
+from lxml import objectify
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ups.base import BaseAPIClient  # noqa
+from ups import decoder  # noqa
+
+FIXTURES = os.path.join(
+    os.path.dirname(__file__), '..', 'ups', 'tests', 'fixtures'
+)
+
+
+def objectify_rate(xml):
+    response = objectify.fromstring(xml)
+    BaseAPIClient.look_for_error(response)
+    return [(
+        rated.Service.Code.text,
+        rated.TotalCharges.CurrencyCode.text,
+        rated.TotalCharges.MonetaryValue.pyval,
+        rated.TransportationCharges.MonetaryValue.pyval,
+        rated.ServiceOptionsCharges.MonetaryValue.pyval,
+        rated.NegotiatedRates.NetSummaryCharges.GrandTotal.MonetaryValue.pyval,
+        rated.BillingWeight.Weight.pyval,
+        rated.BillingWeight.UnitOfMeasurement.Code.text,
+        rated.GuaranteedDaysToDelivery.pyval,
+        rated.ScheduledDeliveryTime.pyval,
+        [w.text for w in rated.RatedShipmentWarning],
+    ) for rated in response.RatedShipment]
+
+
+def objectify_time_in_transit(xml):
+    response = objectify.fromstring(xml)
+    BaseAPIClient.look_for_error(response)
+    transit = response.TransitResponse
+    return transit.PickupDate.text, transit.Disclaimer.text, [(
+        service.Service.Code.text,
+        service.Service.Description.text,
+        service.Guaranteed.Code.text == 'Y',
+        service.EstimatedArrival.BusinessTransitDays.pyval,
+        service.EstimatedArrival.Date.text,
+        service.EstimatedArrival.Time.text,
+        service.EstimatedArrival.DayOfWeek.text,
+    ) for service in transit.ServiceSummary]
+
+
+def objectify_address_validation(xml):
+    response = objectify.fromstring(xml)
+    BaseAPIClient.look_for_error(response)
+    return [(
+        result.Rank.pyval,
+        result.Quality.pyval,
+        result.Address.City.text,
+        result.Address.StateProvinceCode.text,
+        result.PostalCodeLowEnd.text,
+        result.PostalCodeHighEnd.text,
+    ) for result in response.AddressValidationResult]
+
+
+def objectify_shipment_accept(xml):
+    response = objectify.fromstring(xml)
+    BaseAPIClient.look_for_error(response)
+    results = response.ShipmentResults
+    charges = results.ShipmentCharges
+    negotiated = results.NegotiatedRates.NetSummaryCharges.GrandTotal
+    return (
+        results.ShipmentIdentificationNumber.text,
+        charges.TotalCharges.CurrencyCode.text,
+        charges.TotalCharges.MonetaryValue.pyval,
+        charges.TransportationCharges.MonetaryValue.pyval,
+        charges.ServiceOptionsCharges.MonetaryValue.pyval,
+        negotiated.MonetaryValue.pyval,
+        results.BillingWeight.Weight.pyval,
+        results.BillingWeight.UnitOfMeasurement.Code.text,
+        [(
+            package.TrackingNumber.text,
+            package.LabelImage.LabelImageFormat.Code.text,
+            package.LabelImage.GraphicImage.text,
+            package.LabelImage.HTMLImage.text,
+        ) for package in results.PackageResults],
+    )
+
+
+BENCHMARKS = [
+    ('rate_shop.xml', objectify_rate, decoder.decode_rate),
+    ('time_in_transit.xml', objectify_time_in_transit,
+     decoder.decode_time_in_transit),
+    ('address_validation.xml', objectify_address_validation,
+     decoder.decode_address_validation),
+    ('shipment_accept.xml', objectify_shipment_accept,
+     decoder.decode_shipment_accept),
+]
+
+
+def measure(functions, xml, seconds=0.2, repeat=7):
+    """Returns the microseconds a call of each function takes, at best. The
+    functions take turns, so that both suffer the same background noise.
+    """
+    number = 1
+    while timeit.timeit(lambda: functions[0](xml), number=number) < seconds:
+        number *= 2
+    best = [float('inf')] * len(functions)
+    for i in range(repeat):
+        for index, function in enumerate(functions):
+            best[index] = min(
+                best[index],
+                timeit.timeit(lambda: function(xml), number=number)
+            )
+    return [elapsed / number * 1e6 for elapsed in best]
+
+
+def main():
+    print '%-24s %8s %12s %12s %8s' % (
+        'response', 'bytes', 'objectify', 'decoder', 'speedup'
+    )
+    for name, objectified, decoded in BENCHMARKS:
+        with open(os.path.join(FIXTURES, name)) as file:
+            xml = file.read()
+        before, after = measure([objectified, decoded], xml)
+        print '%-24s %8d %10.1fus %10.1fus %7.1fx' % (
+            name, len(xml), before, after, before / after
+        )
+
+
+if __name__ == '__main__':
+    main()
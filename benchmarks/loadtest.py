@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+    loadtest
+
+    Finds out how many requests one worker process sustains, and where it
+    saturates. Worker threads drive an API against the
+    :class:`~ups.fake_server.FakeUPSServer`, served by a process of its own
+    so that it does not compete with the workers for the interpreter, or
+    against the stub given by `--url`. Every combination of the scenarios,
+    the concurrency levels and the payload sizes runs for a while, and is
+    reported with its throughput, latency percentiles, CPU time and RSS.
+
+    The scenarios are the Rate, AV and TimeInTransit APIs, and the two-phase
+    shipment, ShipConfirm followed by ShipAccept, which counts as one
+    request. Payload sizes are the number of packages per shipment, which
+    AV and TimeInTransit are only run with the first of.
+
+    Run from the root of the repository::
+
+        python benchmarks/loadtest.py --concurrency 1 4 16 64 \\
+            --packages 1 20 --latency 0.05 --output report.json
+
+    The report is JSON, so the reports of two releases can be diffed.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+from multiprocessing import Process, Queue
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ups.batch import percentile  # noqa
+from ups.fake_server import FakeUPS, FakeUPSServer, Profile, \
+    lognormal  # noqa
+from ups.pool import ConnectionPool  # noqa
+from ups.rating_package import RatingService  # noqa
+from ups.address_validation import AddressValidation  # noqa
+from ups.time_in_transit import TimeInTransit  # noqa
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept  # noqa
+from suite import build_rate, build_address_validation, \
+    build_time_in_transit, build_ship_confirm  # noqa
+
+PERCENTILES = [('p50', 50), ('p95', 95), ('p99', 99), ('p999', 99.9)]
+
+
+class Scenario(object):
+    "Sends the request of an API over and over again"
+
+    #: The API class and the builder of its requests
+    api_class = None
+    builder = None
+
+    #: False if the requests do not depend on the number of packages
+    sized = True
+
+    def __init__(self, base_url, pool, packages):
+        self.api = self.client(self.api_class, base_url, pool)
+        self.request = self.builder(packages)
+
+    @staticmethod
+    def client(api_class, base_url, pool):
+        api = api_class('license', 'user', 'password', False, pool=pool)
+        api.base_url = base_url
+        return api
+
+    def __call__(self):
+        self.api.request(self.request)
+
+
+class RateScenario(Scenario):
+    api_class = RatingService
+    builder = staticmethod(build_rate)
+
+
+class AddressValidationScenario(Scenario):
+    api_class = AddressValidation
+    builder = staticmethod(build_address_validation)
+    sized = False
+
+
+class TimeInTransitScenario(Scenario):
+    api_class = TimeInTransit
+    builder = staticmethod(build_time_in_transit)
+    sized = False
+
+
+class ShipmentScenario(Scenario):
+    "Confirms a shipment and accepts it, which makes one request"
+
+    api_class = ShipmentConfirm
+    builder = staticmethod(build_ship_confirm)
+
+    def __init__(self, base_url, pool, packages):
+        Scenario.__init__(self, base_url, pool, packages)
+        self.accept_api = self.client(ShipmentAccept, base_url, pool)
+
+    def __call__(self):
+        digest = ShipmentConfirm.extract_digest(self.api.request(self.request))
+        self.accept_api.request(
+            ShipmentAccept.shipment_accept_request_type(digest)
+        )
+
+
+SCENARIOS = OrderedDict([
+    ('rate', RateScenario),
+    ('address_validation', AddressValidationScenario),
+    ('time_in_transit', TimeInTransitScenario),
+    ('shipment', ShipmentScenario),
+])
+
+
+def serve(queue, latency, sigma, error_rate):
+    "Serves the fake UPS until the process is terminated"
+    server = FakeUPSServer(FakeUPS(Profile(
+        latency=latency and lognormal(latency, sigma) or 0,
+        error_rate=error_rate,
+    )))
+    queue.put(server.url)
+    server.server.serve_forever(poll_interval=0.01)
+
+
+def start_server(options):
+    "Starts the fake UPS in a process of its own and returns it and its URL"
+    queue = Queue()
+    process = Process(target=serve, args=(
+        queue, options.latency, options.sigma, options.error_rate
+    ))
+    process.daemon = True
+    process.start()
+    return process, queue.get(timeout=10)
+
+
+def cpu_time():
+    "Returns the CPU seconds used by the process so far"
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rss():
+    "Returns the resident set size of the process in MiB"
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 1048576.0
+    except IOError:
+        # Not on Linux, fall back to the peak, which is in KiB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def drive(scenario, concurrency, duration):
+    """Calls the scenario from the given number of threads for the duration
+    and returns the latencies of the calls which succeeded, and the names of
+    the errors of those which failed
+    """
+    latencies = []
+    errors = []
+    stop = time.time() + duration
+
+    def work():
+        while time.time() < stop:
+            start = time.time()
+            try:
+                scenario()
+            except Exception, exc:
+                errors.append(type(exc).__name__)
+            else:
+                latencies.append(time.time() - start)
+
+    threads = [Thread(target=work) for i in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def run_level(scenario, concurrency, duration):
+    "Runs a level of the sweep and returns its results"
+    cpu = cpu_time()
+    start = time.time()
+    latencies, errors = drive(scenario, concurrency, duration)
+    elapsed = time.time() - start
+    cpu = cpu_time() - cpu
+
+    requests = len(latencies) + len(errors)
+    latencies.sort()
+    latency = OrderedDict(
+        (name, latencies and percentile(latencies, pct) * 1000)
+        for name, pct in PERCENTILES
+    )
+    latency['mean'] = latencies and sum(latencies) / len(latencies) * 1000
+    latency['max'] = latencies and latencies[-1] * 1000
+    return OrderedDict([
+        ('requests', requests),
+        ('errors', dict((name, errors.count(name)) for name in set(errors))),
+        ('throughput', requests / elapsed),
+        ('latency_ms', latency),
+        ('cpu_seconds', cpu),
+        ('cpu_ms_per_request', requests and cpu / requests * 1000),
+        ('rss_mib', rss()),
+    ])
+
+
+def sweep(options, base_url):
+    "Yields the results of every level of the sweep"
+    for name in options.scenarios:
+        sizes = options.packages
+        if not SCENARIOS[name].sized:
+            sizes = sizes[:1]
+        for packages in sizes:
+            for concurrency in options.concurrency:
+                pool = ConnectionPool(maxsize=concurrency)
+                scenario = SCENARIOS[name](base_url, pool, packages)
+                if options.warmup:
+                    drive(scenario, concurrency, options.warmup)
+                result = OrderedDict([
+                    ('scenario', name),
+                    ('packages', packages),
+                    ('concurrency', concurrency),
+                ])
+                result.update(
+                    run_level(scenario, concurrency, options.duration)
+                )
+                pool.close()
+                yield result
+
+
+def version():
+    "Returns the version of PyUPS under test"
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('PyUPS').version
+    except Exception:
+        return None
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Load test the APIs against a local stub of UPS'
+    )
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS))
+    parser.add_argument('--concurrency', nargs='+', type=int,
+                        default=[1, 4, 16, 64],
+                        help='Numbers of worker threads to sweep')
+    parser.add_argument('--packages', nargs='+', type=int, default=[1, 20],
+                        help='Packages per shipment to sweep')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='Seconds each level runs for')
+    parser.add_argument('--warmup', type=float, default=1,
+                        help='Seconds each level warms up for, unmeasured')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Median latency of the stub in seconds')
+    parser.add_argument('--sigma', type=float, default=0.5,
+                        help='Spread of the log-normal latency of the stub')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests the stub fails')
+    parser.add_argument('--url', help='Base URL of a stub to use instead')
+    parser.add_argument('--output', help='Write the report to this file')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    process = None
+    base_url = options.url
+    if base_url is None:
+        process, base_url = start_server(options)
+    report = OrderedDict([
+        ('version', version()),
+        ('python', sys.version.split()[0]),
+        ('started', datetime.utcnow().isoformat()),
+        ('options', vars(options)),
+        ('results', []),
+    ])
+    try:
+        for result in sweep(options, {'production': base_url}):
+            report['results'].append(result)
+            print >> sys.stderr, (
+                '%(scenario)s packages=%(packages)d '
+                'concurrency=%(concurrency)d: %(throughput).1f req/s'
+            ) % result, 'p99=%.1fms' % (result['latency_ms']['p99'] or 0)
+    finally:
+        if process is not None:
+            process.terminate()
+
+    output = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+    suite
+
+    Measures what a request costs apart from the network, phase by phase,
+    for all six APIs: building it with the `*_type` methods and
+    :meth:`~ups.base.BaseAPIClient.make_elements`, serializing it with the
+    access request, and parsing the response, both objectified and typed.
+    Responses come from the :class:`~ups.fake_server.FakeUPS`, so no network
+    is needed. Shipments are measured with 1 (small), 5 (typical) and 200
+    (large) packages.
+
+    Run from the root of the repository::
+
+        python benchmarks/suite.py
+        python benchmarks/suite.py --filter ShipConfirm --save baseline.json
+        python benchmarks/suite.py --compare baseline.json
+
+    Every case reports the operations per second, at best of a few runs,
+    and the allocations per operation. Python 2 cannot count every
+    allocation, so the latter are the garbage collected objects an
+    operation leaves behind while its result is alive, which is what grows
+    when a change allocates more.
+
+    Comparing against a baseline saved earlier prints the change of every
+    case, and exits with status 1 if any slowed down by more than the
+    threshold.
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import timeit
+from collections import OrderedDict
+
+from lxml.builder import E
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ups.base import BaseAPIClient  # noqa
+from ups.rating_package import RatingService  # noqa
+from ups.address_validation import AddressValidation  # noqa
+from ups.time_in_transit import TimeInTransit  # noqa
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept, \
+    ShipmentVoid  # noqa
+from ups.fake_server import FakeUPS  # noqa
+from ups.tests.helper import ShippingPackageHelper as Helper  # noqa
+
+#: Number of packages of the shipments of each size
+SIZES = OrderedDict([('small', 1), ('typical', 5), ('large', 200)])
+
+
+def shipment(packages):
+    "Returns the elements of a GB to GB shipment with the packages"
+    return [
+        Helper.get_shipper('123456', 'GB'),
+        Helper.get_ship_to('GB'),
+        Helper.get_ship_from('GB'),
+        ShipmentConfirm.service_type(Code='11'),
+    ] + [Helper.get_package('GB') for i in xrange(packages)]
+
+
+def build_rate(packages):
+    return RatingService.rating_request_type(E.Shipment(*shipment(packages)))
+
+
+def build_address_validation(packages):
+    return AddressValidation.request_type(
+        City='Miami', StateProvinceCode='FL', PostalCode='33137',
+        CountryCode='US',
+    )
+
+
+def build_time_in_transit(packages):
+    return TimeInTransit.time_in_transit_request_type(
+        TimeInTransit.transit_to_type(
+            PoliticalDivision2='Zapopan', PoliticalDivision1='JAL',
+            CountryCode='MX', PostcodePrimaryLow='45150',
+        ),
+        TimeInTransit.transit_from_type(
+            PoliticalDivision2='Aachen', CountryCode='DE',
+            PostcodePrimaryLow='52064',
+        ),
+        TimeInTransit.shipment_weight_type('14.1', Code='KGS'),
+        TotalPackagesInShipment=str(packages),
+        PickupDate='20141020',
+    )
+
+
+def build_ship_confirm(packages):
+    elements = shipment(packages)
+    elements.append(Helper.get_payment_info(AccountNumber='123456'))
+    return ShipmentConfirm.shipment_confirm_request_type(
+        *elements, Description='Benchmark'
+    )
+
+
+def build_void(packages):
+    return ShipmentVoid.void_shipment_request_type(
+        '1Z999AA10000000001',
+        ['1Z999AA1%010d' % index for index in xrange(packages)]
+    )
+
+
+def make_elements():
+    return BaseAPIClient.make_elements(
+        ['AddressLine1', 'City', 'CountryCode', 'PostalCode'], [], {
+            'AddressLine1': '2,Hope Rd', 'AddressLine2': 'Anson Road',
+            'City': 'Manchester', 'CountryCode': 'GB', 'PostalCode': 'M145EU',
+        }
+    )
+
+
+class Endpoint(object):
+    """The requests and responses of an API for a shipment size, and the
+    cases measuring them
+    """
+
+    def __init__(self, api_class, builder, fake, packages):
+        self.name = api_class.__name__
+        self.api = api_class('license', 'user', 'password', False)
+        self.typed = api_class('license', 'user', 'password', False,
+                               typed=True)
+        self.cycled = api_class('license', 'user', 'password', False,
+                                transport=fake)
+        self.builder = builder
+        self.packages = packages
+        self.request = builder(packages)
+        self.full_request = self.api.build_request(self.request)
+        self.response = fake.respond(
+            self.api.endpoint, self.full_request
+        )[2]
+
+    def cases(self):
+        "Returns the (phase, function) pairs of the cases"
+        cases = [
+            ('build', lambda: self.builder(self.packages)),
+            ('serialize', lambda: self.api.build_request(self.request)),
+            ('parse', lambda: self.api.handle_response(
+                self.response, self.full_request
+            )),
+        ]
+        if self.typed.decoder is not None:
+            cases.append(('parse_typed', lambda: self.typed.handle_response(
+                self.response, self.full_request
+            )))
+        cases.append(('cycle', lambda: self.cycled.request(
+            self.builder(self.packages)
+        )))
+        return cases
+
+
+class AcceptEndpoint(Endpoint):
+    "ShipmentAccept, whose request needs the digest of a confirmed shipment"
+
+    def __init__(self, fake, packages):
+        confirm = Endpoint(ShipmentConfirm, build_ship_confirm, fake, packages)
+        digest = ShipmentConfirm.extract_digest(
+            confirm.api.handle_response(confirm.response, None)
+        )
+        Endpoint.__init__(self, ShipmentAccept, lambda packages: (
+            ShipmentAccept.shipment_accept_request_type(digest)
+        ), fake, packages)
+
+
+def endpoints(fake):
+    "Yields the size and the :class:`Endpoint` of every API and size"
+    for size, packages in SIZES.items():
+        yield size, Endpoint(RatingService, build_rate, fake, packages)
+        yield size, Endpoint(ShipmentConfirm, build_ship_confirm, fake,
+                             packages)
+        yield size, AcceptEndpoint(fake, packages)
+        yield size, Endpoint(ShipmentVoid, build_void, fake, packages)
+    yield 'small', Endpoint(
+        AddressValidation, build_address_validation, fake, 1
+    )
+    yield 'small', Endpoint(TimeInTransit, build_time_in_transit, fake, 1)
+
+
+def cases():
+    "Returns the functions to measure by the name of their case"
+    fake = FakeUPS(seed=1)
+    cases = OrderedDict([('make_elements', make_elements)])
+    for size, endpoint in endpoints(fake):
+        for phase, function in endpoint.cases():
+            cases['%s/%s/%s' % (endpoint.name, phase, size)] = function
+    return cases
+
+
+def ops_per_second(function, seconds=0.2, repeat=5):
+    "Returns the calls of the function per second, at best of the runs"
+    number = 1
+    while timeit.timeit(function, number=number) < seconds / repeat:
+        number *= 2
+    return number / min(timeit.repeat(function, number=number, repeat=repeat))
+
+
+def allocations(function, number=50):
+    """Returns the garbage collected objects a call of the function leaves
+    allocated while its result is kept
+    """
+    results = []
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for i in xrange(number):
+            results.append(function())
+        after = gc.get_count()[0]
+    finally:
+        gc.enable()
+    return (after - before) / float(number)
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of every case against the baseline and returns the
+    names of the cases which slowed down by more than the threshold
+    """
+    print '\n%-36s %12s %12s %8s' % ('case', 'baseline', 'ops/s', 'change')
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['ops']
+        change = result['ops'] / before - 1
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = ' !'
+        print '%-36s %12.0f %12.0f %+7.1f%%%s' % (
+            name, before, result['ops'], change * 100, flag
+        )
+    return regressions
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description='Microbenchmarks of building, serializing and parsing'
+    )
+    parser.add_argument('--filter', default='',
+                        help='Only run the cases whose name contains this')
+    parser.add_argument('--seconds', type=float, default=0.2,
+                        help='Seconds to measure each case for')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs of each case, the best counts')
+    parser.add_argument('--save', help='Save the results to this JSON file')
+    parser.add_argument('--compare',
+                        help='Compare with the results saved in this file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown which counts as a regression')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    results = OrderedDict()
+    print '%-36s %12s %10s' % ('case', 'ops/s', 'allocs/op')
+    for name, function in cases().items():
+        if options.filter not in name:
+            continue
+        results[name] = {
+            'ops': ops_per_second(function, options.seconds, options.repeat),
+            'allocs': allocations(function),
+        }
+        print '%-36s %12.0f %10.1f' % (
+            name, results[name]['ops'], results[name]['allocs']
+        )
+
+    if options.save:
+        with open(options.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if options.compare:
+        with open(options.compare) as file:
+            regressions = compare(results, json.load(file), options.threshold)
+        if regressions:
+            print '\n%d case(s) regressed' % len(regressions)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,6 +26,9 @@ setup(
         'ups',
         'ups.tests',
     ],
+    package_data={
+        'ups.tests': ['fixtures/*.xml', 'cassettes/*.cassette'],
+    },
     install_requires=[
         'lxml',
         'unittest2',
@@ -18,18 +18,27 @@
     for UPS services.
 
 """
+from copy import deepcopy
+
 from lxml.builder import E
-from lxml import etree, objectify
 
 from base import BaseAPIClient
+from batch import BatchMixin
+from decoder import decode_address_validation
 
 
-class AddressValidation(BaseAPIClient):
+class AddressValidation(BatchMixin, BaseAPIClient):
     """Implements the Address Validation"""
 
     # Indicates the action to be taken by the XML service.
     RequestAction = E.RequestAction('AV')
 
+    # Decodes the response if the client is typed, see ups.decoder
+    decoder = staticmethod(decode_address_validation)
+
+    # Requests only read and hence may be hedged, see ups.hedging
+    hedgeable = True
+
     # TransactionReference identifies transactions between client and server.
     TransactionReference = E.TransactionReference(
         E.CustomerContext('unspecified')
@@ -60,38 +69,64 @@ class AddressValidation(BaseAPIClient):
         :param PostalCode: Postal code
         ::
         """
+        # The shared elements are copied, since lxml would move them out
+        # of the requests built before
         request = E.Request(
-            cls.RequestAction,
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(cls.TransactionReference),
         )
         elements = cls.make_elements(['CountryCode'], args, kwargs)
         return E.AddressValidationRequest(
             request, E.Address(*elements)
         )
 
-    def request(self, address_validation_request):
+    #: The elements of the address the validation result depends upon
+    cache_fields = ('CountryCode', 'PostalCode', 'City', 'StateProvinceCode')
+
+    @classmethod
+    def normalized_address(cls, address_validation_request):
+        """Returns the (CountryCode, PostalCode, City, StateProvinceCode)
+        tuple of a request built by :meth:`request_type`, normalized so that
+        trivially different spellings of an address compare equal.
+        """
+        address = address_validation_request.find('Address')
+        return tuple(
+            ' '.join((address.findtext(tag) or '').upper().split())
+            for tag in cls.cache_fields
+        )
+
+    def cache_key(self, address_validation_request):
+        """Validation results are cached by the normalized address, see
+        :meth:`normalized_address`.
+        """
+        environment = self.sandbox and 'sandbox' or 'production'
+        return '|'.join(
+            ('AV', environment) + self.normalized_address(
+                address_validation_request
+            )
+        )
+
+    def preload_cache(self, items):
+        """Stores many validation results in the cache at once, for example
+        to warm a new cache from an export of a previous one. Raises
+        :exc:`ValueError` if the client has no cache.
+
+        :param items: An iterable of (request, response) pairs, where the
+            request is built by :meth:`request_type` and the response is what
+            :meth:`request` returned for it (or its XML).
+        """
+        if self.cache is None:
+            raise ValueError('The client has no cache to preload')
+        self.cache.set_many(
+            (self.cache_key(request), response) for request, response in items
+        )
+
+    def request(self, address_validation_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param rate_request: lxml element with data for the rate request
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
         """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(address_validation_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        # Return request ?
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        return self._request(address_validation_request, deadline)
@@ -0,0 +1,897 @@
+# -*- coding: utf-8 -*-
+"""
+    async_pool
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Non-blocking Connection Pool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :class:`~ups.pool.ConnectionPool` blocks the calling thread until UPS has
+    answered. Applications which run many UPS calls at the same time would
+    need a thread per call for that. The :class:`AsyncConnectionPool` instead
+    multiplexes all requests on non-blocking keep-alive connections driven by
+    a single :class:`EventLoop` thread, so thousands of requests can be in
+    flight at once. Every request immediately returns a :class:`Future`::
+
+        api = RatingService(license_no, user_id, password, True)
+        futures = [api.request_async(request) for request in rate_requests]
+        responses = [future.result() for future in futures]
+
+    Callbacks added with :meth:`Future.add_done_callback` are run on the
+    event loop thread and hence must not block.
+"""
+from __future__ import with_statement
+
+import errno
+import heapq
+import httplib
+import itertools
+import os
+import select
+import socket
+import ssl
+import time
+import urllib2
+from collections import deque
+from logging import getLogger
+from StringIO import StringIO
+from threading import Condition, Lock, Thread, current_thread
+from urlparse import urlsplit
+
+from pool import ConnectionPool
+
+
+logger = getLogger('PyUPS')
+
+_loop_lock = Lock()
+_default_loop = None
+
+PENDING = 'PENDING'
+CANCELLED = 'CANCELLED'
+FINISHED = 'FINISHED'
+
+#: Errors of a non-blocking socket which just mean "try again later"
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+
+class CancelledError(Exception):
+    "Raised when the result of a cancelled :class:`Future` is asked for"
+
+
+class TimeoutError(Exception):
+    "Raised when a :class:`Future` is not done within the given timeout"
+
+
+class Future(object):
+    """The eventual result of an asynchronous call. The API follows the
+    futures of the Python 3 standard library and can be waited upon from
+    any thread.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def __repr__(self):
+        return '<Future at 0x%x state=%s>' % (id(self), self._state)
+
+    def _finish(self, state, result=None, exception=None):
+        with self._condition:
+            if self._state != PENDING:
+                return False
+            self._state = state
+            self._result = result
+            self._exception = exception
+            self._condition.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._invoke(callback)
+        return True
+
+    def _invoke(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logger.exception('Exception in callback of %r', self)
+
+    def cancel(self):
+        """Cancels the future if it is not done yet. Returns True if the
+        future was cancelled.
+        """
+        return self._finish(CANCELLED)
+
+    def cancelled(self):
+        "Returns True if the future was cancelled"
+        return self._state == CANCELLED
+
+    def done(self):
+        "Returns True if the future was cancelled or has a result"
+        return self._state != PENDING
+
+    def set_result(self, result):
+        "Sets the result of the future unless it is already done"
+        return self._finish(FINISHED, result=result)
+
+    def set_exception(self, exception):
+        "Sets the exception of the future unless it is already done"
+        return self._finish(FINISHED, exception=exception)
+
+    def add_done_callback(self, callback):
+        """Calls the callback with the future as its only argument once the
+        future is done. If it is done already, the callback is called at once.
+        """
+        with self._condition:
+            if self._state == PENDING:
+                self._callbacks.append(callback)
+                return
+        self._invoke(callback)
+
+    def _wait(self, timeout):
+        with self._condition:
+            if self._state == PENDING:
+                self._condition.wait(timeout)
+            if self._state == PENDING:
+                raise TimeoutError()
+            if self._state == CANCELLED:
+                raise CancelledError()
+
+    def exception(self, timeout=None):
+        """Waits for the future and returns the exception it failed with, or
+        None.
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def result(self, timeout=None):
+        """Waits for the future and returns its result. If the call failed,
+        the exception is raised.
+
+        :param timeout: Seconds to wait for, forever if None.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class _Timer(object):
+    "A callback scheduled by :meth:`EventLoop.call_later`"
+
+    __slots__ = ('when', 'seq', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, seq, callback, args):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """A minimal poll based event loop which runs in a daemon thread of its
+    own. Only :meth:`call_soon_threadsafe` and :meth:`stop` may be called
+    from other threads, everything else belongs to the loop thread.
+    """
+
+    def __init__(self):
+        self._ready = deque()
+        self._timers = []
+        self._readers = {}
+        self._writers = {}
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._thread = None
+        self._running = False
+
+        # The loop is woken up from other threads by a datagram sent to
+        # itself, which works on every platform that has sockets.
+        self._waker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._waker.bind(('127.0.0.1', 0))
+        self._waker.setblocking(0)
+        self._poller = hasattr(select, 'poll') and select.poll() or None
+
+    def start(self):
+        "Starts the loop thread unless it is running already"
+        with self._lock:
+            if self._thread is None:
+                self._running = True
+                self._thread = Thread(
+                    target=self.run_forever, name='PyUPS-EventLoop'
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        return self
+
+    def stop(self):
+        "Stops the loop after the callbacks which are ready have run"
+        self.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        self._running = False
+
+    def in_loop_thread(self):
+        "Returns True if called from the thread running the loop"
+        return current_thread() is self._thread
+
+    def call_soon_threadsafe(self, callback, *args):
+        "Schedules the callback to be called on the loop thread"
+        with self._lock:
+            self._ready.append((callback, args))
+        if not self.in_loop_thread():
+            try:
+                self._waker.sendto('x', self._waker.getsockname())
+            except socket.error:
+                # The buffer is full, so the loop wakes up anyway
+                pass
+
+    def call_later(self, delay, callback, *args):
+        """Calls the callback after delay seconds. Returns a timer which can
+        be cancelled.
+        """
+        timer = _Timer(time.time() + delay, next(self._seq), callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+        self._register(fd)
+
+    def remove_reader(self, fd):
+        if self._readers.pop(fd, None) is not None:
+            self._register(fd)
+
+    def add_writer(self, fd, callback):
+        self._writers[fd] = callback
+        self._register(fd)
+
+    def remove_writer(self, fd):
+        if self._writers.pop(fd, None) is not None:
+            self._register(fd)
+
+    def _register(self, fd):
+        if self._poller is None:
+            return
+        mask = 0
+        if fd in self._readers:
+            mask |= select.POLLIN
+        if fd in self._writers:
+            mask |= select.POLLOUT
+        if mask:
+            self._poller.register(fd, mask)
+        else:
+            try:
+                self._poller.unregister(fd)
+            except KeyError:
+                pass
+
+    def _drain_waker(self):
+        try:
+            while self._waker.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _poll(self, timeout):
+        "Waits for IO and returns the (reader, writer) fds which are ready"
+        if self._poller is None:
+            readable, writable, _ = select.select(
+                self._readers.keys(), self._writers.keys(), [], timeout
+            )
+            return readable, writable
+        if timeout is not None:
+            timeout = int(timeout * 1000)
+        readable, writable = [], []
+        for fd, event in self._poller.poll(timeout):
+            if event & ~select.POLLOUT:
+                readable.append(fd)
+            if event & ~select.POLLIN:
+                writable.append(fd)
+        return readable, writable
+
+    def _run_once(self):
+        timeout = None
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, self._timers[0].when - time.time())
+
+        try:
+            readable, writable = self._poll(timeout)
+        except (select.error, IOError), exc:
+            if exc.args[0] != errno.EINTR:
+                raise
+            readable, writable = [], []
+
+        for fd in readable:
+            self._run(self._readers.get(fd))
+        for fd in writable:
+            self._run(self._writers.get(fd))
+        self._run_timers()
+
+        with self._lock:
+            ready, self._ready = self._ready, deque()
+        for callback, args in ready:
+            self._run(callback, args)
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0].when <= now:
+            timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                self._run(timer.callback, timer.args)
+
+    def _run(self, callback, args=()):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('Exception in event loop callback')
+
+    def run_forever(self):
+        "Runs the loop in the calling thread until :meth:`stop` is called"
+        self._thread = current_thread()
+        self._running = True
+        self.add_reader(self._waker.fileno(), self._drain_waker)
+        while self._running:
+            self._run_once()
+        self.remove_reader(self._waker.fileno())
+
+
+def get_event_loop():
+    """Returns the process wide default :class:`EventLoop`, starting it on
+    the first call.
+    """
+    global _default_loop
+    if _default_loop is None:
+        with _loop_lock:
+            if _default_loop is None:
+                _default_loop = EventLoop().start()
+    return _default_loop
+
+
+class _ResponseParser(object):
+    """Incremental parser of a HTTP/1.1 response. Supports bodies delimited
+    by Content-Length, chunked transfer encoding or the connection closing.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.reason = None
+        self.msg = None
+        self.will_close = False
+        self.complete = False
+        self.body = []
+        self._buffer = ''
+        self._state = 'head'
+        self._remaining = None
+
+    def feed(self, data):
+        "Feeds received data. Returns True once the response is complete"
+        self._buffer += data
+        while not self.complete:
+            if not getattr(self, '_parse_' + self._state)():
+                break
+        return self.complete
+
+    def feed_eof(self):
+        "The server closed the connection. Returns True if that's expected"
+        if self._state == 'until_close':
+            self.complete = True
+        return self.complete
+
+    def _parse_head(self):
+        end = self._buffer.find('\r\n\r\n')
+        if end < 0:
+            return False
+        head, self._buffer = self._buffer[:end], self._buffer[end + 4:]
+        status_line, _, headers = head.partition('\r\n')
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise httplib.BadStatusLine(status_line)
+        version, self.status = parts[0], int(parts[1])
+        self.reason = len(parts) > 2 and parts[2] or ''
+        if 100 <= self.status < 200:
+            # Interim response, the real one follows
+            return True
+        self.msg = httplib.HTTPMessage(StringIO(headers + '\r\n\r\n'), 0)
+        self._select_body(version)
+        return True
+
+    def _select_body(self, version):
+        connection = (self.msg.getheader('connection') or '').lower()
+        self.will_close = 'close' in connection or (
+            version == 'HTTP/1.0' and 'keep-alive' not in connection
+        )
+        encoding = (self.msg.getheader('transfer-encoding') or '').lower()
+        length = self.msg.getheader('content-length')
+        if 'chunked' in encoding:
+            self._state = 'chunk_size'
+        elif length is not None:
+            self._state = 'length'
+            self._remaining = int(length)
+        elif self.status in (204, 304):
+            self._state = 'length'
+            self._remaining = 0
+        else:
+            self._state = 'until_close'
+            self.will_close = True
+
+    def _take(self):
+        "Moves at most the remaining bytes of the buffer to the body"
+        data = self._buffer[:self._remaining]
+        self._buffer = self._buffer[len(data):]
+        self._remaining -= len(data)
+        if data:
+            self.body.append(data)
+
+    def _parse_length(self):
+        self._take()
+        self.complete = self._remaining == 0
+        return False
+
+    def _parse_until_close(self):
+        if self._buffer:
+            self.body.append(self._buffer)
+            self._buffer = ''
+        return False
+
+    def _parse_chunk_size(self):
+        end = self._buffer.find('\r\n')
+        if end < 0:
+            return False
+        size = self._buffer[:end].split(';', 1)[0].strip()
+        self._buffer = self._buffer[end + 2:]
+        self._remaining = int(size, 16)
+        self._state = self._remaining and 'chunk' or 'trailer'
+        return True
+
+    def _parse_chunk(self):
+        self._take()
+        if self._remaining:
+            return False
+        self._state = 'chunk_end'
+        return True
+
+    def _parse_chunk_end(self):
+        if len(self._buffer) < 2:
+            return False
+        self._buffer = self._buffer[2:]
+        self._state = 'chunk_size'
+        return True
+
+    def _parse_trailer(self):
+        end = self._buffer.find('\r\n')
+        if end < 0:
+            return False
+        line, self._buffer = self._buffer[:end], self._buffer[end + 2:]
+        self.complete = not line
+        return True
+
+
+class _Request(object):
+    "A single request handled by the :class:`AsyncConnectionPool`"
+
+    __slots__ = (
+        'url', 'key', 'payload', 'timeout', 'future', 'timer', 'connection',
+        'retried',
+    )
+
+    def __init__(self, url, key, payload, timeout, future):
+        self.url = url
+        self.key = key
+        self.payload = payload
+        self.timeout = timeout
+        self.future = future
+        self.timer = None
+        self.connection = None
+        self.retried = False
+
+
+class _Connection(object):
+    """A non-blocking keep-alive connection to a host. A connection handles
+    one request at a time and is only used from the loop thread.
+    """
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.loop = pool.loop
+        self.key = key
+        self.sock = None
+        self.fd = None
+        self.connected = False
+        self.request = None
+        self.parser = None
+        self.offset = 0
+        self.received = False
+        self.last_used = None
+        self.idle_timer = None
+
+    def start(self, request):
+        "Sends the request, connecting first if required"
+        self.request = request
+        request.connection = self
+        self.parser = _ResponseParser()
+        self.offset = 0
+        self.received = False
+        if self.connected:
+            self._io(self._on_writable, write=True)
+        else:
+            self._connect()
+
+    def _io(self, callback, read=False, write=False):
+        "Waits for the socket to be readable or writable and calls back"
+        if read:
+            self.loop.add_reader(self.fd, callback)
+        else:
+            self.loop.remove_reader(self.fd)
+        if write:
+            self.loop.add_writer(self.fd, callback)
+        else:
+            self.loop.remove_writer(self.fd)
+
+    def _connect(self):
+        try:
+            family, address = self.pool.resolve(self.key)
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+            self.sock.setblocking(0)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.fd = self.sock.fileno()
+            error = self.sock.connect_ex(address)
+        except socket.error, exc:
+            return self.fail(exc)
+        if error and error not in WOULD_BLOCK:
+            return self.fail(socket.error(error, os.strerror(error)))
+        self._io(self._on_connect, write=True)
+
+    def _on_connect(self):
+        error = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            return self.fail(socket.error(error, os.strerror(error)))
+        if self.key[0] == 'https':
+            self.sock = self.pool.ssl_context.wrap_socket(
+                self.sock, server_hostname=self.key[1],
+                do_handshake_on_connect=False
+            )
+            return self._handshake()
+        self._on_connected()
+
+    def _handshake(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            return self._io(self._handshake, read=True)
+        except ssl.SSLWantWriteError:
+            return self._io(self._handshake, write=True)
+        except (ssl.SSLError, socket.error), exc:
+            return self.fail(exc)
+        self._on_connected()
+
+    def _on_connected(self):
+        self.connected = True
+        self._io(self._on_writable, write=True)
+
+    def _on_writable(self):
+        payload = self.request.payload
+        try:
+            self.offset += self.sock.send(buffer(payload, self.offset))
+        except ssl.SSLWantReadError:
+            return self._io(self._on_writable, read=True)
+        except ssl.SSLWantWriteError:
+            return self._io(self._on_writable, write=True)
+        except socket.error, exc:
+            if exc.args[0] in WOULD_BLOCK:
+                return self._io(self._on_writable, write=True)
+            return self.fail(exc)
+        if self.offset < len(payload):
+            return self._io(self._on_writable, write=True)
+        self._io(self._on_readable, read=True)
+
+    def _recv(self):
+        """Returns the data available on the socket, None if there is none
+        yet and an empty string when the server closed the connection.
+        """
+        try:
+            return self.sock.recv(65536)
+        except ssl.SSLWantReadError:
+            return None
+        except ssl.SSLWantWriteError:
+            self._io(self._on_readable, write=True)
+            return None
+        except socket.error, exc:
+            if exc.args[0] in WOULD_BLOCK:
+                return None
+            raise
+
+    def _on_readable(self):
+        try:
+            while True:
+                data = self._recv()
+                if data is None:
+                    return
+                if not data:
+                    return self._on_eof()
+                self.received = True
+                if self.parser.feed(data):
+                    return self._on_response()
+        except (httplib.HTTPException, socket.error, ValueError), exc:
+            self.fail(exc)
+
+    def _on_eof(self):
+        if self.parser.feed_eof():
+            return self._on_response()
+        if self.received:
+            return self.fail(httplib.IncompleteRead(''.join(self.parser.body)))
+        self.fail(httplib.BadStatusLine("''"))
+
+    def _on_response(self):
+        request, parser = self.request, self.parser
+        self.request = self.parser = None
+        self.pool._response(self, request, parser)
+
+    def fail(self, exc):
+        "Closes the connection and fails or retries its current request"
+        request = self.request
+        self.request = self.parser = None
+        # Only a request which was not written whole to a reused connection
+        # surely was not carried out
+        unsent = self.last_used is not None and request is not None and \
+            self.offset < len(request.payload)
+        self.close()
+        if request is not None:
+            self.pool._failed(self, request, exc, unsent)
+
+    def park(self, idle_timeout):
+        """Keeps the connection idle. If the server closes it in the meantime
+        or it is idle for too long, it is closed.
+        """
+        self.last_used = time.time()
+        self._io(self._on_idle_readable, read=True)
+        self.idle_timer = self.loop.call_later(
+            idle_timeout, self.pool._expire, self
+        )
+
+    def unpark(self):
+        self.idle_timer.cancel()
+        self.idle_timer = None
+
+    def _on_idle_readable(self):
+        # Either the server closed the connection or sent garbage
+        self.pool._expire(self)
+
+    def close(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        if self.sock is not None:
+            self._io(None)
+            self.sock.close()
+            self.sock = None
+        self.connected = False
+
+
+class AsyncConnectionPool(object):
+    """A pool of non-blocking keep-alive connections driven by an
+    :class:`EventLoop`. The interface mirrors
+    :class:`~ups.pool.ConnectionPool`, except that :meth:`urlopen` returns a
+    :class:`Future` at once. It is safe to use from any thread.
+
+    :param loop: The :class:`EventLoop` to run on, the default loop of
+        :func:`get_event_loop` if not given.
+    :param maxsize: Maximum number of idle connections kept open per host.
+    :param idle_timeout: Seconds after which an idle connection is closed.
+    :param timeout: Default timeout in seconds for every request, which
+        includes the time spent waiting for a free connection.
+    :param max_connections: Maximum number of connections opened to a host
+        at the same time. Further requests wait for a free connection.
+    :param ssl_context: Optional :class:`ssl.SSLContext` used for HTTPS
+        connections.
+    """
+
+    default_headers = ConnectionPool.default_headers
+
+    def __init__(self, loop=None, maxsize=10, idle_timeout=30, timeout=10,
+                 max_connections=100, ssl_context=None):
+        self.loop = loop or get_event_loop()
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.closed = False
+
+        # Everything below is only touched from the loop thread
+        self._idle = {}
+        self._active = {}
+        self._waiting = {}
+        self._addresses = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes all idle connections. Connections in use are closed as soon
+        as their response has been read.
+        """
+        self.closed = True
+        self.loop.call_soon_threadsafe(self._close_idle)
+
+    def _close_idle(self):
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def resolve(self, key):
+        """Returns the address family and the socket address for the
+        (scheme, host, port) key. Lookups are cached since they block.
+        """
+        if key not in self._addresses:
+            family, _, _, _, address = socket.getaddrinfo(
+                key[1], key[2], 0, socket.SOCK_STREAM
+            )[0]
+            self._addresses[key] = family, address
+        return self._addresses[key]
+
+    def urlopen(self, url, data, headers=None, timeout=None):
+        """POSTs the data to the url over a pooled connection and returns a
+        :class:`Future` for the body of the response.
+
+        The future fails with :exc:`urllib2.HTTPError` for a HTTP error status
+        and with :exc:`urllib2.URLError` when the server could not be reached
+        or did not answer within the timeout.
+
+        :param url: The URL to POST to
+        :param data: The body of the request as a byte string
+        :param headers: Additional headers to send
+        :param timeout: Timeout in seconds, defaults to :attr:`timeout`
+        """
+        future = Future()
+        if self.closed:
+            future.set_exception(
+                urllib2.URLError('Connection pool is closed')
+            )
+            return future
+
+        key = ConnectionPool.pool_key(url)
+        request = _Request(
+            url, key, self._payload(url, data, headers),
+            self.timeout if timeout is None else timeout, future
+        )
+        future.add_done_callback(
+            lambda f: f.cancelled() and self.loop.call_soon_threadsafe(
+                self._cancel, request
+            )
+        )
+        self.loop.call_soon_threadsafe(self._submit, request)
+        return future
+
+    def _payload(self, url, data, headers):
+        "Returns the raw HTTP request"
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        all_headers = dict(self.default_headers)
+        all_headers.update(headers or {})
+        all_headers['Host'] = parts.netloc
+        all_headers['Content-Length'] = str(len(data))
+        lines = ['POST %s HTTP/1.1' % path]
+        lines.extend('%s: %s' % item for item in all_headers.iteritems())
+        return '\r\n'.join(lines) + '\r\n\r\n' + data
+
+    def _submit(self, request):
+        if request.future.done():
+            return
+        request.timer = self.loop.call_later(
+            request.timeout, self._timeout, request
+        )
+        self._dispatch(request)
+
+    def _dispatch(self, request):
+        key = request.key
+        conn = self._pop_idle(key)
+        if conn is None:
+            active = self._active.get(key, 0)
+            if self.max_connections and active >= self.max_connections:
+                self._waiting.setdefault(key, deque()).append(request)
+                return
+            conn = _Connection(self, key)
+        self._active[key] = self._active.get(key, 0) + 1
+        conn.start(request)
+
+    def _pop_idle(self, key):
+        connections = self._idle.get(key)
+        if connections:
+            conn = connections.pop()
+            conn.unpark()
+            return conn
+
+    def _expire(self, conn):
+        "Closes an idle connection"
+        connections = self._idle.get(conn.key, [])
+        if conn in connections:
+            connections.remove(conn)
+        conn.close()
+
+    def _release(self, conn, keep_alive):
+        "A connection finished its request, reuse it for the next one"
+        key = conn.key
+        self._active[key] -= 1
+        connections = self._idle.setdefault(key, [])
+        if keep_alive and not self.closed and len(connections) < self.maxsize:
+            conn.park(self.idle_timeout)
+            connections.append(conn)
+        else:
+            conn.close()
+
+        waiting = self._waiting.get(key)
+        while waiting:
+            request = waiting.popleft()
+            if not request.future.done():
+                return self._dispatch(request)
+
+    def _finish(self, request, result=None, exception=None):
+        if request.timer is not None:
+            request.timer.cancel()
+        request.connection = None
+        if exception is not None:
+            request.future.set_exception(exception)
+        else:
+            request.future.set_result(result)
+
+    def _response(self, conn, request, parser):
+        body = ''.join(parser.body)
+        self._release(conn, not parser.will_close)
+        if parser.status >= 400:
+            return self._finish(request, exception=urllib2.HTTPError(
+                request.url, parser.status, parser.reason, parser.msg,
+                StringIO(body)
+            ))
+        self._finish(request, body)
+
+    def _failed(self, conn, request, exc, unsent):
+        self._release(conn, False)
+        if unsent and not request.retried and not request.future.done():
+            # The server dropped the idle connection, try once more on a
+            # fresh one.
+            request.retried = True
+            return self._dispatch(request)
+        self._finish(request, exception=urllib2.URLError(exc))
+
+    def _timeout(self, request):
+        request.timer = None
+        self._abort(request, urllib2.URLError(socket.timeout('timed out')))
+
+    def _cancel(self, request):
+        self._abort(request, None)
+
+    def _abort(self, request, exception):
+        "Stops the request where ever it is, failing it with the exception"
+        conn = request.connection
+        if conn is not None:
+            conn.request = None
+            conn.close()
+            self._release(conn, False)
+        else:
+            waiting = self._waiting.get(request.key)
+            if waiting and request in waiting:
+                waiting.remove(request)
+        if exception is not None:
+            self._finish(request, exception=exception)
+        elif request.timer is not None:
+            request.timer.cancel()
@@ -3,14 +3,21 @@
 from __future__ import with_statement
 
 import os
+import time
 from logging import getLogger, StreamHandler, Formatter, getLoggerClass, DEBUG
 from threading import Lock
-import urllib2
 
+from lxml import etree, objectify
 from lxml.builder import E
 
+from pool import ConnectionPool
+from async_pool import AsyncConnectionPool, CancelledError, Future
+from cache import SQLiteCache
+from single_flight import fingerprint
+from deadline import Deadline
 
-_logger_lock = Lock()
+
+_pool_lock = Lock()
 
 # Hide Debug Logs if Travis is providing secure env variables
 HIDE_DEBUG_LOGS = os.environ.get('TRAVIS_SECURE_ENV_VARS') == 'true'
@@ -37,6 +44,38 @@ class BaseAPIClient(object):
     :param user_id: API user ID, Usually your UPS accoutn login
     :param password: API Password,Usually UPS account Password
     :param sandbox: True if supposed to work in test mode
+    :param pool: A :class:`~ups.pool.ConnectionPool` to send the requests
+        through. Pools can be shared by several clients. If no pool is given
+        the client creates its own, which is closed by :meth:`close`.
+    :param async_pool: A :class:`~ups.async_pool.AsyncConnectionPool` used by
+        :meth:`request_async`. Created on first use if not given.
+    :param single_flight: A :class:`~ups.single_flight.SingleFlight` which
+        coalesces identical requests in flight at the same time.
+    :param cache: A cache like :class:`~ups.cache.TTLCache` to answer
+        repeated requests from. Only used by APIs which implement
+        :meth:`cache_key`.
+    :param typed: Decode responses into the compact result objects of
+        :mod:`ups.decoder` instead of objectifying them. Only used by APIs
+        which have a :attr:`decoder`. Typed responses can be kept in a
+        :class:`~ups.cache.TTLCache`, but not in a
+        :class:`~ups.cache.SQLiteCache`, which raises :exc:`ValueError`.
+    :param rate_limiter: A :class:`~ups.ratelimit.RateLimiter` which spaces
+        out the requests sent with the access license. Share it between all
+        clients of the process.
+    :param retry_policy: A :class:`~ups.retry.RetryPolicy` which retries
+        requests that failed transiently and keeps the circuit breakers of
+        the endpoints. Share it between the clients to share the breakers.
+    :param hedge_policy: A :class:`~ups.hedging.HedgePolicy` which sends a
+        second copy of slow requests. Only used by APIs which are
+        :attr:`hedgeable`.
+    :param transport: A :class:`~ups.transport.Transport` which sends the
+        requests instead of the connection pools, like the in-process
+        :class:`~ups.fake_server.FakeUPS`. It is shared, and hence left open
+        by :meth:`close`.
+    :param metrics: A :class:`~ups.metrics.Metrics` registry the requests
+        and the time their phases take are recorded in.
+    :param tracer: A :class:`~ups.tracing.Tracer` which emits a span for
+        every call and its phases, see :mod:`ups.tracing`.
     """
 
     #: UPS uses different URLs to differenciate between a production request
@@ -58,30 +97,99 @@ class BaseAPIClient(object):
         '-' * 80
     )
 
-    #: UPS API allows test requests to be made to its servers. The `sandbox`
-    #: flag, is used by the API to determine if calls must be made to the
-    #: production servers or the sandbox servers provided by UPS
-    sandbox = True
+    #: A function of :mod:`ups.decoder` which turns the XML of a response into
+    #: its typed result, used if the client is created with `typed=True`.
+    decoder = None
+
+    #: Seconds a request waits for the :attr:`rate_limiter` at most. Requests
+    #: which would have to wait longer fail with
+    #: :exc:`~ups.ratelimit.RateLimitExceeded` at once, so 0 fails fast.
+    #: None waits as long as needed.
+    rate_limit_wait = None
+
+    #: True for the APIs which only read, and whose requests hence may be
+    #: sent twice, see :mod:`ups.hedging`
+    hedgeable = False
+
+    #: False for the APIs whose requests must not be carried out twice,
+    #: which are hence only retried if they surely were not, see
+    #: :mod:`ups.retry`
+    idempotent = True
 
     def __init__(self, license_no, user_id, password, sandbox,
-                 return_xml=False):
+                 return_xml=False, pool=None, async_pool=None,
+                 single_flight=None, cache=None, typed=False,
+                 rate_limiter=None, retry_policy=None, hedge_policy=None,
+                 transport=None, metrics=None, tracer=None):
         """ """
+        if typed and self.decoder is not None and \
+                isinstance(cache, SQLiteCache):
+            # Only XML can be stored in the database
+            raise ValueError('Typed responses cannot be kept in a SQLiteCache')
+        self._access_request_xml = None
         self.license_no = license_no
         self.user_id = user_id
         self.password = password
+        self.logger_name = 'PyUPS'
         self.sandbox = sandbox
         self.return_xml = return_xml
+        self.typed = typed
+
+        #: Keep-alive connections to UPS. A private pool is created lazily if
+        #: none is given.
+        self._pool = pool
+        self._owns_pool = pool is None
+        self._async_pool = async_pool
+        self._owns_async_pool = async_pool is None
+        self.single_flight = single_flight
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.transport = transport
+        self.metrics = metrics
+        self.tracer = tracer
 
-        #: Prepare the lazy setup of the logger.
+    @property
+    def sandbox(self):
+        """UPS API allows test requests to be made to its servers. The
+        `sandbox` flag, is used by the API to determine if calls must be made
+        to the production servers or the sandbox servers provided by UPS.
+        Setting it resets the logger, see :meth:`reset_logger`.
+        """
+        return self._sandbox
+
+    @sandbox.setter
+    def sandbox(self, value):
+        self._sandbox = value
+        self.reset_logger()
+
+    def reset_logger(self):
+        """Drops the logger, which is created again on first use, and
+        determines once whether debug messages are logged at all, see
+        :attr:`debug`. Call it after reconfiguring the logging of the
+        application for the client to pick the change up.
+        """
         self._logger = None
-        self.logger_name = 'PyUPS'
+        sandbox_debug = self.sandbox and not HIDE_DEBUG_LOGS
+
+        #: True if debug messages are logged, either because of the
+        #: :attr:`sandbox` flag or because the logging of the application
+        #: enables them for :attr:`logger_name`. The request and response
+        #: documents are only formatted for the log if it is set.
+        self.debug = bool(
+            sandbox_debug or getLogger(self.logger_name).isEnabledFor(DEBUG)
+        )
 
     def create_logger(self):
         """Creates a logger.  This logger works similar to a regular Python
         logger but changes the effective logging level based on the API's
         sandbox flag.
-        Furthermore this function also removes all attached handlers in case
-        there was a logger with the log name before.
+
+        The logger belongs to the client alone, it is not registered with
+        the :mod:`logging` module. Its records propagate to the logger named
+        :attr:`logger_name`, which is left untouched, so that handlers the
+        application attaches to it keep working.
 
         :copyright: (c) 2010 by Armin Ronacher.
         """
@@ -99,11 +207,8 @@ class BaseAPIClient(object):
         handler = DebugHandler()
         handler.setLevel(DEBUG)
         handler.setFormatter(Formatter(self.debug_log_format))
-        logger = getLogger(self.logger_name)
-        # just in case that was not a new logger, get rid of all the handlers
-        # already attached to it.
-        del logger.handlers[:]
-        logger.__class__ = DebugLogger
+        logger = DebugLogger(self.logger_name)
+        logger.parent = getLogger(self.logger_name)
         logger.addHandler(handler)
         return logger
 
@@ -124,31 +229,517 @@ class BaseAPIClient(object):
         >>> import sys; sys.stderr = sys.stdout
         >>> c = BaseAPIClient('a', 'b', 'c', True)
         >>> c.logger
-        <....DebugLogger instance at 0x...>
+        <....DebugLogger object at 0x...>
         >>> c.logger.debug('Test')
         -...
         DEBUG in ...:
         Test
         -...
         >>> c.sandbox = False
-        >>> c._logger = None
+        >>> c.debug
+        False
         >>> c.logger.debug('Test')
 
         """
-        if self._logger and self._logger.name == self.logger_name:
-            return self._logger
+        logger = self._logger
+        if logger is None or logger.name != self.logger_name:
+            # Creating a logger has no side effects, so a race between two
+            # threads merely creates one that is thrown away
+            logger = self._logger = self.create_logger()
+        return logger
+
+    @property
+    def pool(self):
+        """The :class:`~ups.pool.ConnectionPool` used to talk to UPS"""
+        if self._pool is None:
+            with _pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool()
+        return self._pool
+
+    @property
+    def async_pool(self):
+        """The :class:`~ups.async_pool.AsyncConnectionPool` used by
+        :meth:`request_async`
+        """
+        if self._async_pool is None:
+            with _pool_lock:
+                if self._async_pool is None:
+                    self._async_pool = AsyncConnectionPool()
+        return self._async_pool
+
+    def close(self):
+        """Closes the connections held by the client. A pool which was passed
+        to the client is shared and hence left open.
+        """
+        if self._owns_pool and self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if self._owns_async_pool and self._async_pool is not None:
+            self._async_pool.close()
+            self._async_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _credential(name):
+        "A credential whose change invalidates :attr:`access_request_xml`"
+        attribute = '_' + name
+
+        def fget(self):
+            return getattr(self, attribute)
 
-        with _logger_lock:
-            if self._logger and self._logger.name == self.logger_name:
-                return self._logger
-            self._logger = rv = self.create_logger()
-            return rv
+        def fset(self, value):
+            setattr(self, attribute, value)
+            self._access_request_xml = None
 
-    def send_request(self, url, data):
+        return property(fget, fset)
+
+    license_no = _credential('license_no')
+    user_id = _credential('user_id')
+    password = _credential('password')
+    del _credential
+
+    #: The XML declaration preceding both the access request and the request
+    xml_declaration = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+    @property
+    def access_request_xml(self):
+        """The serialized :attr:`access_request` as UTF-8 bytes, with the XML
+        declarations of both itself and the request which follows it. The
+        credentials do not change between requests, so it is only serialized
+        again when one of them is set.
+
+        >>> client = BaseAPIClient('license_no', 'user_id', 'password', True)
+        >>> client.access_request_xml is client.access_request_xml
+        True
+        >>> client.password = 'secret'
+        >>> '<Password>secret</Password>' in client.access_request_xml
+        True
+        """
+        access_request_xml = self._access_request_xml
+        if access_request_xml is None:
+            access_request_xml = self._access_request_xml = ''.join([
+                self.xml_declaration,
+                etree.tostring(self.access_request, encoding='UTF-8',
+                               xml_declaration=False),
+                '\n',
+                self.xml_declaration,
+            ])
+        return access_request_xml
+
+    def send_request(self, url, data, timeout=None, deadline=None):
         """Sends data to the server on a request
+
+        :param timeout: Socket timeout, defaults to that of the :attr:`pool`
+        :param deadline: A :class:`~ups.deadline.Deadline` the request must
+            be finished by, see :meth:`~ups.pool.ConnectionPool.urlopen`
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if self.transport is not None:
+            return self.transport.urlopen(
+                url, data, timeout=timeout, deadline=deadline
+            )
+        return self.pool.urlopen(
+            url, data, timeout=timeout, deadline=deadline
+        )
+
+    def build_request(self, request_element, pretty=False):
+        """Returns the full XML document sent to UPS for the request element,
+        which is the access request followed by the request itself, as UTF-8
+        encoded bytes.
+
+        The document is compact, without any indentation. Indented output is
+        meant for reading only, see :meth:`log_request`.
+
+        >>> client = BaseAPIClient('license_no', 'user_id', 'password', True)
+        >>> print client.build_request(E.Request(E.Code('01')))
+        <?xml version="1.0" encoding="UTF-8"?>
+        <AccessRequest><Password>password</Password>...</AccessRequest>
+        <?xml version="1.0" encoding="UTF-8"?>
+        <Request><Code>01</Code></Request>
+        >>> print client.build_request(E.Request(E.Code('01')), pretty=True)
+        <?xml version="1.0" encoding="UTF-8"?>
+        <AccessRequest>
+          <Password>password</Password>
+          ...
+        <Request>
+          <Code>01</Code>
+        </Request>
+        <BLANKLINE>
+
+        :param pretty: Indent the elements, for humans to read
+        """
+        if pretty:
+            return ''.join([
+                self.xml_declaration,
+                etree.tostring(self.access_request, encoding='UTF-8',
+                               xml_declaration=False, pretty_print=True),
+                self.xml_declaration,
+                etree.tostring(request_element, encoding='UTF-8',
+                               xml_declaration=False, pretty_print=True),
+            ])
+        return self.access_request_xml + etree.tostring(
+            request_element, encoding='UTF-8', xml_declaration=False
+        )
+
+    def log_request(self, request_element):
+        """Logs the request in readable form if :attr:`debug` is set.
+        Nothing is serialized otherwise.
+        """
+        if self.debug:
+            self.logger.debug(
+                "Request XML: %s",
+                self.build_request(request_element, pretty=True)
+            )
+
+    def handle_response(self, result, full_request):
+        """Parses the response received from UPS and raises the error it
+        contains, if any.
+
+        :param result: The body of the response
+        :param full_request: The XML document which was sent
+        """
+        if self.debug:
+            self.logger.debug("Response Received: %s", result)
+
+        if self.typed and self.decoder is not None:
+            response = self.decoder(result, full_request)
+        else:
+            response = objectify.fromstring(result)
+            self.look_for_error(response, full_request)
+
+        # Return request ?
+        if self.return_xml:
+            return full_request, response
+        else:
+            return response
+
+    def cache_key(self, request_element):
+        """Returns the key the response to the request is cached under, or
+        None if it must not be cached. Nothing is cached by default, APIs
+        whose responses can be reused override this.
+        """
+        return None
+
+    def cache_expiry(self, request_element):
+        """Returns the timestamp at which the cached response to the request
+        expires, or None to use the expiry of the cache.
+        """
+        return None
+
+    def _cache_lookup(self, request_element):
+        """Returns the cache key of the request and the cached response, if
+        there is one.
+        """
+        if self.cache is None:
+            return None, None
+        key = self.cache_key(request_element)
+        if key is None:
+            return None, None
+        return key, self.cache.get(key)
+
+    def _cache_store(self, key, request_element, result):
+        "Caches the result of `request` for the key"
+        if key is not None:
+            self.cache.set(
+                key, self.return_xml and result[1] or result,
+                self.cache_expiry(request_element)
+            )
+
+    def _cached(self, request_element, response, sample=None):
+        "Returns a cached response the same way `request` returns it"
+        if sample is not None:
+            sample.cached()
+        if self.return_xml:
+            return self.build_request(request_element), response
+        return response
+
+    def _request(self, request_element, deadline=None):
+        """Calls up UPS and sends the request element. This is the common
+        implementation of the `request` method of all APIs.
+
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+            which the call must be finished, see :mod:`ups.deadline`
         """
-        request = urllib2.Request(url=url, data=data.encode("utf-8"))
-        return urllib2.urlopen(request, timeout=10).read()
+        deadline = Deadline.of(deadline)
+        sample = self._start(request_element)
+        key, response = self._cache_lookup(request_element)
+        if response is not None:
+            return self._cached(request_element, response, sample)
+
+        full_request = self._serialize(request_element, sample)
+        try:
+            if self.single_flight is not None:
+                result = self.single_flight.call(
+                    fingerprint(self.url, full_request), self._call,
+                    full_request, deadline, sample
+                )
+            else:
+                result = self._call(full_request, deadline, sample)
+        except Exception, exc:
+            self._finish(sample, exc)
+            raise
+        self._finish(sample)
+        self._cache_store(key, request_element, result)
+        return result
+
+    def _start(self, request_element):
+        """Returns the :class:`~ups.metrics.Sample` a call of the request
+        element is timed into for the :attr:`metrics` and the
+        :attr:`tracer`, or None if there are neither
+        """
+        if self.tracer is not None:
+            return self.tracer.sample(
+                self.metrics, self.endpoint, self.sandbox, request_element
+            )
+        return self.metrics and self.metrics.sample(self.endpoint)
+
+    @staticmethod
+    def _finish(sample, exc=None):
+        "Tells the sample, if any, that its call is done"
+        if sample is not None:
+            sample.finish(exc)
+
+    def _serialize(self, request_element, sample=None):
+        """Returns the full request for the request element, timing its
+        serialization, and its logging in debug mode, into the sample
+        """
+        if sample is None:
+            full_request = self.build_request(request_element)
+            self.log_request(request_element)
+            return full_request
+        sample.restart()
+        full_request = self.build_request(request_element)
+        sample.lap('serialize')
+        if self.debug:
+            self.log_request(request_element)
+            sample.lap('log')
+        return full_request
+
+    def _sample(self, full_request, sample=None):
+        """Returns the :class:`~ups.metrics.Sample` an attempt to send the
+        full request is timed into, which is the sample of the call for its
+        first attempt
+        """
+        if sample is None:
+            return None
+        if sample.recorded:
+            sample = sample.retry()
+        sample.request_bytes = len(full_request)
+        sample.restart()
+        return sample
+
+    @property
+    def endpoint(self):
+        "The last part of the :attr:`url`, which names the API, e.g. Rate"
+        return self.url.rsplit('/', 1)[-1]
+
+    def throttle(self, deadline=None):
+        """Reserves a request with the :attr:`rate_limiter` and returns the
+        seconds to wait before sending it, see
+        :meth:`~ups.ratelimit.RateLimiter.reserve`. The wait ends by the
+        deadline of the call, if it has one, at the latest.
+        """
+        if self.rate_limiter is None:
+            return 0
+        expires = deadline and deadline.expires
+        if self.rate_limit_wait is not None:
+            expires = min(
+                expires or float('inf'), time.time() + self.rate_limit_wait
+            )
+        return self.rate_limiter.reserve(
+            self.license_no, self.endpoint, expires
+        )
+
+    def _call(self, full_request, deadline=None, sample=None):
+        """Sends the full request and handles the response, as often as the
+        :attr:`retry_policy` asks for and the deadline allows
+        """
+        if self.retry_policy is None:
+            return self._attempt(full_request, deadline, sample)
+        return self.retry_policy.call(
+            self.url, self._attempt, (full_request, deadline, sample),
+            deadline, self.idempotent
+        )
+
+    @property
+    def hedging(self):
+        """True if requests are hedged, see :attr:`hedge_policy`. Requests
+        sent through a :attr:`transport` are not.
+        """
+        return self.hedgeable and self.hedge_policy is not None and \
+            self.transport is None
+
+    def _attempt(self, full_request, deadline=None, sample=None):
+        "Sends the full request once and handles the response"
+        wait = self.throttle(deadline)
+        if wait:
+            time.sleep(wait)
+        return self._handle(
+            self._send, (full_request, deadline), full_request,
+            self._sample(full_request, sample)
+        )
+
+    def _send(self, full_request, deadline=None):
+        "Sends the full request once and returns the body of the response"
+        if self.hedging:
+            return self._urlopen_async(full_request, deadline).result()
+        return self.send_request(
+            self.url, full_request,
+            deadline and deadline.timeout(
+                (self.transport or self.pool).timeout
+            ), deadline
+        )
+
+    def _handle(self, send, args, full_request, sample=None):
+        """Handles the body of the response `send` returns for the
+        arguments, timing the network and parse phases into the sample, if
+        any
+        """
+        if sample is None:
+            return self.handle_response(send(*args), full_request)
+        result = sample.call('network', send, *args)
+        sample.response_bytes = len(result)
+        response = sample.call(
+            'parse', self.handle_response, result, full_request
+        )
+        sample.record()
+        return response
+
+    @staticmethod
+    def _timed(sample, phase, function, *args):
+        "Calls the function, timed as the phase into the sample if any"
+        if sample is None:
+            return function(*args)
+        return sample.call(phase, function, *args)
+
+    def _urlopen_async(self, full_request, deadline=None):
+        """Sends the full request over the async pool, hedged if need be, or
+        through the :attr:`transport`
+        """
+        if self.transport is not None:
+            return self.transport.urlopen_async(
+                self.url, full_request,
+                timeout=deadline and deadline.timeout(self.transport.timeout)
+            )
+        if self.hedging:
+            return self.hedge_policy.urlopen(
+                self.async_pool, self.url, full_request, deadline=deadline
+            )
+        timeout = deadline and deadline.timeout(self.async_pool.timeout)
+        return self.async_pool.urlopen(self.url, full_request, timeout=timeout)
+
+    def request_async(self, request_element, deadline=None):
+        """Non-blocking counterpart of `request`. The request is sent over
+        the :attr:`async_pool` and a :class:`~ups.async_pool.Future` is
+        returned at once, which resolves to exactly what `request` returns or
+        fails with the exception it raises.
+
+        :param request_element: lxml element built by the `*_type` methods of
+            the API, same as for `request`.
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+            which the call must be finished, see :mod:`ups.deadline`
+        """
+        deadline = Deadline.of(deadline)
+        sample = self._start(request_element)
+        key, response = self._cache_lookup(request_element)
+        if response is not None:
+            future = Future()
+            future.set_result(self._cached(request_element, response, sample))
+            return future
+
+        full_request = self._serialize(request_element, sample)
+        if self.single_flight is not None:
+            future = self.single_flight.call_async(
+                fingerprint(self.url, full_request), self._call_async,
+                full_request, deadline, sample
+            )
+        else:
+            future = self._call_async(full_request, deadline, sample)
+        if sample is not None:
+            def finish(future):
+                if future.cancelled():
+                    return sample.finish(CancelledError())
+                sample.finish(future.exception())
+            future.add_done_callback(finish)
+        if key is not None:
+            def store(future):
+                if not future.cancelled() and future.exception() is None:
+                    self._cache_store(key, request_element, future.result())
+            future.add_done_callback(store)
+        return future
+
+    def _call_later(self, delay, callback, *args):
+        """Calls the callback on the event loop of the :attr:`transport` or
+        the async pool after a delay
+        """
+        loop = (self.transport or self.async_pool).loop
+        loop.call_soon_threadsafe(loop.call_later, delay, callback, *args)
+
+    def _call_async(self, full_request, deadline=None, sample=None):
+        """Sends the full request over the async pool and handles the
+        response, as often as the :attr:`retry_policy` asks for and the
+        deadline allows. Pauses between attempts are timers of the event
+        loop.
+        """
+        if self.retry_policy is None:
+            return self._attempt_async(full_request, deadline, sample)
+        return self.retry_policy.call_async(
+            self.url, self._attempt_async, self._call_later,
+            (full_request, deadline, sample), deadline, self.idempotent
+        )
+
+    def _attempt_async(self, full_request, deadline=None, sample=None):
+        """Sends the full request over the async pool once and handles the
+        response. Requests held back by the rate limiter are sent by a timer
+        of the event loop, without blocking the caller.
+        """
+        future = Future()
+        try:
+            wait = self.throttle(deadline)
+        except Exception, exc:
+            future.set_exception(exc)
+            return future
+
+        if wait:
+            self._call_later(
+                wait, self._send_async, future, full_request, deadline, sample
+            )
+        else:
+            self._send_async(future, full_request, deadline, sample)
+        return future
+
+    def _send_async(self, future, full_request, deadline, sample=None):
+        "Sends an attempt and resolves its future with the handled response"
+        if future.done():
+            return
+        sample = self._sample(full_request, sample)
+        try:
+            sent = self._urlopen_async(full_request, deadline)
+        except Exception, exc:
+            if sample is not None:
+                sample.record(exc, 'network')
+            return future.set_exception(exc)
+
+        def on_response(sent):
+            if sent.cancelled():
+                return future.cancel()
+            try:
+                future.set_result(
+                    self._handle(sent.result, (), full_request, sample)
+                )
+            except Exception, exc:
+                future.set_exception(exc)
+
+        future.add_done_callback(
+            lambda future: future.cancelled() and sent.cancel()
+        )
+        sent.add_done_callback(on_response)
 
     @classmethod
     def look_for_error(cls, response, request=None):
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+    batch
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Batch Requests
+    ~~~~~~~~~~~~~~
+
+    Sending thousands of requests one after the other spends most of the
+    time waiting on UPS. :meth:`BatchMixin.request_many` runs them on a
+    bounded pool of worker threads instead and yields a :class:`BatchResult`
+    for each request, either in the order of the input or as soon as they
+    complete::
+
+        batch = rating_api.request_many(rate_requests, workers=16)
+        for result in batch:
+            if result.error is not None:
+                print result.index, result.error
+            else:
+                print result.index, result.response.RatedShipment
+        print batch.stats
+
+    Errors never stop the batch, each one is captured in the result of the
+    request which caused it. The input is consumed lazily and only a window
+    of requests is held in memory at a time, so generators of any length can
+    be passed in.
+"""
+from __future__ import with_statement
+
+import math
+import time
+from Queue import Queue
+from threading import Semaphore, Thread
+
+from deadline import Deadline
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of the sorted values
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    >>> percentile([], 50)
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class BatchResult(object):
+    """The outcome of a single request of a batch
+
+    :param index: Position of the request in the input
+    :param request: The request element
+    :param response: What `request` returned, None if it failed
+    :param error: The exception raised by `request`, None if it succeeded
+    :param latency: Seconds the request took
+    """
+
+    __slots__ = ('index', 'request', 'response', 'error', 'latency')
+
+    def __init__(self, index, request, response=None, error=None,
+                 latency=None):
+        self.index = index
+        self.request = request
+        self.response = response
+        self.error = error
+        self.latency = latency
+
+    def __repr__(self):
+        return '<BatchResult %d %s>' % (
+            self.index, self.error is None and 'ok' or repr(self.error)
+        )
+
+
+class BatchStats(object):
+    """Throughput and latency of a finished batch
+
+    :param latencies: Latencies of all the requests in seconds
+    :param errors: Number of failed requests
+    :param elapsed: Wall clock seconds the batch took
+    """
+
+    def __init__(self, latencies, errors, elapsed):
+        latencies = sorted(latencies)
+        self.count = len(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.throughput = elapsed and self.count / elapsed or 0.0
+        self.p50 = percentile(latencies, 50)
+        self.p99 = percentile(latencies, 99)
+
+    def __str__(self):
+        return (
+            '%d requests (%d failed) in %.2fs: %.1f req/s, '
+            'p50 %.1fms, p99 %.1fms' % (
+                self.count, self.errors, self.elapsed, self.throughput,
+                (self.p50 or 0) * 1000, (self.p99 or 0) * 1000,
+            )
+        )
+
+
+class _Done(object):
+    "Sent by the feeder once the input is exhausted"
+
+    def __init__(self, count, error=None):
+        self.count = count
+        self.error = error
+
+
+class Batch(object):
+    """An iterable over the results of :meth:`BatchMixin.request_many`.
+    Requests are only sent while the batch is iterated upon, and
+    :attr:`stats` is available once it has been exhausted.
+    """
+
+    def __init__(self, api, requests, workers=8, ordered=True, window=None,
+                 deadline=None):
+        self.api = api
+        self.requests = requests
+        self.workers = workers
+        self.ordered = ordered
+        self.window = window or workers * 4
+        self.deadline = Deadline.of(deadline)
+
+        #: :class:`BatchStats` of the batch, set once all results are yielded
+        self.stats = None
+
+        self._stopped = False
+        self._slots = Semaphore(self.window)
+        self._tasks = Queue()
+        self._results = Queue()
+
+    def _feed(self):
+        "Puts the requests on the task queue, at most a window at a time"
+        count, error = 0, None
+        try:
+            for request in self.requests:
+                self._slots.acquire()
+                if self._stopped:
+                    break
+                self._tasks.put((count, request))
+                count += 1
+        except Exception, error:
+            pass
+        for i in range(self.workers):
+            self._tasks.put(None)
+        self._results.put(_Done(count, error))
+
+    def _work(self):
+        "Sends requests until the feeder says there are no more"
+        while True:
+            task = self._tasks.get()
+            if task is None or self._stopped:
+                return
+            self._results.put(self.send(*task))
+
+    def send(self, index, request):
+        "Sends one request of the batch and returns its :class:`BatchResult`"
+        result = BatchResult(index, request)
+        start = time.time()
+        try:
+            result.response = self.api.request(request, self.deadline)
+        except Exception, exc:
+            result.error = exc
+        result.latency = time.time() - start
+        return result
+
+    def _start(self):
+        threads = [Thread(target=self._feed)] + [
+            Thread(target=self._work) for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def _completed(self):
+        """Yields the results as they complete and finally the :class:`_Done`
+        marker of the feeder.
+        """
+        done, received = None, 0
+        while done is None or received < done.count:
+            result = self._results.get()
+            if isinstance(result, _Done):
+                done = result
+                continue
+            received += 1
+            yield result
+        yield done
+
+    def _in_order(self, results):
+        "Reorders the results into the order of the input"
+        pending, next_index = {}, 0
+        for result in results:
+            if isinstance(result, _Done):
+                yield result
+                return
+            pending[result.index] = result
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+
+    def __iter__(self):
+        start = time.time()
+        latencies, errors = [], 0
+        self._start()
+        results = self._completed()
+        if self.ordered:
+            results = self._in_order(results)
+        try:
+            for result in results:
+                if isinstance(result, _Done):
+                    if result.error is not None:
+                        raise result.error
+                    break
+                latencies.append(result.latency)
+                errors += result.error is not None
+                yield result
+                self._slots.release()
+        finally:
+            self._stop()
+        self.stats = BatchStats(latencies, errors, time.time() - start)
+        self.api.logger.info("Batch finished: %s", self.stats)
+
+    def _stop(self):
+        "Lets the feeder and the workers go when iteration ends early"
+        self._stopped = True
+        for i in range(self.window + 1):
+            self._slots.release()
+
+
+class BatchMixin(object):
+    """Adds :meth:`request_many` to the API clients whose requests are safe
+    to send concurrently and in any order.
+    """
+
+    def request_many(self, requests, workers=8, ordered=True, deadline=None):
+        """Sends many requests on a bounded pool of worker threads.
+
+        Returns a :class:`Batch` which yields a :class:`BatchResult` for each
+        request. Once exhausted, its `stats` attribute holds the throughput
+        and the p50/p99 latency of the batch, which are also logged.
+
+        The connection pool of the client keeps at most `maxsize` idle
+        connections per host, so it should be at least as large as the
+        number of workers to avoid reconnecting.
+
+        :param requests: An iterable of request elements, as passed to
+            `request`
+        :param workers: Number of requests in flight at the same time
+        :param ordered: Yield the results in the order of the requests if
+            True, or as soon as they complete if False
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+            which the whole batch must be finished. Requests which are not
+            fail with :exc:`~ups.deadline.DeadlineExceeded`, without being
+            sent if the deadline has passed already.
+        """
+        return Batch(self, requests, workers, ordered, deadline=deadline)
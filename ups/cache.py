@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+    cache
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Response Caches
+    ~~~~~~~~~~~~~~~
+
+    Many UPS answers do not change for minutes (rates) or even days (address
+    validation), yet every call goes to UPS again. A cache given to an API
+    client answers repeated requests without any network I/O::
+
+        rates_cache = TTLCache(maxsize=10000, ttl=600)
+        rating_api = RatingService(
+            license_no, user_id, password, True, cache=rates_cache
+        )
+
+    Only the APIs which know how to derive a key from their request (see
+    `cache_key` of the API clients) make use of a cache. Errors are never
+    cached.
+
+    Answers which are effectively static, like address validations, can be
+    kept across restarts and shared by the processes of a host in a
+    :class:`SQLiteCache`::
+
+        address_api = AddressValidation(
+            license_no, user_id, password, True,
+            cache=SQLiteCache('/var/cache/ups/av.sqlite')
+        )
+
+    .. note::
+        A cache hit returns the very same response object every time, so it
+        should be treated as read-only.
+"""
+from __future__ import with_statement
+
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock, local
+from xml.sax.saxutils import escape
+
+from lxml import etree, objectify
+
+_QUOTE = {'"': '&quot;'}
+
+
+def canonical_form(element):
+    """Returns a string representation of the element which does not depend
+    on the order of its children. This makes requests built from the same
+    keyword arguments compare equal, whatever order the dictionary of
+    keyword arguments was iterated in. Texts and attribute values are
+    escaped, so that no text can pass for elements.
+
+    >>> from lxml.builder import E
+    >>> canonical_form(E.a(E.b('1'), E.c('2'))) == canonical_form(
+    ...     E.a(E.c('2'), E.b('1')))
+    True
+    >>> canonical_form(E.a(E.b('1'))) == canonical_form(E.a(E.b('2')))
+    False
+    >>> canonical_form(E.a('<b>1</b>')) == canonical_form(E.a(E.b('1')))
+    False
+    """
+    children = sorted(canonical_form(child) for child in element)
+    attributes = sorted(element.attrib.items())
+    return '<%s%s>%s%s</%s>' % (
+        element.tag,
+        ''.join(
+            ' %s="%s"' % (name, escape(value, _QUOTE))
+            for name, value in attributes
+        ),
+        escape((element.text or '').strip()),
+        ''.join(children),
+        element.tag,
+    )
+
+
+def canonical_key(*parts):
+    """Returns a digest of the given strings and elements, where elements are
+    represented by their :func:`canonical_form`.
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if not isinstance(part, basestring):
+            part = canonical_form(part)
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+class TTLCache(object):
+    """A thread safe in-memory cache whose entries expire after a time to
+    live, and which evicts the least recently used entries once it holds
+    :attr:`maxsize` of them.
+
+    :param maxsize: Maximum number of entries
+    :param ttl: Seconds an entry is served for
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+        #: Counters to help sizing the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        "Returns the value cached for the key, or None"
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires = entry
+            if expires <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # Move the entry to the most recently used end
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires=None):
+        """Caches the value for the key.
+
+        :param expires: Timestamp the entry expires at, if that is sooner
+            than after :attr:`ttl` seconds.
+        """
+        limit = time.time() + self.ttl
+        expires = limit if expires is None else min(expires, limit)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set_many(self, items, expires=None):
+        "Caches many (key, value) pairs at once"
+        for key, value in items:
+            self.set(key, value, expires)
+
+    def delete(self, key):
+        "Removes the entry of the key, if any"
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        "Removes all entries, the counters are kept"
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        "Returns the counters and the size of the cache as a dictionary"
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class SQLiteCache(object):
+    """A persistent cache stored in a SQLite database file, meant for answers
+    which hardly ever change, like address validations. The database runs in
+    WAL mode, so the worker processes of a host can share one file and read
+    it concurrently. Entries survive restarts, which makes cold starts after
+    a deploy almost free.
+
+    Cached values are the parsed responses, which are stored as XML and
+    parsed again when they are read.
+
+    :param path: Path of the database file, created if it does not exist
+    :param ttl: Seconds an entry is served for, 30 days by default
+    :param timeout: Seconds to wait for a lock held by another process
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, timeout=10):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+        self._setup(self._connection())
+
+    def _connection(self):
+        "Returns the connection of the current thread"
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Connections are only ever used by their own thread, but are
+            # closed by whichever thread calls close()
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            connection.text_factory = str
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _setup(self, connection):
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'expires REAL NOT NULL)'
+            )
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM cache WHERE expires > ?', (time.time(), )
+        ).fetchone()[0]
+
+    def get(self, key):
+        "Returns the value cached for the key, or None"
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache WHERE key = ?', (key, )
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+        return objectify.fromstring(str(row[0]))
+
+    def _row(self, key, value, expires):
+        if not isinstance(value, basestring):
+            value = etree.tostring(value)
+        limit = time.time() + self.ttl
+        expires = limit if expires is None else min(expires, limit)
+        return key, sqlite3.Binary(value), expires
+
+    def set(self, key, value, expires=None):
+        """Caches the value for the key.
+
+        :param value: A response element or its XML
+        :param expires: Timestamp the entry expires at, if that is sooner
+            than after :attr:`ttl` seconds.
+        """
+        self.set_many([(key, value)], expires)
+
+    def set_many(self, items, expires=None):
+        """Caches many (key, value) pairs at once in a single transaction,
+        which is the fast way to preload the cache.
+        """
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                (self._row(key, value, expires) for key, value in items)
+            )
+
+    def delete(self, key):
+        "Removes the entry of the key, if any"
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key, ))
+
+    def purge(self):
+        "Removes the expired entries and returns how many there were"
+        connection = self._connection()
+        with connection:
+            return connection.execute(
+                'DELETE FROM cache WHERE expires <= ?', (time.time(), )
+            ).rowcount
+
+    def clear(self):
+        "Removes all entries, the counters are kept"
+        connection = self._connection()
+        with connection:
+            connection.execute('DELETE FROM cache')
+
+    def stats(self):
+        "Returns the counters and the size of the cache as a dictionary"
+        size = len(self)
+        with self._lock:
+            return {
+                'size': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+            }
+
+    def close(self):
+        "Closes the database connections of all threads"
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = local()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+    cassette
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Record and Replay
+    ~~~~~~~~~~~~~~~~~
+
+    Tests which talk to the sandbox of UPS are slow, fail whenever the
+    sandbox does, and need credentials. A :class:`Cassette` is a
+    :class:`~ups.transport.Transport` which records the responses of UPS
+    once, and replays them later without any network I/O::
+
+        cassette = Cassette('rating.cassette', mode=RECORD)
+        rating_api = RatingService(
+            license_no, user_id, password, True, transport=cassette
+        )
+
+    Responses are recorded under the fingerprint of their request, which is
+    the endpoint and the :func:`~ups.cache.canonical_form` of the request
+    document without its credentials and without volatile fields like the
+    pickup date. Replaying hence works with other credentials, or none, and
+    on another day.
+
+    The credentials are never written to the cassette: the access request
+    and the account numbers are redacted from both requests and responses.
+
+    A cassette is a SQLite database file with compressed documents. Replay
+    reads all of it into memory once, so even benchmark loops of thousands
+    of requests are answered from it in no time.
+"""
+from __future__ import with_statement
+
+import os
+import re
+import sqlite3
+import urllib2
+import zlib
+from StringIO import StringIO
+from threading import Lock
+
+from lxml import etree
+
+from async_pool import Future
+from base import PyUPSException
+from cache import canonical_key
+from single_flight import fingerprint
+from transport import PoolTransport, Transport
+
+
+#: Records every response, replacing what was recorded for the request
+RECORD = 'record'
+#: Replays what was recorded, requests which were not fail
+REPLAY = 'replay'
+#: Replays what was recorded, and records what was not
+ONCE = 'once'
+
+#: Elements whose text is a credential, redacted from the cassette
+CREDENTIALS = frozenset([
+    'AccessLicenseNumber', 'UserId', 'Password', 'ShipperNumber',
+    'AccountNumber',
+])
+
+#: Elements whose text changes between runs, left out of the fingerprint
+VOLATILE = frozenset(['PickupDate', 'CustomerContext'])
+
+#: Text the credentials are replaced with
+REDACTED = 'REDACTED'
+
+_credentials = re.compile(
+    r'<(%s)>[^<]*</\1>' % '|'.join(sorted(CREDENTIALS))
+)
+
+
+class CassetteMiss(PyUPSException):
+    "Raised in replay mode for a request which was not recorded"
+
+
+def redact(xml):
+    """Returns the XML with the text of the :data:`CREDENTIALS` replaced
+
+    >>> redact('<UserId>me</UserId><Weight>2</Weight>')
+    '<UserId>REDACTED</UserId><Weight>2</Weight>'
+    """
+    return _credentials.sub(r'<\1>%s</\1>' % REDACTED, xml)
+
+
+class Cassette(Transport):
+    """Records responses to, and replays them from, a file, see
+    :mod:`ups.cassette`
+
+    :param path: Path of the cassette file, created if it does not exist,
+        unless the cassette only replays
+    :param mode: :data:`RECORD`, :data:`REPLAY` or :data:`ONCE`
+    :param transport: The :class:`~ups.transport.Transport` responses are
+        recorded from, which sends to UPS over connection pools by default
+    :param volatile: Elements left out of the fingerprint of a request
+    """
+
+    def __init__(self, path, mode=ONCE, transport=None, volatile=VOLATILE):
+        if mode not in (RECORD, REPLAY, ONCE):
+            raise ValueError('Unknown mode %s' % mode)
+        self.path = path
+        self.mode = mode
+        self.volatile = frozenset(volatile) | CREDENTIALS
+        self._transport = transport
+
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self._keys = {}
+        self._lock = Lock()
+        self._connection = None
+        self._responses = {}
+        # Replaying a cassette which was never recorded answers nothing, and
+        # leaves no file behind
+        if mode != REPLAY or os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        "Opens the cassette file and reads its responses into memory"
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False
+        )
+        self._connection.text_factory = str
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cassette ('
+                'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, '
+                'request BLOB NOT NULL, status INTEGER NOT NULL, '
+                'body BLOB NOT NULL)'
+            )
+        self._responses = dict(
+            (key, (status, zlib.decompress(body)))
+            for key, status, body in self._connection.execute(
+                'SELECT key, status, body FROM cassette'
+            )
+        )
+
+    def __len__(self):
+        return len(self._responses)
+
+    @property
+    def transport(self):
+        "The :class:`~ups.transport.Transport` responses are recorded from"
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = PoolTransport()
+        return self._transport
+
+    @property
+    def timeout(self):
+        return self.transport.timeout
+
+    @property
+    def loop(self):
+        return self.transport.loop
+
+    def key(self, url, data):
+        """Returns the fingerprint of the request the response is recorded
+        under, see :mod:`ups.cassette`
+        """
+        raw = fingerprint(url, data)
+        key = self._keys.get(raw)
+        if key is None:
+            document = etree.fromstring(data[max(0, data.rfind('<?xml')):])
+            for element in document.iter(*self.volatile):
+                element.text = None
+            key = canonical_key(url.rsplit('/', 1)[-1], document)
+            if len(self._keys) > 10000:
+                self._keys.clear()
+            self._keys[raw] = key
+        return key
+
+    def _replay(self, url, key, sink=None):
+        "Returns the recorded body, raising the recorded HTTP error if any"
+        status, body = self._responses[key]
+        with self._lock:
+            self.hits += 1
+        return _answer(url, status, body, sink)
+
+    def _recording(self, key):
+        "Returns True if the request must be sent, and not replayed"
+        if self.mode == RECORD or (
+                self.mode == ONCE and key not in self._responses):
+            return True
+        if key not in self._responses:
+            with self._lock:
+                self.misses += 1
+            raise CassetteMiss('No response recorded for %s' % key, None, None)
+        return False
+
+    def record(self, key, url, data, status, body):
+        "Records the response to the request"
+        body = redact(body)
+        with self._lock:
+            self._responses[key] = status, body
+            self.recorded += 1
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO cassette '
+                    '(key, endpoint, request, status, body) '
+                    'VALUES (?, ?, ?, ?, ?)', (
+                        key, url.rsplit('/', 1)[-1],
+                        sqlite3.Binary(zlib.compress(redact(data))), status,
+                        sqlite3.Binary(zlib.compress(body)),
+                    )
+                )
+
+    def urlopen(self, url, data, headers=None, timeout=None, sink=None,
+                deadline=None):
+        """Replays the response to the request, or sends the request and
+        records its response, depending on the :attr:`mode`
+        """
+        key = self.key(url, data)
+        if not self._recording(key):
+            return self._replay(url, key, sink)
+        try:
+            status, body = 200, self.transport.urlopen(
+                url, data, headers, timeout, deadline=deadline
+            )
+        except urllib2.HTTPError, exc:
+            status, body = exc.code, exc.read()
+        self.record(key, url, data, status, body)
+        return _answer(url, status, body, sink)
+
+    def urlopen_async(self, url, data, headers=None, timeout=None):
+        "Non-blocking counterpart of :meth:`urlopen`"
+        future = Future()
+        key = self.key(url, data)
+        if not self._recording(key):
+            _resolve(future, self._replay, url, key)
+            return future
+
+        def recorded(sent):
+            if sent.cancelled():
+                return future.cancel()
+            exc = sent.exception()
+            if isinstance(exc, urllib2.HTTPError):
+                status, body = exc.code, exc.read()
+            elif exc is None:
+                status, body = 200, sent.result()
+            else:
+                return future.set_exception(exc)
+            self.record(key, url, data, status, body)
+            _resolve(future, _answer, url, status, body)
+
+        self.transport.urlopen_async(
+            url, data, headers, timeout
+        ).add_done_callback(recorded)
+        return future
+
+    def close(self):
+        "Closes the cassette file and the transport"
+        if self._connection is not None:
+            self._connection.close()
+        if self._transport is not None:
+            self._transport.close()
+
+
+def _answer(url, status, body, sink=None):
+    """Returns the body, or passes it on to the sink, and raises the HTTP
+    error of the status if it is one
+    """
+    if status >= 400:
+        raise urllib2.HTTPError(url, status, body, {}, StringIO(body))
+    if sink is None:
+        return body
+    sink(body)
+
+
+def _resolve(future, function, *args):
+    "Resolves the future with what the function returns or raises"
+    try:
+        future.set_result(function(*args))
+    except Exception, exc:
+        future.set_exception(exc)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
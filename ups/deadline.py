@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    deadline
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Deadlines
+    ~~~~~~~~~
+
+    Every request waits for UPS as long as the `timeout` of the connection
+    pool, and a request which is retried even several times that. A check
+    out page which has to answer within a second cannot afford that, while a
+    nightly batch job can wait much longer. The `request` methods of all
+    APIs and :meth:`~ups.batch.BatchMixin.request_many` hence take a
+    `deadline`: the seconds the call may take at most, or a
+    :class:`Deadline` shared by several calls::
+
+        deadline = Deadline(0.8)
+        address_api.request(address_request, deadline=deadline)
+        rates = rating_api.request(rate_request, deadline=deadline)
+        transit = transit_api.request(transit_request, deadline=deadline)
+
+    The deadline covers everything the call does: waiting for the rate
+    limiter, connecting, sending, receiving and retrying. Every socket
+    operation is given at most what is left of it, down to every read of the
+    response, so a response which trickles in cannot stretch the call, and
+    retries which could not finish in time are not made. A call which runs
+    out of time fails with :exc:`DeadlineExceeded`, or with the
+    :exc:`~urllib2.URLError` of the socket operation which timed out. The
+    former is a kind of the latter, so catching :exc:`~urllib2.URLError`
+    catches both.
+
+    Identical requests coalesced by a :class:`~ups.single_flight.SingleFlight`
+    share the call, and hence the deadline, of the first of them.
+"""
+import time
+import urllib2
+
+
+class DeadlineExceeded(urllib2.URLError):
+    "Raised for a call whose deadline passed before it could finish"
+
+    def __init__(self):
+        urllib2.URLError.__init__(self, 'Deadline exceeded')
+
+
+class Deadline(object):
+    """The time by which a call, or a number of calls, must be finished
+
+    >>> deadline = Deadline(10)
+    >>> 9 < deadline.remaining() <= 10
+    True
+    >>> deadline.timeout(2)
+    2
+    >>> Deadline(0).timeout(2)
+    Traceback (most recent call last):
+        ...
+    DeadlineExceeded: <urlopen error Deadline exceeded>
+
+    :param seconds: Seconds from now until the deadline
+    """
+
+    def __init__(self, seconds):
+        #: The deadline as of :func:`time.time`
+        self.expires = time.time() + seconds
+
+    @classmethod
+    def of(cls, deadline):
+        """Returns the deadline for the `deadline` argument of a call, which
+        may be seconds, a :class:`Deadline` or None for no deadline
+        """
+        if deadline is None or isinstance(deadline, Deadline):
+            return deadline
+        return cls(deadline)
+
+    def __repr__(self):
+        return '<Deadline in %.3fs>' % (self.expires - time.time())
+
+    def remaining(self):
+        "Returns the seconds left, which are negative once it has passed"
+        return self.expires - time.time()
+
+    def timeout(self, default=None):
+        """Returns the seconds left, or the default if that is less, for use
+        as a timeout. Raises :exc:`DeadlineExceeded` if it has passed.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        if default is not None and default < remaining:
+            return default
+        return remaining
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
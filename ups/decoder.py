@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+    decoder
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Typed Responses
+    ~~~~~~~~~~~~~~~
+
+    By default responses are parsed with :func:`lxml.objectify.fromstring`,
+    and the whole tree is kept for as long as the response is. With
+    `typed=True` the API clients read the fields most applications need
+    into plain result objects with `__slots__` instead, and let go of the
+    tree, labels included::
+
+        rating_api = RatingService(
+            license_no, user_id, password, True, typed=True
+        )
+        for rated_shipment in rating_api.request(rate_request):
+            print rated_shipment.service_code, rated_shipment.total_charges
+
+    ============================ ==============================================
+    API                          Typed response
+    ============================ ==============================================
+    :class:`RatingService`       A list of :class:`RatedShipment`
+    :class:`TimeInTransit`       A :class:`TransitResponse`
+    :class:`AddressValidation`   A list of :class:`AVResult`
+    :class:`ShipmentAccept`      A :class:`ShipmentResults`
+    ============================ ==============================================
+
+    Other APIs return objectified responses whatever the flag. Monetary
+    values and weights are floats, like the `pyval` of their objectified
+    elements, and fields missing from the response are None.
+
+    Parsing the response takes most of the time either way, so decoding it
+    is only a little faster than objectifying it and reading the same
+    fields, see `benchmarks/decoder.py`.
+"""
+import base64
+from datetime import date
+
+from lxml import etree
+
+from base import PyUPSException
+
+
+#: The parser all responses are parsed with. Labels can make a ShipAccept
+#: response larger than what lxml accepts by default.
+parser = etree.XMLParser(
+    remove_blank_text=True, resolve_entities=False, huge_tree=True
+)
+
+
+def _date(value):
+    "Parses a YYYY-MM-DD date, much faster than strptime does"
+    year, month, day = value.split('-')
+    return date(int(year), int(month), int(day))
+
+
+def compile_fields(fields):
+    """Returns the tree of the paths of the fields, as walked by :func:`walk`
+
+    >>> tree = compile_fields([
+    ...     ('code', 'Service/Code', None), ('days', 'Days', int)])
+    >>> tree['Service']
+    {'Code': ('code', None)}
+    >>> tree['Days']
+    ('days', <type 'int'>)
+
+    :param fields: (attribute, path, convert) triples, where convert turns
+        the text of the element into the value of the attribute, or is None
+        to keep the text.
+    """
+    tree = {}
+    for name, path, convert in fields:
+        tags = path.split('/')
+        node = tree
+        for tag in tags[:-1]:
+            node = node.setdefault(tag, {})
+        node[tags[-1]] = (name, convert)
+    return tree
+
+
+def walk(element, tree, values):
+    """Collects the converted texts of the fields of the tree into values.
+    Only the branches of the element which hold a field are descended into,
+    and every element is visited at most once, however many fields there
+    are.
+
+    >>> from lxml.builder import E
+    >>> values = walk(
+    ...     E.R(E.Service(E.Code('03')), E.Days('2'), E.Package('...')),
+    ...     compile_fields([('code', 'Service/Code', None),
+    ...                     ('days', 'Days', int)]), {})
+    >>> sorted(values.items())
+    [('code', '03'), ('days', 2)]
+    """
+    # Looking the tag of every child up is faster than having lxml filter
+    # the children by tag, whose matcher is built again for each call.
+    # Iterating an objectified element would yield its siblings instead.
+    for child in element.iterchildren():
+        node = tree.get(child.tag)
+        if node is None:
+            continue
+        if node.__class__ is tuple:
+            text = child.text
+            if text is not None:
+                name, convert = node
+                values[name] = text if convert is None else convert(text)
+        else:
+            walk(child, node, values)
+    return values
+
+
+class Result(object):
+    """Base of the typed results. Results are plain, compact objects with a
+    fixed set of attributes, which compare equal if all attributes do.
+    """
+
+    __slots__ = ()
+
+    #: (attribute, path, convert) triples of the fields, see
+    #: :func:`compile_fields`
+    fields = ()
+    _tree = {}
+
+    @classmethod
+    def from_values(cls, values):
+        "Returns a result with the attributes given in the dictionary"
+        self = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(self, name, values.get(name))
+        return self
+
+    @classmethod
+    def from_element(cls, element):
+        "Returns the result for the element"
+        return cls.from_values(walk(element, cls._tree, {}))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, ' '.join(
+            '%s=%r' % (name, getattr(self, name))
+            for name in self.__slots__
+        ))
+
+
+class RatedShipment(Result):
+    "A rated service of a rate (or shop) response"
+
+    __slots__ = (
+        'service_code', 'currency_code', 'total_charges',
+        'transportation_charges', 'service_options_charges',
+        'negotiated_total', 'billing_weight', 'billing_weight_unit',
+        'guaranteed_days_to_delivery', 'scheduled_delivery_time', 'warnings',
+    )
+
+    fields = (
+        ('service_code', 'Service/Code', None),
+        ('currency_code', 'TotalCharges/CurrencyCode', None),
+        ('total_charges', 'TotalCharges/MonetaryValue', float),
+        ('transportation_charges', 'TransportationCharges/MonetaryValue',
+         float),
+        ('service_options_charges', 'ServiceOptionsCharges/MonetaryValue',
+         float),
+        ('negotiated_total',
+         'NegotiatedRates/NetSummaryCharges/GrandTotal/MonetaryValue',
+         float),
+        ('billing_weight', 'BillingWeight/Weight', float),
+        ('billing_weight_unit', 'BillingWeight/UnitOfMeasurement/Code', None),
+        ('guaranteed_days_to_delivery', 'GuaranteedDaysToDelivery', int),
+        ('scheduled_delivery_time', 'ScheduledDeliveryTime', None),
+    )
+    _tree = compile_fields(fields)
+
+    @classmethod
+    def from_element(cls, element):
+        "Returns the result for a RatedShipment element"
+        self = super(RatedShipment, cls).from_element(element)
+        self.warnings = [
+            warning.text
+            for warning in element.iterchildren('RatedShipmentWarning')
+        ]
+        return self
+
+
+class TransitService(Result):
+    "A service of a time in transit response, with its estimated arrival"
+
+    __slots__ = (
+        'service_code', 'description', 'guaranteed', 'business_transit_days',
+        'arrival_date', 'arrival_time', 'day_of_week',
+    )
+
+    fields = (
+        ('service_code', 'Service/Code', None),
+        ('description', 'Service/Description', None),
+        ('guaranteed', 'Guaranteed/Code', lambda code: code == 'Y'),
+        ('business_transit_days', 'EstimatedArrival/BusinessTransitDays',
+         int),
+        ('arrival_date', 'EstimatedArrival/Date', _date),
+        ('arrival_time', 'EstimatedArrival/Time', None),
+        ('day_of_week', 'EstimatedArrival/DayOfWeek', None),
+    )
+    _tree = compile_fields(fields)
+
+
+class TransitResponse(Result):
+    "The services available for a shipment and when they arrive"
+
+    __slots__ = ('pickup_date', 'disclaimer', 'services')
+
+    fields = (
+        ('pickup_date', 'PickupDate', _date),
+        ('disclaimer', 'Disclaimer', None),
+    )
+    _tree = compile_fields(fields)
+
+    @classmethod
+    def from_element(cls, element):
+        "Returns the result for a TransitResponse element"
+        self = super(TransitResponse, cls).from_element(element)
+        self.services = [
+            TransitService.from_element(service)
+            for service in element.iterchildren('ServiceSummary')
+        ]
+        return self
+
+
+class AVResult(Result):
+    "A candidate of an address validation response"
+
+    __slots__ = (
+        'rank', 'quality', 'city', 'state_province_code',
+        'postal_code_low', 'postal_code_high',
+    )
+
+    fields = (
+        ('rank', 'Rank', int),
+        ('quality', 'Quality', float),
+        ('city', 'Address/City', None),
+        ('state_province_code', 'Address/StateProvinceCode', None),
+        ('postal_code_low', 'PostalCodeLowEnd', None),
+        ('postal_code_high', 'PostalCodeHighEnd', None),
+    )
+    _tree = compile_fields(fields)
+
+
+class PackageResults(Result):
+    "A package of an accepted shipment, with its label"
+
+    __slots__ = (
+        'tracking_number', 'label_format', 'graphic_image', 'html_image',
+    )
+
+    fields = (
+        ('tracking_number', 'TrackingNumber', None),
+        ('label_format', 'LabelImage/LabelImageFormat/Code', None),
+        ('graphic_image', 'LabelImage/GraphicImage', None),
+        ('html_image', 'LabelImage/HTMLImage', None),
+    )
+    _tree = compile_fields(fields)
+
+    def label(self):
+        "Returns the decoded label image, or None if there is none"
+        if self.graphic_image is not None:
+            return base64.b64decode(self.graphic_image)
+
+
+class ShipmentResults(Result):
+    "The charges and packages of an accepted shipment"
+
+    __slots__ = (
+        'identification_number', 'currency_code', 'total_charges',
+        'transportation_charges', 'service_options_charges',
+        'negotiated_total', 'billing_weight', 'billing_weight_unit',
+        'packages',
+    )
+
+    fields = (
+        ('identification_number', 'ShipmentIdentificationNumber', None),
+        ('currency_code', 'ShipmentCharges/TotalCharges/CurrencyCode', None),
+        ('total_charges', 'ShipmentCharges/TotalCharges/MonetaryValue',
+         float),
+        ('transportation_charges',
+         'ShipmentCharges/TransportationCharges/MonetaryValue', float),
+        ('service_options_charges',
+         'ShipmentCharges/ServiceOptionsCharges/MonetaryValue', float),
+        ('negotiated_total',
+         'NegotiatedRates/NetSummaryCharges/GrandTotal/MonetaryValue',
+         float),
+        ('billing_weight', 'BillingWeight/Weight', float),
+        ('billing_weight_unit', 'BillingWeight/UnitOfMeasurement/Code', None),
+    )
+    _tree = compile_fields(fields)
+
+    @classmethod
+    def from_element(cls, element):
+        "Returns the result for a ShipmentResults element"
+        self = super(ShipmentResults, cls).from_element(element)
+        self.packages = [
+            PackageResults.from_element(package)
+            for package in element.iterchildren('PackageResults')
+        ]
+        return self
+
+
+_error = etree.XPath('Response/Error[1]')
+_error_fields = compile_fields([
+    ('severity', 'ErrorSeverity', None),
+    ('code', 'ErrorCode', None),
+    ('description', 'ErrorDescription', None),
+])
+
+
+def parse(xml, request=None):
+    """Parses the response and raises the error it contains, if any, just
+    like :meth:`~ups.base.BaseAPIClient.look_for_error` does for objectified
+    responses. Returns the root element.
+
+    >>> parse('<Response/>').tag
+    'Response'
+    >>> parse('''<R><Response><Error>
+    ...     <ErrorSeverity>Hard</ErrorSeverity><ErrorCode>10002</ErrorCode>
+    ...     <ErrorDescription>Invalid</ErrorDescription>
+    ... </Error></Response></R>''')
+    Traceback (most recent call last):
+        ...
+    PyUPSException: ('Hard-10002:Invalid', None, <Element R at 0x...>)
+    """
+    root = etree.fromstring(xml, parser)
+    errors = _error(root)
+    if errors:
+        error = walk(errors[0], _error_fields, {})
+        if error.get('severity') != 'Warning':
+            raise PyUPSException("%s-%s:%s" % (
+                error.get('severity'), error.get('code'),
+                error.get('description'),
+            ), request, root)
+    return root
+
+
+def decode_rate(xml, request=None):
+    "Returns the list of :class:`RatedShipment` of a rate response"
+    return [
+        RatedShipment.from_element(element)
+        for element in parse(xml, request).iterchildren('RatedShipment')
+    ]
+
+
+def decode_time_in_transit(xml, request=None):
+    "Returns the :class:`TransitResponse` of a time in transit response"
+    element = parse(xml, request).find('TransitResponse')
+    return TransitResponse.from_element(element) \
+        if element is not None else None
+
+
+def decode_address_validation(xml, request=None):
+    "Returns the list of :class:`AVResult` of an address validation response"
+    return [
+        AVResult.from_element(element)
+        for element in parse(xml, request).iterchildren(
+            'AddressValidationResult'
+        )
+    ]
+
+
+def decode_shipment_accept(xml, request=None):
+    "Returns the :class:`ShipmentResults` of a shipment accept response"
+    element = parse(xml, request).find('ShipmentResults')
+    return ShipmentResults.from_element(element) \
+        if element is not None else None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
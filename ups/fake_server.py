@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+    fake_server
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Fake UPS
+    ~~~~~~~~
+
+    Benchmarks and load tests cannot be run against the sandbox of UPS:
+    it needs credentials, it is slow, and it would not take the load anyway.
+    :class:`FakeUPS` answers the requests of all six APIs, Rate, AV,
+    TimeInTransit, ShipConfirm, ShipAccept and Void, with responses shaped
+    like those of UPS and built from the request, e.g. a label for every
+    package of a confirmed shipment.
+
+    It is a :class:`~ups.transport.Transport`, which answers in-process
+    without any sockets. That leaves building, serializing and parsing of
+    the documents to measure::
+
+        fake = FakeUPS()
+        rating_api = RatingService(
+            'license', 'user', 'password', True, transport=fake
+        )
+
+    :class:`FakeUPSServer` serves it over HTTP instead, to load test the
+    whole stack, connection pools included::
+
+        server = FakeUPSServer(FakeUPS(Rate=Profile(latency=0.2))).start()
+        rating_api = RatingService('license', 'user', 'password', True)
+        rating_api.base_url = server.base_url
+
+    How each endpoint behaves is set by its :class:`Profile`: the
+    distribution of its latency, the rates of UPS and HTTP errors, and the
+    size of its responses.
+"""
+from __future__ import with_statement
+
+import base64
+import itertools
+import math
+import random
+import socket
+import time
+import urllib2
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import date, timedelta
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from threading import Lock, Thread
+
+from lxml import etree
+from lxml.builder import E
+
+from async_pool import Future, get_event_loop
+from transport import Transport
+
+
+#: Names of the endpoints, the last part of their URL
+ENDPOINTS = (
+    'Rate', 'AV', 'TimeInTransit', 'ShipConfirm', 'ShipAccept', 'Void',
+)
+
+#: Root element of the response of each endpoint
+RESPONSE_TAGS = {
+    'Rate': 'RatingServiceSelectionResponse',
+    'AV': 'AddressValidationResponse',
+    'TimeInTransit': 'TimeInTransitResponse',
+    'ShipConfirm': 'ShipmentConfirmResponse',
+    'ShipAccept': 'ShipmentAcceptResponse',
+    'Void': 'VoidShipmentResponse',
+}
+
+#: Services rated by a Shop request, and listed by TimeInTransit
+SERVICES = [
+    ('01', 'UPS Next Day Air'), ('02', 'UPS Second Day Air'),
+    ('03', 'UPS Ground'), ('07', 'UPS Worldwide Express'),
+    ('08', 'UPS Worldwide Expedited'), ('11', 'UPS Standard'),
+    ('12', 'UPS Three-Day Select'), ('13', 'UPS Next Day Air Saver'),
+    ('14', 'UPS Next Day Air Early A.M.'), ('54', 'UPS Worldwide Express Plus'),
+    ('59', 'UPS Second Day Air A.M.'), ('65', 'UPS Saver'),
+]
+
+#: The error of an UPS error response, see :attr:`Profile.error`
+GENERAL_FAILURE = ('Transient', '20001', 'General process failure')
+AUTHENTICATION_FAILURE = (
+    'Hard', '250002', 'Invalid Authentication Information.'
+)
+INVALID_DIGEST = ('Hard', '128001', 'Invalid shipment digest.')
+MISSING_PACKAGE = ('Hard', '121210', 'Missing or invalid package.')
+
+DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+
+
+class RequestError(Exception):
+    """Raised by the builders of :class:`FakeUPS` for a request which UPS
+    answers with the :attr:`error`
+    """
+    error = GENERAL_FAILURE
+
+
+class InvalidDigest(RequestError):
+    "Raised for the digest of a shipment which was not confirmed"
+    error = INVALID_DIGEST
+
+
+class MissingPackage(RequestError):
+    "Raised for a shipment without packages"
+    error = MISSING_PACKAGE
+
+
+def constant(seconds):
+    "Latency distribution which always takes the given seconds"
+    return lambda rng: seconds
+
+
+def uniform(low, high):
+    "Latency distribution uniform between low and high seconds"
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential(mean):
+    "Latency distribution exponential with the given mean in seconds"
+    return lambda rng: rng.expovariate(1.0 / mean)
+
+
+def lognormal(median, sigma=0.5):
+    """Latency distribution log-normal with the given median in seconds.
+    Its long tail resembles the latency of real services best.
+    """
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class Profile(object):
+    """How an endpoint of :class:`FakeUPS` behaves
+
+    :param latency: Seconds a response takes, or a distribution like
+        :func:`lognormal` to draw them from
+    :param error_rate: Fraction of the requests answered with an UPS error
+    :param http_error_rate: Fraction of the requests answered with a HTTP
+        503 status
+    :param error: Severity, code and description of the UPS errors
+    :param size: Size of the responses, which means the number of rated
+        services for Rate, candidates for AV, services for TimeInTransit,
+        bytes of the digest for ShipConfirm and bytes of each label for
+        ShipAccept. Defaults to what UPS typically answers.
+    """
+
+    def __init__(self, latency=0, error_rate=0, http_error_rate=0,
+                 error=GENERAL_FAILURE, size=None):
+        if not callable(latency):
+            latency = constant(latency)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.error = error
+        self.size = size
+
+
+class FakeUPS(Transport):
+    """Answers the requests of the APIs like UPS, see :mod:`ups.fake_server`
+
+    >>> from ups.rating_package import RatingService
+    >>> api = RatingService('license', 'user', 'password', False,
+    ...     transport=FakeUPS(seed=1))
+    >>> response = api.request(RatingService.rating_request_type(
+    ...     RatingService.ship_to_type(CompanyName='Apple')))
+    >>> len(response.RatedShipment)
+    12
+    >>> api.transport.answered
+    1
+
+    :param profile: The :class:`Profile` of the endpoints which are not
+        given one of their own
+    :param seed: Seed of the random numbers, for repeatable runs
+    :param profiles: The :class:`Profile` of an endpoint by its name, e.g.
+        `ShipAccept=Profile(latency=0.5)`
+    """
+
+    def __init__(self, profile=None, seed=None, timeout=10, **profiles):
+        unknown = set(profiles) - set(ENDPOINTS)
+        if unknown:
+            raise ValueError('Unknown endpoints %s' % ', '.join(unknown))
+        profile = profile or Profile()
+        self.profiles = dict(
+            (endpoint, profiles.get(endpoint, profile))
+            for endpoint in ENDPOINTS
+        )
+        self.timeout = timeout
+        self.random = random.Random(seed)
+
+        #: Number of requests answered
+        self.answered = 0
+        self._numbers = itertools.count(1)
+        self._labels = {}
+        self._lock = Lock()
+
+    @property
+    def loop(self):
+        return get_event_loop()
+
+    def respond(self, endpoint, data):
+        """Returns the latency, the HTTP status and the body of the response
+        to a request to the endpoint, without waiting for the latency
+        """
+        profile = self.profiles.get(endpoint)
+        if profile is None:
+            return 0, 404, 'Not Found'
+        with self._lock:
+            self.answered += 1
+        latency = profile.latency(self.random)
+        if self.random.random() < profile.http_error_rate:
+            return latency, 503, 'Service Unavailable'
+
+        split = data.rfind('<?xml')
+        if split <= 0 or '<AccessLicenseNumber>' not in data[:split]:
+            error = AUTHENTICATION_FAILURE
+        elif self.random.random() < profile.error_rate:
+            error = profile.error
+        else:
+            request = etree.fromstring(data[split:])
+            try:
+                return latency, 200, self.build(endpoint, request, profile)
+            except RequestError, exc:
+                error = exc.error
+        return latency, 200, etree.tostring(self.error_response(
+            RESPONSE_TAGS[endpoint], error
+        ))
+
+    def build(self, endpoint, request, profile):
+        "Returns the serialized response to the parsed request"
+        response = getattr(self, 'build_' + endpoint.lower())(
+            request, profile.size
+        )
+        return etree.tostring(response, encoding='UTF-8', xml_declaration=True)
+
+    def urlopen(self, url, data, headers=None, timeout=None, sink=None,
+                deadline=None):
+        """Answers the request after its latency, see
+        :meth:`ups.pool.ConnectionPool.urlopen`
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if deadline is not None:
+            timeout = deadline.timeout(timeout)
+        latency, status, body = self.respond(url.rsplit('/', 1)[-1], data)
+        if latency > timeout:
+            time.sleep(timeout)
+            raise urllib2.URLError(socket.timeout('timed out'))
+        time.sleep(latency)
+        if status >= 400:
+            raise urllib2.HTTPError(url, status, body, {}, StringIO(body))
+        if sink is None:
+            return body
+        for start in xrange(0, len(body), 64 * 1024):
+            sink(body[start:start + 64 * 1024])
+
+    def urlopen_async(self, url, data, headers=None, timeout=None):
+        """Answers the request after its latency by a timer of the
+        :attr:`loop`, see :meth:`ups.async_pool.AsyncConnectionPool.urlopen`
+        """
+        if timeout is None:
+            timeout = self.timeout
+        future = Future()
+        latency, status, body = self.respond(url.rsplit('/', 1)[-1], data)
+
+        def answer():
+            if latency > timeout:
+                future.set_exception(
+                    urllib2.URLError(socket.timeout('timed out'))
+                )
+            elif status >= 400:
+                future.set_exception(urllib2.HTTPError(
+                    url, status, body, {}, StringIO(body)
+                ))
+            else:
+                future.set_result(body)
+
+        self.loop.call_soon_threadsafe(
+            self.loop.call_later, min(latency, timeout), answer
+        )
+        return future
+
+    def tracking_number(self):
+        "Returns a tracking number which was not used before"
+        return '1Z999AA1%010d' % next(self._numbers)
+
+    def label(self, size):
+        "Returns a base64 encoded label image of the given size"
+        label = self._labels.get(size)
+        if label is None:
+            image = 'GIF89a' + ''.join(
+                chr(self.random.randint(0, 255)) for i in xrange(size - 6)
+            )
+            label = self._labels[size] = base64.b64encode(image)
+        return label
+
+    def _charges(self, tag, value, currency='USD'):
+        return E(tag, E.CurrencyCode(currency), E.MonetaryValue(
+            '%.2f' % value
+        ))
+
+    def _billing_weight(self, weight):
+        return E.BillingWeight(
+            E.UnitOfMeasurement(E.Code('LBS')), E.Weight('%.1f' % weight)
+        )
+
+    def _response(self, tag, request, *elements):
+        "Returns the response element, telling that the request succeeded"
+        return E(tag, E.Response(
+            E.TransactionReference(E.CustomerContext(
+                request.findtext('Request/TransactionReference/'
+                                 'CustomerContext') or 'unspecified'
+            )),
+            E.ResponseStatusCode('1'),
+            E.ResponseStatusDescription('Success'),
+        ), *elements)
+
+    def error_response(self, tag, error):
+        "Returns the response element for the error of :class:`Profile`"
+        severity, code, description = error
+        return E(tag, E.Response(
+            E.TransactionReference(E.CustomerContext('unspecified')),
+            E.ResponseStatusCode('0'),
+            E.ResponseStatusDescription('Failure'),
+            E.Error(
+                E.ErrorSeverity(severity),
+                E.ErrorCode(code),
+                E.ErrorDescription(description),
+            ),
+        ))
+
+    def build_rate(self, request, size):
+        "RatingServiceSelectionResponse, a rate per service shopped"
+        if size is None:
+            shop = request.findtext('Request/RequestOption') == 'Shop'
+            size = shop and len(SERVICES) or 1
+        packages = len(request.findall('Shipment/Package')) or 1
+        rated = []
+        for index in xrange(size):
+            code = SERVICES[index % len(SERVICES)][0]
+            package = round(self.random.uniform(5, 50), 2)
+            total = package * packages
+            rated.append(E.RatedShipment(
+                E.Service(E.Code(code)),
+                E.RatedShipmentWarning(
+                    'Your invoice may vary from the displayed reference rates'
+                ),
+                self._billing_weight(packages),
+                self._charges('TransportationCharges', total),
+                self._charges('ServiceOptionsCharges', 0),
+                self._charges('TotalCharges', total),
+                E.GuaranteedDaysToDelivery(str(index % 5 + 1)),
+                E.ScheduledDeliveryTime('10:30 A.M.'),
+                *[E.RatedPackage(
+                    self._charges('TransportationCharges', package),
+                    self._charges('ServiceOptionsCharges', 0),
+                    self._charges('TotalCharges', package),
+                    E.Weight('1.0'),
+                    self._billing_weight(1),
+                ) for i in xrange(packages)]
+            ))
+        return self._response(
+            'RatingServiceSelectionResponse', request, *rated
+        )
+
+    def build_av(self, request, size):
+        """AddressValidationResponse, candidates for the address, or the
+        best one alone with a quality of 1.0 if it has the postal code of
+        the address
+        """
+        city = (request.findtext('Address/City') or 'MIAMI').upper()
+        state = request.findtext('Address/StateProvinceCode') or 'FL'
+        postal_code = request.findtext('Address/PostalCode')
+        exact = postal_code and '33101' <= postal_code <= '33103'
+        ranks = exact and [1] or xrange(1, (size or 3) + 1)
+        return self._response('AddressValidationResponse', request, *[
+            E.AddressValidationResult(
+                E.Rank(str(rank)),
+                E.Quality(exact and '1.0' or '%.4f' % (1 - rank / 40.0)),
+                E.Address(
+                    E.City(rank > 1 and '%s %d' % (city, rank) or city),
+                    E.StateProvinceCode(state),
+                ),
+                E.PostalCodeLowEnd('%05d' % (33100 + rank)),
+                E.PostalCodeHighEnd('%05d' % (33102 + rank)),
+            ) for rank in ranks
+        ])
+
+    def build_timeintransit(self, request, size):
+        "TimeInTransitResponse, the services with their estimated arrival"
+        pickup = request.findtext('PickupDate') or date.today().strftime(
+            '%Y%m%d'
+        )
+        pickup = date(int(pickup[:4]), int(pickup[4:6]), int(pickup[6:8]))
+        services = []
+        for index in xrange(size or 6):
+            code, description = SERVICES[index % len(SERVICES)]
+            arrival = pickup + timedelta(days=index % 5 + 1)
+            services.append(E.ServiceSummary(
+                E.Service(E.Code(code), E.Description(description)),
+                E.Guaranteed(E.Code(index < 3 and 'Y' or 'N')),
+                E.EstimatedArrival(
+                    E.BusinessTransitDays(str(index % 5 + 1)),
+                    E.Time('10:30:00'),
+                    E.PickupDate(pickup.isoformat()),
+                    E.PickupTime('17:30:00'),
+                    E.Date(arrival.isoformat()),
+                    E.DayOfWeek(DAYS[arrival.weekday()]),
+                ),
+            ))
+        return self._response('TimeInTransitResponse', request, E(
+            'TransitResponse',
+            E.PickupDate(pickup.isoformat()),
+            E.Disclaimer('Services listed as guaranteed are backed by a '
+                         'money-back guarantee for transportation charges '
+                         'only.'),
+            *services
+        ))
+
+    def _shipment_charges(self, packages):
+        total = 9.15 * packages
+        return E.ShipmentCharges(
+            self._charges('TransportationCharges', total),
+            self._charges('ServiceOptionsCharges', 0),
+            self._charges('TotalCharges', total),
+        )
+
+    def build_shipconfirm(self, request, size):
+        """ShipmentConfirmResponse, whose digest remembers the number of
+        packages and the identification number for ShipAccept. Raises
+        :exc:`MissingPackage` for a shipment without packages.
+        """
+        packages = len(request.findall('Shipment/Package'))
+        if not packages:
+            raise MissingPackage('No packages')
+        identification = self.tracking_number()
+        digest = '%d:%s:' % (packages, identification)
+        digest = base64.b64encode(
+            digest + 'X' * max(0, (size or 2048) * 3 / 4 - len(digest))
+        )
+        return self._response(
+            'ShipmentConfirmResponse', request,
+            self._shipment_charges(packages),
+            self._billing_weight(packages),
+            E.ShipmentIdentificationNumber(identification),
+            E.ShipmentDigest(digest),
+        )
+
+    def build_shipaccept(self, request, size):
+        """ShipmentAcceptResponse, a label for every package of the
+        confirmed shipment. Raises :exc:`InvalidDigest` for a digest
+        which was not confirmed.
+        """
+        try:
+            packages, identification, padding = base64.b64decode(
+                request.findtext('ShipmentDigest') or ''
+            ).split(':', 2)
+            packages = int(packages)
+        except (TypeError, ValueError):
+            raise InvalidDigest('Invalid digest')
+        label = self.label(size or 20000)
+        results = [E.PackageResults(
+            E.TrackingNumber(
+                index and self.tracking_number() or identification
+            ),
+            self._charges('ServiceOptionsCharges', 0),
+            E.LabelImage(
+                E.LabelImageFormat(E.Code('GIF')),
+                E.GraphicImage(label),
+            ),
+        ) for index in xrange(packages)]
+        return self._response(
+            'ShipmentAcceptResponse', request, E.ShipmentResults(
+                self._shipment_charges(packages),
+                self._billing_weight(packages),
+                E.ShipmentIdentificationNumber(identification),
+                *results
+            )
+        )
+
+    def build_void(self, request, size):
+        "VoidShipmentResponse, voiding every package asked for"
+        tracking_numbers = request.findall(
+            'ExpandedVoidShipment/TrackingNumber'
+        )
+        return self._response('VoidShipmentResponse', request, E.Status(
+            E.StatusType(E.Code('1'), E.Description('Success'))
+        ), *[E.PackageLevelResults(
+            E.TrackingNumber(tracking_number.text),
+            E.StatusCode(E.Code('1'), E.Description('Success')),
+        ) for tracking_number in tracking_numbers])
+
+
+class FakeUPSServer(object):
+    """Serves a :class:`FakeUPS` over HTTP/1.1 with keep-alive connections
+    from a background thread, see :mod:`ups.fake_server`
+
+    :param fake_ups: The :class:`FakeUPS` which answers the requests
+    :param host: Host to listen on
+    :param port: Port to listen on, any free port by default
+    """
+
+    def __init__(self, fake_ups=None, host='127.0.0.1', port=0):
+        self.fake_ups = fake_ups = fake_ups or FakeUPS()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers['Content-Length']))
+                latency, status, body = fake_ups.respond(
+                    self.path.rsplit('/', 1)[-1], data
+                )
+                time.sleep(latency)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            request_queue_size = 128
+
+        self.server = Server((host, port), Handler)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        "The base URL of the server"
+        return 'http://%s:%d' % self.server.server_address
+
+    @property
+    def base_url(self):
+        "The :attr:`~ups.base.BaseAPIClient.base_url` of clients to use it"
+        return {'sandbox': self.url, 'production': self.url}
+
+    def start(self):
+        "Starts serving in a background thread and returns the server"
+        thread = Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.01}
+        )
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        "Stops serving and closes the socket"
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+    hedging
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Hedged Requests
+    ~~~~~~~~~~~~~~~
+
+    Most requests to UPS are answered quickly, but now and then one gets
+    stuck on a slow backend and holds up the whole page. Requests which only
+    read, i.e. those of :class:`RatingService`, :class:`AddressValidation`
+    and :class:`TimeInTransit`, can simply be sent again. With a
+    :class:`HedgePolicy` given to these clients a second copy of a request
+    is sent over another connection if the first has not been answered
+    within a percentile of the recent latency of the endpoint. Whichever
+    answers first is used and the other one is cancelled::
+
+        hedge_policy = HedgePolicy(percentile=95)
+        rating_api = RatingService(
+            license_no, user_id, password, True, hedge_policy=hedge_policy
+        )
+
+    Hedges are paid from a budget shared by all clients using the policy:
+    every request adds a fraction of a hedge to it, up to a limit, and every
+    hedge takes a whole one. Hedging hence never adds more than that
+    fraction to the load on UPS, even if UPS is slow across the board.
+
+    A hedge is sent with what is left of the deadline of the call, if any,
+    so it never outlives the call it was sent for.
+
+    Requests of the other APIs, like ShipmentAccept and Void, are never
+    hedged since they change the state of a shipment.
+"""
+from __future__ import with_statement
+
+import time
+from collections import deque
+from threading import Lock
+
+from async_pool import Future
+from batch import percentile
+from deadline import DeadlineExceeded
+
+
+class HedgePolicy(object):
+    """Decides when requests are hedged, and keeps the recent latencies of
+    the endpoints and the hedge budget, see :mod:`ups.hedging`.
+
+    :param percentile: The percentile of the recent latencies after which a
+        request is hedged
+    :param min_samples: Requests are not hedged until the endpoint answered
+        this many
+    :param min_delay: Seconds a request is given at least before it is
+        hedged
+    :param budget: The fraction of a hedge each request adds to the budget
+    :param max_budget: Hedges the budget can save up
+    :param window: Number of recent latencies kept per endpoint
+    """
+
+    def __init__(self, percentile=95, min_samples=20, min_delay=0.01,
+                 budget=0.05, max_budget=10, window=500):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_budget = max_budget
+        self.window = window
+
+        #: Number of hedges sent
+        self.hedged = 0
+        self._tokens = float(max_budget)
+        self._latencies = {}
+        self._lock = Lock()
+
+    def record(self, url, latency):
+        "Records the seconds a request to the endpoint took to be answered"
+        latencies = self._latencies.get(url)
+        if latencies is None:
+            latencies = self._latencies.setdefault(
+                url, deque(maxlen=self.window)
+            )
+        latencies.append(latency)
+
+    def delay(self, url):
+        """Returns the seconds after which a request to the endpoint is
+        hedged, None if too few of its latencies are known yet
+        """
+        latencies = self._latencies.get(url)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        return max(
+            self.min_delay, percentile(sorted(latencies), self.percentile)
+        )
+
+    def _earn(self):
+        "Adds the share of a request to the budget"
+        with self._lock:
+            self._tokens = min(self.max_budget, self._tokens + self.budget)
+
+    def _spend(self):
+        "Takes a hedge from the budget, returns False if there is none left"
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def urlopen(self, pool, url, data, timeout=None, deadline=None):
+        """Sends the data over the :class:`~ups.async_pool.AsyncConnectionPool`
+        like its `urlopen` does, and hedges it if it is not answered in
+        time. Returns a :class:`~ups.async_pool.Future` for the body of the
+        first successful response, or the error of the last failed one.
+
+        :param timeout: Timeout of each copy, defaults to that of the pool
+        :param deadline: A :class:`~ups.deadline.Deadline` the request must
+            be answered by. Each copy is given at most what is left of it
+            when it is sent, and no hedge is sent once it has passed.
+        """
+        request = _HedgedRequest(self, pool, url, data, timeout, deadline)
+        timeout = request.remaining()
+        self._earn()
+        request.send(timeout)
+        delay = self.delay(url)
+        if delay is not None:
+            pool.loop.call_soon_threadsafe(
+                pool.loop.call_later, delay, request.hedge
+            )
+        return request.future
+
+
+class _HedgedRequest(object):
+    "A request and its hedge, if it was hedged"
+
+    def __init__(self, policy, pool, url, data, timeout=None, deadline=None):
+        self.policy = policy
+        self.pool = pool
+        self.url = url
+        self.data = data
+        self.timeout = timeout
+        self.deadline = deadline
+        self.attempts = []
+        self.future = Future()
+        self.future.add_done_callback(self.cancel)
+
+    def remaining(self):
+        """Returns the timeout of a copy sent now, which is at most what is
+        left of the deadline. Raises :exc:`~ups.deadline.DeadlineExceeded`
+        if it has passed.
+        """
+        if self.deadline is None:
+            return self.timeout
+        if self.timeout is None:
+            return self.deadline.timeout(self.pool.timeout)
+        return self.deadline.timeout(self.timeout)
+
+    def send(self, timeout):
+        "Sends a copy of the request"
+        start = time.time()
+        sent = self.pool.urlopen(self.url, self.data, timeout=timeout)
+        self.attempts.append(sent)
+        sent.add_done_callback(lambda sent: self.done(sent, start))
+
+    def hedge(self):
+        """Sends the hedge, unless the request is done, its deadline passed
+        or there is no budget
+        """
+        if self.future.done():
+            return
+        try:
+            timeout = self.remaining()
+        except DeadlineExceeded:
+            return
+        if self.policy._spend():
+            self.send(timeout)
+
+    def done(self, sent, start):
+        if sent.cancelled():
+            return
+        if sent.exception() is None:
+            if self.future.set_result(sent.result()):
+                self.policy.record(self.url, time.time() - start)
+        elif all(attempt.done() for attempt in self.attempts):
+            if self.deadline is not None and self.deadline.remaining() <= 0:
+                # The copies timed out because the deadline passed
+                return self.future.set_exception(DeadlineExceeded())
+            self.future.set_exception(sent.exception())
+
+    def cancel(self, future):
+        "Cancels the copies still in flight once there is an outcome"
+        for attempt in self.attempts:
+            attempt.cancel()
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+    journal
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Shipment Journal
+    ~~~~~~~~~~~~~~~~
+
+    Labels are bought by the ShipmentAccept of a confirmed shipment. A
+    worker which dies between the confirm and the accept, or whose accept
+    times out, leaves it unknown whether a label was bought, and running
+    the whole flow again may buy a second one. An
+    :class:`IdempotentShipper` hence writes every step of a shipment to a
+    :class:`Journal` first, under an idempotency key of the caller, like
+    the number of the order::
+
+        journal = Journal('/var/lib/ups/journal.sqlite')
+        shipper = IdempotentShipper(confirm_api, accept_api, journal)
+        results = shipper.ship('order-1042', confirm_request)
+
+    Shipping a key again never repeats what is done already:
+
+    * A shipment which was accepted is not sent again, its recorded
+      :class:`~ups.decoder.ShipmentResults` are returned.
+    * A shipment which was confirmed is not confirmed again, its digest is
+      accepted, since a new confirm would create a second shipment.
+    * A shipment whose accept was sent without an answer, because the worker
+      died or the request timed out, is *in doubt*: UPS may have bought its
+      label. It is given to the `reconcile` callable of the shipper, which
+      finds out what became of it, e.g. by tracking its identification
+      number. Without one, :exc:`ShipmentInDoubt` is raised, unless the
+      shipper is told to accept the digest again with `reaccept=True`.
+
+    A key is claimed in the journal while it is shipped, so a concurrent
+    call to ship it, from any thread or process using the same journal,
+    raises :exc:`ShipmentInProgress` instead of shipping it twice. The
+    claim of a process which died lapses after the `lease` of the shipper.
+
+    After a restart, :meth:`Journal.unfinished` tells the shipments which
+    were confirmed but not accepted, and :meth:`IdempotentShipper.resume`
+    finishes them.
+
+    The journal is an append-only SQLite table of the steps. Appends are
+    written by a thread of the journal, which commits all appends waiting
+    for it in one transaction. Concurrent appends hence share the cost of
+    syncing the file to disk, which keeps thousands of appends per second
+    durable. :meth:`Journal.append` returns once its step is committed.
+"""
+from __future__ import with_statement
+
+import cPickle as pickle
+import sqlite3
+import time
+import uuid
+import zlib
+from threading import Condition, Lock, Thread, local
+
+from async_pool import Future
+from base import PyUPSException
+from decoder import ShipmentResults
+from retry import unsent
+from shipping_package import ShipmentConfirm, ShipmentAccept
+
+#: The shipment was confirmed, the step has its digest and identification
+#: number
+CONFIRMED = 'confirmed'
+#: The accept of the shipment is about to be sent, the step has the number
+#: of the attempt
+ACCEPTING = 'accepting'
+#: The shipment was accepted, the step has its results
+ACCEPTED = 'accepted'
+#: The accept failed before it was sent or UPS answered it with an error,
+#: so no label was bought
+ACCEPT_FAILED = 'accept_failed'
+#: The accept failed without an answer of UPS, e.g. it timed out
+UNKNOWN = 'unknown'
+
+#: The last steps of shipments whose accept was sent without an answer
+IN_DOUBT = frozenset([ACCEPTING, UNKNOWN])
+
+
+class ShipmentInProgress(PyUPSException):
+    "Raised for a shipment whose key is claimed by another call"
+
+
+class ShipmentInDoubt(PyUPSException):
+    """Raised for a shipment whose accept was sent without an answer, and
+    which could not be reconciled
+    """
+
+
+class JournalEntry(object):
+    """The state of a shipment, as told by its steps in the :class:`Journal`
+
+    :param key: The idempotency key of the shipment
+    :param step: The last step of the shipment, e.g. :data:`CONFIRMED`
+    :param digest: The digest of the confirmed shipment
+    :param identification_number: The identification number of the
+        confirmed shipment
+    :param attempts: Number of accepts sent
+    :param error: The error of the last accept which failed, if any
+    :param results: The :class:`~ups.decoder.ShipmentResults` of the
+        accepted shipment
+    :param updated: Timestamp of the last step
+    """
+
+    __slots__ = (
+        'key', 'step', 'digest', 'identification_number', 'attempts',
+        'error', 'results', 'updated',
+    )
+
+    def __init__(self, key):
+        self.key = key
+        self.step = None
+        self.digest = None
+        self.identification_number = None
+        self.attempts = 0
+        self.error = None
+        self.results = None
+        self.updated = None
+
+    def __repr__(self):
+        return '<JournalEntry %s %s>' % (self.key, self.step)
+
+    @property
+    def in_doubt(self):
+        "True if an accept was sent without an answer"
+        return self.step in IN_DOUBT
+
+    def apply(self, step, digest, detail, data, created):
+        "Applies a step of the journal to the entry"
+        self.step = step
+        self.updated = created
+        if step == CONFIRMED:
+            self.digest, self.identification_number = digest, detail
+        elif step == ACCEPTING:
+            self.attempts = int(detail)
+        elif step == ACCEPTED:
+            self.results = data and pickle.loads(zlib.decompress(str(data)))
+        else:
+            self.error = detail
+
+
+class Journal(object):
+    """An append-only journal of the steps of shipments in a SQLite
+    database file, see :mod:`ups.journal`
+
+    :param path: Path of the database file, created if it does not exist
+    :param timeout: Seconds to wait for a lock held by another process
+    :param synchronous: The `synchronous` pragma of SQLite. `FULL` syncs
+        every commit to disk, `NORMAL` may lose the last commits if the host
+        crashes
+    :param max_batch: Number of steps committed in one transaction at most
+    """
+
+    def __init__(self, path, timeout=10, synchronous='FULL', max_batch=1000):
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self.max_batch = max_batch
+        self.closed = False
+
+        #: Counters to see how well appends are grouped
+        self.appended = 0
+        self.commits = 0
+
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+        self._pending = []
+        self._condition = Condition()
+
+        self._writer_connection = self._connect()
+        with self._writer_connection:
+            self._writer_connection.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                'seq INTEGER PRIMARY KEY, key TEXT NOT NULL, '
+                'step TEXT NOT NULL, digest TEXT, detail TEXT, data BLOB, '
+                'created REAL NOT NULL)'
+            )
+            self._writer_connection.execute(
+                'CREATE INDEX IF NOT EXISTS journal_key ON journal (key)'
+            )
+            self._writer_connection.execute(
+                'CREATE TABLE IF NOT EXISTS claims ('
+                'key TEXT PRIMARY KEY, token TEXT NOT NULL, '
+                'expires REAL NOT NULL)'
+            )
+        self._writer = Thread(target=self._write)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        "Returns a new connection to the database file"
+        connection = sqlite3.connect(
+            self.path, timeout=self.timeout, check_same_thread=False
+        )
+        connection.text_factory = str
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=%s' % self.synchronous)
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def _connection(self):
+        "Returns the connection the current thread reads with"
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def append_async(self, key, step, digest=None, detail=None, data=None):
+        """Queues a step of the shipment of the key for the next commit and
+        returns a :class:`~ups.async_pool.Future` which resolves once it is
+        committed
+
+        :param digest: The digest of a :data:`CONFIRMED` shipment
+        :param detail: The text of the step, see :class:`JournalEntry`
+        :param data: The results of an :data:`ACCEPTED` shipment
+        """
+        if data is not None:
+            data = sqlite3.Binary(zlib.compress(
+                pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            ))
+        future = Future()
+        row = (key, step, digest, detail, data, time.time())
+        with self._condition:
+            if self.closed:
+                raise ValueError('Journal is closed')
+            self._pending.append((row, future))
+            self._condition.notify()
+        return future
+
+    def append(self, key, step, digest=None, detail=None, data=None):
+        """Appends a step of the shipment of the key, and returns once it
+        is committed, see :meth:`append_async`
+        """
+        self.append_async(key, step, digest, detail, data).result()
+
+    def _write(self):
+        "Commits the steps appended, as many at once as are waiting"
+        while True:
+            with self._condition:
+                while not self._pending and not self.closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            try:
+                with self._writer_connection:
+                    self._writer_connection.executemany(
+                        'INSERT INTO journal '
+                        '(key, step, digest, detail, data, created) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', [row for row, f in batch]
+                    )
+            except Exception, exc:
+                for row, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.appended += len(batch)
+            self.commits += 1
+            for row, future in batch:
+                future.set_result(None)
+
+    def get(self, key):
+        "Returns the :class:`JournalEntry` of the key, None if it has none"
+        entry = None
+        for row in self._connection().execute(
+                'SELECT step, digest, detail, data, created FROM journal '
+                'WHERE key = ? ORDER BY seq', (key, )):
+            entry = entry or JournalEntry(key)
+            entry.apply(*row)
+        return entry
+
+    def unfinished(self):
+        """Returns the :class:`JournalEntry` of every shipment which was
+        confirmed but not accepted, in the order they were confirmed
+        """
+        keys = [key for key, in self._connection().execute(
+            'SELECT key FROM journal GROUP BY key '
+            'HAVING SUM(step = ?) = 0 ORDER BY MIN(seq)', (ACCEPTED, )
+        )]
+        return [self.get(key) for key in keys]
+
+    def claim(self, key, lease):
+        """Claims the key for `lease` seconds, unless another claim of it
+        has not lapsed yet. Returns the token to :meth:`release` the claim
+        with, None if the key is claimed already.
+        """
+        token, now = uuid.uuid4().hex, time.time()
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'DELETE FROM claims WHERE key = ? AND expires < ?', (key, now)
+            )
+            try:
+                connection.execute(
+                    'INSERT INTO claims (key, token, expires) '
+                    'VALUES (?, ?, ?)', (key, token, now + lease)
+                )
+            except sqlite3.IntegrityError:
+                return None
+        return token
+
+    def release(self, key, token):
+        "Releases the claim of the key :meth:`claim` returned the token for"
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'DELETE FROM claims WHERE key = ? AND token = ?', (key, token)
+            )
+
+    def close(self):
+        "Commits the steps appended so far and closes the journal"
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self._writer.join()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+
+class IdempotentShipper(object):
+    """Confirms and accepts shipments at most once per idempotency key,
+    see :mod:`ups.journal`
+
+    :param confirm_api: The :class:`~ups.shipping_package.ShipmentConfirm`
+        client the shipments are confirmed with
+    :param accept_api: The :class:`~ups.shipping_package.ShipmentAccept`
+        client the confirmed shipments are accepted with
+    :param journal: The :class:`Journal` the steps are written to
+    :param reconcile: A callable which is given the :class:`JournalEntry`
+        of a shipment in doubt, and returns its
+        :class:`~ups.decoder.ShipmentResults` if it finds out that it was
+        accepted, or None if it finds out that it was not, in which case
+        it is accepted again. It raises if it cannot tell.
+    :param reaccept: Accept the digest of a shipment in doubt again if
+        there is no `reconcile` callable, instead of raising
+        :exc:`ShipmentInDoubt`
+    :param lease: Seconds a key stays claimed at most, which must be
+        longer than shipping it takes
+    """
+
+    def __init__(self, confirm_api, accept_api, journal, reconcile=None,
+                 reaccept=False, lease=300):
+        self.confirm_api = confirm_api
+        self.accept_api = accept_api
+        self.journal = journal
+        self.reconcile = reconcile
+        self.reaccept = reaccept
+        self.lease = lease
+
+    def ship(self, key, confirm_request=None, deadline=None):
+        """Ships the shipment of the key, unless that was done already,
+        and returns its :class:`~ups.decoder.ShipmentResults`. Raises
+        :exc:`ShipmentInProgress` if the key is being shipped by another
+        call.
+
+        :param key: The idempotency key of the shipment
+        :param confirm_request: The ShipmentConfirm request element, which
+            is only needed if the shipment was not confirmed yet
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+            which each request must be finished
+        """
+        entry = self.journal.get(key)
+        if entry is not None and entry.step == ACCEPTED:
+            return entry.results
+        token = self.journal.claim(key, self.lease)
+        if token is None:
+            raise ShipmentInProgress(
+                'Shipment %s is being shipped' % key, None, None
+            )
+        try:
+            return self._ship(key, confirm_request, deadline)
+        finally:
+            self.journal.release(key, token)
+
+    def _ship(self, key, confirm_request, deadline=None):
+        "Ships the shipment of the claimed key"
+        # Another call may have shipped it before the key was claimed
+        entry = self.journal.get(key)
+        if entry is not None and entry.step == ACCEPTED:
+            return entry.results
+        if entry is None or entry.digest is None:
+            if confirm_request is None:
+                raise ValueError('Shipment %s was not confirmed' % key)
+            entry = self._confirm(key, confirm_request, deadline)
+        if entry.in_doubt:
+            results = self._reconcile(entry)
+            if results is not None:
+                return results
+        return self._accept(entry, deadline)
+
+    def _reconcile(self, entry):
+        """Returns the results of the shipment in doubt if it was accepted,
+        None if it is to be accepted again
+        """
+        if self.reconcile is not None:
+            results = self.reconcile(entry)
+            if results is not None:
+                self.journal.append(entry.key, ACCEPTED, data=results)
+            return results
+        if not self.reaccept:
+            raise ShipmentInDoubt(
+                'Shipment %s may have been accepted' % entry.key, None, None
+            )
+
+    def resume(self, key, deadline=None):
+        """Finishes the shipment of the key, which must have been confirmed,
+        e.g. one of :meth:`Journal.unfinished` after a restart
+        """
+        return self.ship(key, None, deadline)
+
+    def _confirm(self, key, confirm_request, deadline=None):
+        "Confirms the shipment and journals its digest"
+        response = self.confirm_api.request(confirm_request, deadline)
+        if isinstance(response, tuple):
+            response = response[1]
+        entry = JournalEntry(key)
+        entry.digest = ShipmentConfirm.extract_digest(response)
+        entry.identification_number = \
+            response.ShipmentIdentificationNumber.text
+        self.journal.append(
+            key, CONFIRMED, entry.digest, entry.identification_number
+        )
+        return entry
+
+    def _accept(self, entry, deadline=None):
+        """Accepts the confirmed shipment of the entry, journaling the
+        attempt before it is sent and its outcome once it is known
+        """
+        attempt = entry.attempts + 1
+        self.journal.append(entry.key, ACCEPTING, detail=str(attempt))
+        try:
+            response = self.accept_api.request(
+                ShipmentAccept.shipment_accept_request_type(entry.digest),
+                deadline
+            )
+        except Exception, exc:
+            # UPS carried out neither accepts it answered with an error nor
+            # those which never reached it
+            failed = isinstance(exc, PyUPSException) or unsent(exc)
+            self.journal.append(
+                entry.key, failed and ACCEPT_FAILED or UNKNOWN,
+                detail=unicode(exc)
+            )
+            raise
+        if isinstance(response, tuple):
+            response = response[1]
+        if not isinstance(response, ShipmentResults):
+            response = ShipmentResults.from_element(response.ShipmentResults)
+        self.journal.append(entry.key, ACCEPTED, data=response)
+        return response
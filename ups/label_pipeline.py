@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+    label_pipeline
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Label Pipeline
+    ~~~~~~~~~~~~~~
+
+    Decoding the labels of accepted shipments, converting them to another
+    format and writing them to disk is CPU work, which holds up the threads
+    doing the UPS calls if it is done on them. The :class:`LabelPipeline`
+    does it on a pool of processes instead, so the number of concurrent UPS
+    calls and the number of labels processed at once can be sized
+    separately::
+
+        pipeline = LabelPipeline(
+            '/var/labels/%(tracking_number)s.%(format)s',
+            convert=ImageConverter('PNG', rotate=90),
+        )
+        futures = pipeline.submit(accept_api.request(accept_request))
+        for tracking_number, future in futures.items():
+            print tracking_number, future.result()
+        pipeline.close()
+
+    :meth:`LabelPipeline.submit` takes the response of
+    :meth:`~ups.shipping_package.ShipmentAccept.request`, objectified or
+    typed, and returns a :class:`~ups.async_pool.Future` for the path of the
+    label of each package, by tracking number. At most `max_pending` labels
+    are queued for the processes; once that many are, :meth:`submit` blocks
+    until some of them are done, so a slow disk slows down the callers
+    instead of piling up labels in memory.
+
+    Callbacks added to the futures run on a thread of the pipeline and hence
+    must not block.
+
+    A label whose task could not be sent to the processes, or whose process
+    died while it was processing it, fails its future with a
+    :exc:`LabelError`, and its place in the queue is freed.
+"""
+from __future__ import with_statement
+
+import base64
+import errno
+import os
+import pickle
+from collections import OrderedDict
+from io import BytesIO
+from itertools import count
+from multiprocessing import Pool, cpu_count
+from multiprocessing.queues import SimpleQueue
+from threading import Condition, Semaphore, Thread
+
+from async_pool import Future
+from decoder import ShipmentResults
+
+
+class LabelError(Exception):
+    """Raised for a label which failed with an error that cannot be pickled,
+    whose task could not be sent to the processes or whose process died
+    """
+
+
+class ImageConverter(object):
+    """Converts labels to another image format (and rotates them) with PIL,
+    which must be installed for it. Pass an instance as the `convert` of a
+    :class:`LabelPipeline`.
+
+    :param format: The format to save the labels in, e.g. PNG or PDF
+    :param rotate: Degrees to rotate the labels by, counter clockwise
+    """
+
+    def __init__(self, format='PNG', rotate=0):
+        self.format = format
+        self.rotate = rotate
+
+    def __call__(self, data, label_format):
+        from PIL import Image
+
+        image = Image.open(BytesIO(data))
+        if self.rotate:
+            image = image.rotate(self.rotate, expand=True)
+        if self.format.upper() == 'PDF' and image.mode not in ('1', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, self.format)
+        return output.getvalue(), self.format.lower()
+
+
+def label_jobs(response):
+    """Returns the tracking number, label format and base64 encoded label of
+    each package of a ShipmentAccept response
+    """
+    if isinstance(response, ShipmentResults):
+        return [(
+            package.tracking_number, package.label_format,
+            package.graphic_image,
+        ) for package in response.packages]
+    return [(
+        package.TrackingNumber.text,
+        package.LabelImage.LabelImageFormat.Code.text,
+        package.LabelImage.GraphicImage.text,
+    ) for package in response.ShipmentResults.PackageResults]
+
+
+def process_label(tracking_number, label_format, image, index, output,
+                  convert=None):
+    """Decodes and converts a label and writes it to the output, returns the
+    path written to. This is what the processes of a :class:`LabelPipeline`
+    run for every label.
+
+    :param output: A path formatted with the `tracking_number`, the
+        `format` of the label (after conversion) in lower case and the
+        `index` of the package, or a callable which is given the tracking
+        number and format and returns the path.
+    :param convert: A callable which is given the decoded label and its
+        format and returns the converted label and its new format.
+    """
+    data = base64.b64decode(image)
+    label_format = (label_format or '').lower()
+    if convert is not None:
+        data, label_format = convert(data, label_format)
+    if callable(output):
+        path = output(tracking_number, label_format)
+    else:
+        path = output % {
+            'tracking_number': tracking_number,
+            'format': label_format,
+            'index': index,
+        }
+    with open(path, 'wb') as file:
+        file.write(data)
+    return path
+
+
+#: The queue a process of the pool reports the labels it starts on to
+_started = None
+
+
+def _init(started):
+    "Sets the queue of :data:`_started` in a process of the pool"
+    global _started
+    _started = started
+
+
+def _alive(pid):
+    "Returns True unless the process of the pid is gone"
+    try:
+        os.kill(pid, 0)
+    except OSError, exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+def _run(job, args):
+    """Runs :func:`process_label` in a process of the pool and returns
+    whether it succeeded along with the path or the exception.
+    """
+    _started.put((job, os.getpid()))
+    try:
+        return True, process_label(*args)
+    except Exception, exc:
+        try:
+            pickle.dumps(exc)
+        except Exception:
+            exc = LabelError('%s: %s' % (exc.__class__.__name__, exc))
+        return False, exc
+
+
+class LabelPipeline(object):
+    """Processes labels of accepted shipments on a pool of processes, see
+    :mod:`ups.label_pipeline`. The output and the converter are sent to the
+    processes and so must be picklable, i.e. functions and classes must be
+    defined at the top level of a module.
+
+    :param output: Where to write the labels to, see :func:`process_label`
+    :param convert: How to convert the labels, see :func:`process_label`.
+        Labels are written as sent by UPS if not given.
+    :param processes: Number of processes, defaults to the number of CPUs
+    :param max_pending: Maximum number of labels queued or being processed,
+        defaults to four per process
+    """
+
+    #: Seconds between the checks for labels which failed to be processed
+    watch_interval = 0.05
+
+    def __init__(self, output, convert=None, processes=None,
+                 max_pending=None):
+        try:
+            pickle.dumps((output, convert), pickle.HIGHEST_PROTOCOL)
+        except Exception, exc:
+            raise ValueError(
+                'The output and converter must be picklable: %s' % exc
+            )
+        self.output = output
+        self.convert = convert
+        self.processes = processes or cpu_count()
+        self.max_pending = max_pending or 4 * self.processes
+        self.closed = False
+
+        self._slots = Semaphore(self.max_pending)
+        #: The future, async result and process of each pending label, by
+        #: the number of its job
+        self._pending = {}
+        self._jobs = count()
+        self._condition = Condition()
+        self._lost = False
+        self._started = SimpleQueue()
+        self._pool = Pool(self.processes, _init, (self._started, ))
+        self._watcher = Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, response):
+        """Queues the labels of the ShipmentAccept response and returns an
+        ordered dictionary of a :class:`~ups.async_pool.Future` for each of
+        them, by tracking number. Blocks while `max_pending` labels are
+        queued already.
+        """
+        if self.closed:
+            raise ValueError('Label pipeline is closed')
+        futures = OrderedDict()
+        for index, job in enumerate(label_jobs(response)):
+            futures[job[0]] = self._submit(
+                job + (index, self.output, self.convert)
+            )
+        return futures
+
+    def _submit(self, args):
+        "Queues a label for the processes once there is room for it"
+        future, job = Future(), next(self._jobs)
+
+        def done((succeeded, result)):
+            self._finish(job, succeeded, result)
+
+        self._slots.acquire()
+        with self._condition:
+            self._pending[job] = [future, None, None]
+        try:
+            result = self._pool.apply_async(_run, (job, args), callback=done)
+        except Exception:
+            with self._condition:
+                del self._pending[job]
+            self._slots.release()
+            raise
+        with self._condition:
+            # The label may have been processed already
+            if job in self._pending:
+                self._pending[job][1] = result
+        return future
+
+    def _finish(self, job, succeeded, result):
+        """Resolves the future of the job, unless that was done already,
+        and frees its place in the queue
+        """
+        with self._condition:
+            pending = self._pending.pop(job, None)
+            self._condition.notify_all()
+        if pending is None:
+            return
+        if succeeded:
+            pending[0].set_result(result)
+        else:
+            pending[0].set_exception(result)
+        self._slots.release()
+
+    def _watch(self):
+        """Fails the labels whose task could not be sent to the processes or
+        whose process died, which :mod:`multiprocessing` never reports
+        """
+        while not (self.closed and self._idle()):
+            with self._condition:
+                self._condition.wait(self.watch_interval)
+            while not self._started.empty():
+                job, pid = self._started.get()
+                with self._condition:
+                    if job in self._pending:
+                        self._pending[job][2] = pid
+            with self._condition:
+                pending = self._pending.items()
+            for job, (future, result, pid) in pending:
+                if result is not None and result.ready():
+                    try:
+                        result.get(0)
+                    except Exception, exc:
+                        self._finish(job, False, LabelError(
+                            'Label could not be processed: %s' % exc
+                        ))
+                elif pid is not None and not _alive(pid):
+                    self._lost = True
+                    self._finish(job, False, LabelError(
+                        'Label process %d died' % pid
+                    ))
+
+    def _idle(self):
+        "Returns True if no labels are pending"
+        with self._condition:
+            return not self._pending
+
+    def close(self, wait=True):
+        """Stops taking labels. Waits until the queued labels are processed
+        if `wait` is set, or else abandons them and cancels their futures.
+        """
+        self.closed = True
+        if wait:
+            with self._condition:
+                while self._pending:
+                    self._condition.wait(self.watch_interval)
+        if wait and not self._lost:
+            self._pool.close()
+        else:
+            # Tasks of a process which died would be waited for forever
+            self._pool.terminate()
+        self._pool.join()
+        with self._condition:
+            pending, self._pending = self._pending.values(), {}
+            self._condition.notify_all()
+        for future, result, pid in pending:
+            future.cancel()
+        self._watcher.join()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+    labels
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Streaming Labels
+    ~~~~~~~~~~~~~~~~
+
+    The response to a ShipmentAccept request carries the labels of all the
+    packages of the shipment as base64 encoded images, which makes it several
+    megabytes large for shipments with many packages. Rather than holding
+    the whole response and its labels in memory,
+    :meth:`~ups.shipping_package.ShipmentAccept.request_labels` parses it
+    while it is received and decodes each label straight into a file::
+
+        results = accept_api.request_labels(
+            accept_request, '/var/labels/%(tracking_number)s.%(format)s'
+        )
+        for package in results.packages:
+            print package.tracking_number, package.label, package.label_size
+
+    Only the charges and the tracking numbers are kept, so the memory used
+    does not depend on the number of packages.
+
+    The output of the labels is given as one of
+
+    * a path, which is formatted with the `tracking_number`, the label
+      `format` in lower case (e.g. gif) and the `index` of the package,
+    * a callable, which is called with the tracking number and the label
+      format of each package and returns a path or a file object to write
+      the label to. File objects are not closed.
+
+    A file opened for a label which is cut off by a broken response is
+    removed again.
+"""
+import base64
+import os
+
+from base import PyUPSException
+from decoder import Result, ShipmentResults, PackageResults
+
+
+class StreamedPackage(Result):
+    """A package of a streamed shipment. The labels are not held, instead
+    :attr:`label` is the path or the file object the label was written to.
+    """
+
+    __slots__ = (
+        'tracking_number', 'label_format', 'label', 'label_size',
+        'html_label', 'html_size',
+    )
+
+
+class Base64Writer(object):
+    """Decodes base64 data given in chunks of any size and writes it to a
+    file as soon as a complete group of four characters is available.
+
+    >>> from StringIO import StringIO
+    >>> file = StringIO()
+    >>> writer = Base64Writer(file)
+    >>> for chunk in ('aGVs', 'bG8g\\n d2', '9y', 'bGQ='):
+    ...     writer.write(chunk)
+    >>> writer.finish()
+    11
+    >>> file.getvalue()
+    'hello world'
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+        self._pending = ''
+
+    def write(self, data):
+        data = self._pending + ''.join(data.split())
+        end = len(data) - len(data) % 4
+        self._pending = data[end:]
+        if end:
+            decoded = base64.b64decode(data[:end])
+            self.size += len(decoded)
+            self.file.write(decoded)
+
+    def finish(self):
+        "Returns the number of bytes written, once all data was given"
+        if self._pending:
+            raise ValueError('Truncated base64 data')
+        return self.size
+
+
+def _prefixed(prefix, fields, kind):
+    "Returns the fields by their path below the root of the response"
+    return dict(
+        (prefix + path, (kind, name, convert))
+        for name, path, convert in fields
+    )
+
+
+PACKAGE = 'ShipmentResults/PackageResults'
+GRAPHIC_IMAGE = PACKAGE + '/LabelImage/GraphicImage'
+HTML_IMAGE = PACKAGE + '/LabelImage/HTMLImage'
+
+#: The fields kept, by their path below the root of the response
+FIELDS = {}
+FIELDS.update(_prefixed(
+    'ShipmentResults/', ShipmentResults.fields, 'shipment'
+))
+FIELDS.update(_prefixed(PACKAGE + '/', [
+    field for field in PackageResults.fields
+    if field[0] in ('tracking_number', 'label_format')
+], 'package'))
+FIELDS.update(_prefixed('Response/Error/', [
+    ('severity', 'ErrorSeverity', None),
+    ('code', 'ErrorCode', None),
+    ('description', 'ErrorDescription', None),
+], 'error'))
+
+
+class LabelTarget(object):
+    """A parser target (see :class:`lxml.etree.XMLParser`) for ShipmentAccept
+    responses, which writes the labels to their output while they are
+    parsed. Closing the parser returns a
+    :class:`~ups.decoder.ShipmentResults` whose packages are
+    :class:`StreamedPackage` instances.
+
+    :param label_output: Where to write the labels to, see :mod:`ups.labels`
+    :param html_output: Where to write the HTML labels to, if at all
+    :param request: The request, for the exception raised for an error
+    """
+
+    def __init__(self, label_output, html_output=None, request=None):
+        self.label_output = label_output
+        self.html_output = html_output
+        self.request = request
+        self.values = {'shipment': {}, 'error': {}, 'package': None}
+        self.packages = []
+
+        self._paths = []
+        self._field = None
+        self._text = None
+        self._writer = None
+        self._file = None
+        self._opened = []
+
+    def start(self, tag, attrib):
+        if self._paths:
+            parent = self._paths[-1]
+            path = parent and parent + '/' + tag or tag
+        else:
+            path = ''
+        self._paths.append(path)
+
+        if path in FIELDS:
+            self._field, self._text = FIELDS[path], []
+        elif path == PACKAGE:
+            self.values['package'] = {}
+        elif path == GRAPHIC_IMAGE:
+            self._open(self.label_output, 'label')
+        elif path == HTML_IMAGE and self.html_output is not None:
+            self._open(self.html_output, 'html_label')
+
+    def data(self, data):
+        if self._writer is not None:
+            self._writer.write(data)
+        elif self._text is not None:
+            self._text.append(data)
+
+    def end(self, tag):
+        path = self._paths.pop()
+        if self._text is not None:
+            kind, name, convert = self._field
+            text = ''.join(self._text)
+            if text:
+                self.values[kind].setdefault(
+                    name, text if convert is None else convert(text)
+                )
+            self._field = self._text = None
+        elif self._writer is not None:
+            self._close(path == GRAPHIC_IMAGE and 'label_size' or 'html_size')
+        elif path == PACKAGE:
+            self.packages.append(
+                StreamedPackage.from_values(self.values['package'])
+            )
+            self.values['package'] = None
+
+    def close(self):
+        error = self.values['error']
+        if error and error.get('severity') != 'Warning':
+            raise PyUPSException("%s-%s:%s" % (
+                error.get('severity'), error.get('code'),
+                error.get('description'),
+            ), self.request, None)
+        results = ShipmentResults.from_values(self.values['shipment'])
+        results.packages = self.packages
+        return results
+
+    def _open(self, output, name):
+        "Starts writing the label of the current package to the output"
+        package = self.values['package']
+        if callable(output):
+            output = output(
+                package.get('tracking_number'), package.get('label_format')
+            )
+        elif isinstance(output, basestring):
+            output = output % {
+                'tracking_number': package.get('tracking_number'),
+                'format': (package.get('label_format') or '').lower(),
+                'index': len(self.packages),
+            }
+        if isinstance(output, basestring):
+            package[name] = output
+            self._file = open(output, 'wb')
+            self._opened.append(self._file)
+        else:
+            package[name] = self._file = output
+        self._writer = Base64Writer(self._file)
+
+    def _close(self, name):
+        "Finishes writing the label of the current package"
+        self.values['package'][name] = self._writer.finish()
+        if self._file in self._opened:
+            self._opened.remove(self._file)
+            self._file.close()
+        self._writer = self._file = None
+
+    def close_files(self):
+        """Closes the files opened by the target, if parsing failed half way,
+        and removes them since their labels were not written whole
+        """
+        for file in self._opened:
+            file.close()
+            try:
+                os.remove(file.name)
+            except OSError:
+                pass
+        self._opened = []
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
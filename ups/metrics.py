@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+    metrics
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Metrics
+    ~~~~~~~
+
+    A :class:`Metrics` registry given to the API clients counts every
+    request sent to UPS by its endpoint and :data:`outcome <OUTCOMES>`,
+    along with the bytes sent and received and the codes of the errors UPS
+    answered with. How long the phases of a request took goes into
+    histograms::
+
+        metrics = Metrics()
+        rating_api = RatingService(
+            license_no, user_id, password, True, metrics=metrics
+        )
+
+    The clients time serializing the request, pretty-printing it for the
+    log in debug mode, the network round trip and parsing the response.
+    Building the request with the `*_type` methods
+    happens before the client sees it, and is timed with
+    :meth:`Metrics.timed`::
+
+        with metrics.timed('Rate', 'build'):
+            rate_request = RatingService.rating_request_type(shipment)
+
+    Every attempt of a request retried by a
+    :class:`~ups.retry.RetryPolicy` counts as a request of its own, and the
+    phases of a request are recorded with its outcome. Responses answered
+    from the cache count as `cached`, without any phases. The labels
+    streamed by :meth:`~ups.shipping_package.ShipmentAccept.request_labels`
+    are parsed while they are received, so their network phase includes
+    most of the parsing, and their bytes are not counted.
+
+    Recording takes no lock: every thread counts into a shard of its own,
+    and the shards are only added up by :meth:`Metrics.snapshot` and
+    :meth:`Metrics.prometheus`, which export the registry as a dict and in
+    the text format of Prometheus. The shard of a thread which exits is
+    added to a total of the exited threads, so that a registry does not
+    grow with every thread which ever recorded into it.
+"""
+from __future__ import with_statement
+
+import socket
+import time
+import urllib2
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock, local
+
+from async_pool import CancelledError
+from base import PyUPSException
+from deadline import DeadlineExceeded
+from retry import error_code
+
+
+#: The phases of a request. Requests are also pretty-printed in a `log`
+#: phase after they are serialized, in debug mode only.
+PHASES = ('build', 'serialize', 'network', 'parse')
+
+OK = 'ok'
+CACHED = 'cached'
+UPS_ERROR = 'ups_error'
+HTTP_ERROR = 'http_error'
+TIMEOUT = 'timeout'
+NETWORK_ERROR = 'network_error'
+CANCELLED = 'cancelled'
+ERROR = 'error'
+
+#: The outcomes requests are counted by
+OUTCOMES = (
+    OK, CACHED, UPS_ERROR, HTTP_ERROR, TIMEOUT, NETWORK_ERROR, CANCELLED,
+    ERROR
+)
+
+#: Upper bounds in seconds of the buckets of the histograms
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+    2.5, 5, 10,
+)
+
+#: The counters, with the names and the help texts of their Prometheus
+#: metrics
+COUNTERS = (
+    ('requests', 'requests_total', 'Requests sent to UPS'),
+    ('request_bytes', 'request_bytes_total', 'Bytes of the requests sent'),
+    ('response_bytes', 'response_bytes_total',
+     'Bytes of the responses received'),
+)
+
+
+def outcome(exc=None):
+    """Returns the outcome of a request which raised the exception, or
+    succeeded if it is None
+
+    >>> outcome()
+    'ok'
+    >>> outcome(PyUPSException('Hard-111210:Unavailable', None, None))
+    'ups_error'
+    >>> outcome(urllib2.URLError(socket.timeout('timed out')))
+    'timeout'
+    >>> outcome(CancelledError())
+    'cancelled'
+    """
+    if exc is None:
+        return OK
+    if isinstance(exc, CancelledError):
+        return CANCELLED
+    if isinstance(exc, PyUPSException):
+        return UPS_ERROR
+    if isinstance(exc, urllib2.HTTPError):
+        return HTTP_ERROR
+    if isinstance(exc, DeadlineExceeded) or isinstance(exc, socket.timeout):
+        return TIMEOUT
+    if isinstance(exc, urllib2.URLError):
+        if isinstance(exc.reason, socket.timeout):
+            return TIMEOUT
+        return NETWORK_ERROR
+    if isinstance(exc, (socket.error, IOError)):
+        return NETWORK_ERROR
+    return ERROR
+
+
+class Sample(object):
+    """The phases of a request, timed one after the other and recorded
+    together with the outcome of the request
+
+    :param metrics: The :class:`Metrics` the sample is recorded in, if any
+    :param endpoint: The endpoint the request is sent to
+    """
+
+    __slots__ = (
+        'metrics', 'endpoint', 'phases', 'lapped', 'request_bytes',
+        'response_bytes', 'recorded',
+    )
+
+    def __init__(self, metrics, endpoint):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.phases = []
+        self.lapped = time.time()
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.recorded = False
+
+    def restart(self):
+        "Starts timing the next phase now"
+        self.lapped = time.time()
+
+    def lap(self, phase):
+        "Ends the phase, which started when the previous one ended"
+        now = time.time()
+        self.phases.append((phase, now - self.lapped))
+        self.lapped = now
+
+    def call(self, phase, function, *args):
+        """Returns what the function returns, timed as the phase. If it
+        raises the sample is recorded with the exception.
+        """
+        try:
+            result = function(*args)
+        except Exception, exc:
+            self.record(exc, phase)
+            raise
+        self.lap(phase)
+        return result
+
+    def record(self, exc=None, phase=None):
+        """Records the sample with the outcome of the exception, if any,
+        ending the phase first if one is given
+        """
+        if phase is not None:
+            self.lap(phase)
+        self.recorded = True
+        if self.metrics is not None:
+            self.metrics.record(
+                self.endpoint, outcome(exc), self.phases, self.request_bytes,
+                self.response_bytes, exc is not None and error_code(exc)[1]
+            )
+
+    def retry(self):
+        "Returns the sample of the next attempt of the request"
+        return Sample(self.metrics, self.endpoint)
+
+    def cached(self):
+        "Records that the request was answered from the cache"
+        if self.metrics is not None:
+            self.metrics.cached(self.endpoint)
+
+    def finish(self, exc=None):
+        """Called once the call the request was sent by is done, with the
+        exception it failed with, if any
+        """
+
+
+class _Owner(object):
+    "Stands for a thread whose locals hold it, see :meth:`Metrics._shard`"
+
+
+def _add(totals, shard):
+    "Adds the counters and histograms of the shard to the totals"
+    counters, histograms = totals
+    shard_counters, shard_histograms = shard
+    # Copying a dict, or a list, is atomic and hence safe while the thread
+    # of the shard records into it
+    for key, value in dict(shard_counters).iteritems():
+        counters[key] = counters.get(key, 0) + value
+    for key, histogram in dict(shard_histograms).iteritems():
+        total = histograms.setdefault(key, [0] * len(histogram))
+        for index, value in enumerate(list(histogram)):
+            total[index] += value
+
+
+class Metrics(object):
+    """A registry of the requests sent to UPS, see :mod:`ups.metrics`
+
+    :param buckets: Upper bounds in seconds of the buckets of the histograms
+    :param prefix: Prefix of the names of the Prometheus metrics
+    """
+
+    def __init__(self, buckets=BUCKETS, prefix='ups'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._shards = {}
+        self._retired = ({}, {})
+        self._local = local()
+        self._lock = Lock()
+
+    def _shard(self):
+        "Returns the counters and histograms of the current thread"
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = ({}, {})
+            # The owner is dropped with the locals of the thread once it
+            # exits, which retires its shard
+            owner = self._local.owner = _Owner()
+            with self._lock:
+                self._shards[weakref.ref(owner, self._retire)] = shard
+            return shard
+
+    def _retire(self, owner):
+        "Adds the shard of a thread which exited to the retired total"
+        with self._lock:
+            shard = self._shards.pop(owner, None)
+            if shard is not None:
+                _add(self._retired, shard)
+
+    def _observe(self, histograms, key, seconds):
+        "Adds the seconds to the histogram of the key"
+        histogram = histograms.get(key)
+        if histogram is None:
+            # The bucket counts, followed by that of +Inf and the sum
+            histogram = histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def observe(self, endpoint, phase, outcome, seconds):
+        "Records the seconds a phase of a request took"
+        self._observe(self._shard()[1], (endpoint, phase, outcome), seconds)
+
+    def record(self, endpoint, outcome, phases=(), request_bytes=0,
+               response_bytes=0, code=None):
+        """Records a request
+
+        :param phases: The phases of the request and the seconds they took
+        :param code: The code of the UPS error it failed with, if any
+        """
+        counters, histograms = self._shard()
+        for name, value in (
+                ('requests', 1), ('request_bytes', request_bytes),
+                ('response_bytes', response_bytes)):
+            key = (name, endpoint, outcome)
+            counters[key] = counters.get(key, 0) + value
+        if code:
+            key = ('errors', endpoint, code)
+            counters[key] = counters.get(key, 0) + 1
+        for phase, seconds in phases:
+            self._observe(histograms, (endpoint, phase, outcome), seconds)
+
+    def cached(self, endpoint):
+        "Records a request answered from the cache"
+        self.record(endpoint, CACHED)
+
+    def sample(self, endpoint):
+        "Returns a :class:`Sample` of a request to the endpoint"
+        return Sample(self, endpoint)
+
+    @contextmanager
+    def timed(self, endpoint, phase):
+        """Times the block as a phase of a request to the endpoint, whose
+        outcome is that of the exception the block raises, if any
+        """
+        started = time.time()
+        try:
+            yield
+        except Exception, exc:
+            self.observe(endpoint, phase, outcome(exc), time.time() - started)
+            raise
+        self.observe(endpoint, phase, OK, time.time() - started)
+
+    def _totals(self):
+        "Returns the counters and histograms of all threads added up"
+        totals = ({}, {})
+        with self._lock:
+            shards = self._shards.values()
+            _add(totals, self._retired)
+        for shard in shards:
+            _add(totals, shard)
+        return totals
+
+    def _cumulative(self, histogram):
+        "Returns the (upper bound, cumulative count) pairs of a histogram"
+        buckets, count = [], 0
+        for bound, value in zip(self.buckets + (float('inf'),), histogram):
+            count += value
+            buckets.append((bound, count))
+        return buckets
+
+    def snapshot(self):
+        """Returns the metrics as a dict of the endpoints, like::
+
+            {'Rate': {
+                'requests': {'ok': 2},
+                'request_bytes': {'ok': 1480},
+                'response_bytes': {'ok': 9270},
+                'errors': {},
+                'phases': {'network': {'ok': {
+                    'count': 2, 'sum': 0.51,
+                    'buckets': [(0.0005, 0), ..., (inf, 2)],
+                }}, ...},
+            }}
+        """
+        counters, histograms = self._totals()
+        endpoints = {}
+
+        def endpoint(name):
+            return endpoints.setdefault(name, {
+                'requests': {}, 'request_bytes': {}, 'response_bytes': {},
+                'errors': {}, 'phases': {},
+            })
+
+        for (name, endpoint_name, label), value in counters.iteritems():
+            endpoint(endpoint_name)[name][label] = value
+        for (endpoint_name, phase, label), histogram in \
+                histograms.iteritems():
+            endpoint(endpoint_name)['phases'].setdefault(phase, {})[label] = {
+                'count': sum(histogram[:-1]),
+                'sum': histogram[-1],
+                'buckets': self._cumulative(histogram[:-1]),
+            }
+        return endpoints
+
+    def prometheus(self):
+        """Returns the metrics in the text exposition format of Prometheus
+
+        >>> metrics = Metrics(buckets=[0.1, 1])
+        >>> metrics.record('Rate', 'ok', [('network', 0.25)], 740, 4635)
+        >>> print metrics.prometheus()
+        # HELP ups_requests_total Requests sent to UPS
+        # TYPE ups_requests_total counter
+        ups_requests_total{endpoint="Rate",outcome="ok"} 1
+        ...
+        # TYPE ups_phase_seconds histogram
+        ups_phase_seconds_bucket{endpoint="Rate",phase="network",outcome="ok",le="0.1"} 0
+        ups_phase_seconds_bucket{endpoint="Rate",phase="network",outcome="ok",le="1"} 1
+        ups_phase_seconds_bucket{endpoint="Rate",phase="network",outcome="ok",le="+Inf"} 1
+        ups_phase_seconds_sum{endpoint="Rate",phase="network",outcome="ok"} 0.25
+        ups_phase_seconds_count{endpoint="Rate",phase="network",outcome="ok"} 1
+        <BLANKLINE>
+        """  # noqa
+        counters, histograms = self._totals()
+        lines = []
+
+        def header(name, kind, text):
+            lines.append('# HELP %s_%s %s' % (self.prefix, name, text))
+            lines.append('# TYPE %s_%s %s' % (self.prefix, name, kind))
+
+        def sample(name, labels, value):
+            lines.append('%s_%s{%s} %s' % (self.prefix, name, ','.join(
+                '%s="%s"' % (label, _escape(text)) for label, text in labels
+            ), _format(value)))
+
+        for counter, name, text in COUNTERS + (
+                ('errors', 'errors_total', 'Errors UPS answered with'),):
+            header(name, 'counter', text)
+            label = counter == 'errors' and 'code' or 'outcome'
+            for key in sorted(key for key in counters if key[0] == counter):
+                sample(name, [('endpoint', key[1]), (label, key[2])],
+                       counters[key])
+
+        header('phase_seconds', 'histogram', 'Seconds the phases took')
+        for key in sorted(histograms):
+            labels = zip(('endpoint', 'phase', 'outcome'), key)
+            histogram = histograms[key]
+            for bound, count in self._cumulative(histogram[:-1]):
+                sample('phase_seconds_bucket', labels + [('le', bound)], count)
+            sample('phase_seconds_sum', labels, histogram[-1])
+            sample('phase_seconds_count', labels, sum(histogram[:-1]))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    "Escapes the value of a Prometheus label"
+    if isinstance(value, float):
+        return _format(value)
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n'
+    )
+
+
+def _format(value):
+    """Formats a number for Prometheus
+
+    >>> _format(float('inf')), _format(0.25), _format(1.0), _format(3)
+    ('+Inf', '0.25', '1', '3')
+    """
+    if value == float('inf'):
+        return '+Inf'
+    text = repr(value)
+    if isinstance(value, float) and '.' in text and 'e' not in text:
+        return text.rstrip('0').rstrip('.')
+    return text
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(optionflags=doctest.ELLIPSIS)
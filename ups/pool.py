@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+    pool
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Keep-Alive Connection Pool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Every UPS call is a small XML POST to the same couple of hosts. Opening a
+    new TCP connection and negotiating TLS for each of them costs far more
+    than the request itself, so the :class:`ConnectionPool` keeps the
+    connections open (HTTP/1.1 keep-alive) and hands them out again to the
+    next request for the same host.
+
+    A pool is safe to share between threads and between API clients::
+
+        pool = ConnectionPool(maxsize=20)
+        confirm_api = ShipmentConfirm(license, user, password, True, pool=pool)
+        accept_api = ShipmentAccept(license, user, password, True, pool=pool)
+
+"""
+from __future__ import with_statement
+
+import httplib
+import select
+import socket
+import time
+import urllib2
+from collections import deque
+from StringIO import StringIO
+from threading import Lock
+from urlparse import urlsplit
+
+from deadline import DeadlineExceeded
+
+
+#: Errors which indicate that the server silently dropped a keep-alive
+#: connection while it was sitting idle in the pool, when a request is
+#: written to it.
+STALE_CONNECTION_ERRORS = (
+    httplib.CannotSendRequest,
+    socket.error,
+)
+
+
+def _dropped(conn):
+    """Returns True if the server closed the idle connection, or sent
+    something it should not have, which makes it readable
+    """
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+def _remaining(deadline, timeout):
+    "Returns the timeout, or what is left of the deadline if that is less"
+    if deadline is None:
+        return timeout
+    return deadline.timeout(timeout)
+
+
+class _DeadlineSocket(object):
+    """Wraps the socket a response is read from, so that every read is given
+    at most what is left of the deadline of the request
+    """
+
+    def __init__(self, sock, deadline, timeout):
+        self._sock = sock
+        self.deadline = deadline
+        self.timeout = timeout
+
+    def makefile(self, mode='r', bufsize=-1):
+        return socket._fileobject(self, mode, bufsize)
+
+    def recv(self, size):
+        timeout = _remaining(self.deadline, self.timeout)
+        self._sock.settimeout(timeout)
+        try:
+            return self._sock.recv(size)
+        except socket.timeout:
+            # The socket may time out a little before the deadline passes
+            if self.timeout is None or timeout < self.timeout:
+                raise DeadlineExceeded()
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class ConnectionPool(object):
+    """A thread safe pool of persistent HTTP(S) connections, kept per host.
+
+    :param maxsize: Maximum number of idle connections kept open per host.
+        Requests are never blocked by this limit; connections opened beyond
+        it are simply closed once their response has been read.
+    :param idle_timeout: Seconds after which an idle connection is evicted
+        instead of being reused. UPS closes idle connections on its side
+        after a while, so keep this reasonably low.
+    :param timeout: Default socket timeout in seconds for every request.
+    :param ssl_context: Optional :class:`ssl.SSLContext` used for HTTPS
+        connections.
+    """
+
+    #: Headers sent with every request. UPS expects the XML document as the
+    #: body of a form POST, same as :func:`urllib2.urlopen` used to send it.
+    default_headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+    }
+
+    #: Size of the chunks a streamed response is passed on to the sink in
+    chunk_size = 64 * 1024
+
+    def __init__(self, maxsize=10, idle_timeout=30, timeout=10,
+                 ssl_context=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.closed = False
+
+        #: (scheme, host, port) -> deque of (connection, last used time)
+        self._idle = {}
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _new_connection(self, key, timeout):
+        "Opens a new connection for the given (scheme, host, port) key"
+        scheme, host, port = key
+        if scheme == 'https':
+            kwargs = {}
+            if self.ssl_context is not None:
+                kwargs['context'] = self.ssl_context
+            return httplib.HTTPSConnection(
+                host, port, timeout=timeout, **kwargs
+            )
+        return httplib.HTTPConnection(host, port, timeout=timeout)
+
+    def _get_connection(self, key):
+        """Returns an idle connection for the key, or None if there is none.
+        Connections which have been idle for too long, or which the server
+        closed in the meantime, are closed on the way.
+        """
+        expired = []
+        connection = None
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                # Oldest connections are on the left, most recent on the right
+                deadline = time.time() - self.idle_timeout
+                while connections and connections[0][1] < deadline:
+                    expired.append(connections.popleft()[0])
+                while connections and connection is None:
+                    conn = connections.pop()[0]
+                    if _dropped(conn):
+                        expired.append(conn)
+                    else:
+                        connection = conn
+        for conn in expired:
+            conn.close()
+        return connection
+
+    def _put_connection(self, key, conn):
+        "Returns a connection to the pool, or closes it if the pool is full"
+        with self._lock:
+            if not self.closed:
+                connections = self._idle.setdefault(key, deque())
+                if len(connections) < self.maxsize:
+                    connections.append((conn, time.time()))
+                    return
+        conn.close()
+
+    def evict_idle(self):
+        """Closes all connections which have been idle for longer than
+        :attr:`idle_timeout`.
+        """
+        expired = []
+        now = time.time()
+        with self._lock:
+            for key, connections in self._idle.items():
+                alive = deque()
+                for conn, last_used in connections:
+                    if now - last_used > self.idle_timeout:
+                        expired.append(conn)
+                    else:
+                        alive.append((conn, last_used))
+                self._idle[key] = alive
+        for conn in expired:
+            conn.close()
+        return len(expired)
+
+    def idle_count(self, url=None):
+        """Returns the number of idle connections, for the host of the url if
+        one is given.
+        """
+        with self._lock:
+            if url is not None:
+                return len(self._idle.get(self.pool_key(url), ()))
+            return sum(len(c) for c in self._idle.values())
+
+    def close(self):
+        """Closes all idle connections. Connections in use are closed as soon
+        as their response has been read.
+        """
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, last_used in connections:
+                conn.close()
+
+    @classmethod
+    def pool_key(cls, url):
+        "Returns the (scheme, host, port) tuple the url is pooled under"
+        parts = urlsplit(url)
+        port = parts.port or (parts.scheme == 'https' and 443 or 80)
+        return parts.scheme, parts.hostname, port
+
+    @staticmethod
+    def _write(conn, parts, data, headers, timeout, deadline=None):
+        """Writes the request to the connection, connecting first if need
+        be. Connecting and sending are given at most what is left of the
+        deadline, if any.
+        """
+        conn.timeout = _remaining(deadline, timeout)
+        if conn.sock is None:
+            conn.connect()
+        conn.sock.settimeout(_remaining(deadline, timeout))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        conn.request('POST', path, data, headers)
+
+    def _read(self, conn, timeout, sink=None, deadline=None):
+        """Reads the whole response to the request written to the
+        connection, or passes it on to the sink chunk by chunk. Every read is
+        given at most what is left of the deadline, if any.
+        """
+        response = self._response(conn, deadline, timeout)
+        if sink is None or response.status >= 400:
+            return response, response.read()
+        while True:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                return response, None
+            sink(chunk)
+
+    @staticmethod
+    def _response(conn, deadline, timeout):
+        "Returns the response to the request sent on the connection"
+        if deadline is None:
+            return conn.getresponse()
+
+        def response_class(sock, *args, **kwargs):
+            return httplib.HTTPResponse(
+                _DeadlineSocket(sock, deadline, timeout), *args, **kwargs
+            )
+
+        conn.response_class = response_class
+        try:
+            return conn.getresponse()
+        finally:
+            del conn.response_class
+
+    def urlopen(self, url, data, headers=None, timeout=None, sink=None,
+                deadline=None):
+        """POSTs the data to the url over a pooled connection and returns the
+        body of the response.
+
+        Errors are raised just like :func:`urllib2.urlopen` raises them, i.e.
+        :exc:`urllib2.HTTPError` for a HTTP error status and
+        :exc:`urllib2.URLError` when the server could not be reached.
+
+        :param url: The URL to POST to
+        :param data: The body of the request as a byte string
+        :param headers: Additional headers to send
+        :param timeout: Socket timeout, defaults to :attr:`timeout`
+        :param sink: A callable which is given the body of a successful
+            response in chunks of at most :attr:`chunk_size` bytes as they
+            are received, instead of returning it. None is returned then.
+        :param deadline: A :class:`~ups.deadline.Deadline` the whole request
+            must be finished by. Every socket operation is given at most
+            what is left of it, and :exc:`~ups.deadline.DeadlineExceeded` is
+            raised once it has passed.
+        """
+        if self.closed:
+            raise urllib2.URLError('Connection pool is closed')
+        if timeout is None:
+            timeout = self.timeout
+        all_headers = dict(self.default_headers)
+        all_headers.update(headers or {})
+
+        key = self.pool_key(url)
+        conn, response, body = self._send_pooled(
+            key, urlsplit(url), data, all_headers, timeout, sink, deadline
+        )
+        self._release(key, conn, response)
+
+        if response.status >= 400:
+            raise urllib2.HTTPError(
+                url, response.status, response.reason, response.msg,
+                StringIO(body)
+            )
+        return body
+
+    def _send_pooled(self, key, parts, data, headers, timeout, sink=None,
+                     deadline=None):
+        """Sends the request on an idle connection if there is one, or on a
+        new connection otherwise. Returns the connection used, the response
+        and its body.
+
+        The request is sent again on a new connection only if writing it to
+        the idle connection failed. Once it is written, the server may well
+        carry it out, so a failure to read the response is raised, and left
+        to the :mod:`~ups.retry` policy of the client.
+        """
+        conn = self._get_connection(key)
+        try:
+            if conn is not None:
+                try:
+                    self._write(conn, parts, data, headers, timeout, deadline)
+                except socket.timeout:
+                    raise
+                except STALE_CONNECTION_ERRORS:
+                    # The server dropped the idle connection, try once more
+                    # on a fresh one.
+                    conn.close()
+                else:
+                    return (conn, ) + self._read(conn, timeout, sink, deadline)
+            conn = self._new_connection(key, timeout)
+            self._write(conn, parts, data, headers, timeout, deadline)
+            return (conn, ) + self._read(conn, timeout, sink, deadline)
+        except Exception, exc:
+            # The rest of the response, if any, is left unread
+            if conn is not None:
+                conn.close()
+            if isinstance(exc, (httplib.HTTPException, socket.error)):
+                raise urllib2.URLError(exc)
+            raise
+
+    def _release(self, key, conn, response):
+        "Returns the connection to the pool unless the server closes it"
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_connection(key, conn)
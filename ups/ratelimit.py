@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    ratelimit
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Rate Limiting
+    ~~~~~~~~~~~~~
+
+    UPS throttles the requests made with an access license. Many workers
+    sending requests at will run into that limit all at once and retry in
+    lockstep. A :class:`RateLimiter` given to the API clients spaces out
+    their requests with a token bucket per access license and endpoint, so
+    they stay within a budget instead::
+
+        limiter = RateLimiter(rate=5, budgets={'ShipAccept': (1, 2)})
+        rating_api = RatingService(
+            license_no, user_id, password, True, rate_limiter=limiter
+        )
+
+    Budgets are requests per second, with the number of requests which may
+    be sent at once after a pause as the optional second item. They are
+    given per endpoint, i.e. the last part of the URL of an API: `Rate`,
+    `AV`, `TimeInTransit`, `ShipConfirm`, `ShipAccept` or `Void`. Endpoints
+    without a budget are not limited.
+
+    Share one limiter between all clients of a process. With a `directory`
+    the buckets are kept in files there, which are locked while they are
+    updated, so that all processes of a host using the same directory share
+    the budgets.
+
+    Requests wait for their turn as long as needed, unless the client has a
+    :attr:`~ups.base.BaseAPIClient.rate_limit_wait`, in which case requests
+    which would have to wait longer fail with :exc:`RateLimitExceeded` at
+    once, without using up the budget.
+"""
+from __future__ import with_statement
+
+import fcntl
+import hashlib
+import os
+import struct
+import time
+from threading import Lock
+
+from base import PyUPSException
+
+
+class RateLimitExceeded(PyUPSException):
+    """Raised for a request which would have to wait for the rate limiter
+    beyond its deadline. The `wait` attribute has the seconds it would have
+    had to wait.
+    """
+
+    def __init__(self, message, wait):
+        super(RateLimitExceeded, self).__init__(message, None, None)
+        self.wait = wait
+
+
+class TokenBucket(object):
+    """A thread safe token bucket, which holds up to `burst` tokens and is
+    refilled with `rate` tokens per second.
+
+    Tokens are reserved rather than waited for: the bucket may go into debt
+    and :meth:`reserve` returns how long the caller has to wait until its
+    tokens are refilled. Callers are thus served in order, however many are
+    waiting.
+
+    >>> bucket = TokenBucket(10, 2)
+    >>> bucket.reserve(), bucket.reserve()
+    (0.0, 0.0)
+    >>> round(bucket.reserve(), 1)
+    0.1
+
+    :param rate: Tokens refilled per second
+    :param burst: Size of the bucket, defaults to one second of tokens
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._lock = Lock()
+
+    def take(self, state, now, tokens, deadline):
+        """Returns the state of the bucket after taking the tokens at the
+        time `now`, and the seconds to wait for them. Raises
+        :exc:`RateLimitExceeded` if the wait would end after the deadline.
+
+        :param state: The tokens left and the time they were counted at
+        """
+        left, stamp = state
+        left = min(self.burst, left + max(0.0, now - stamp) * self.rate)
+        wait = max(0.0, (tokens - left) / self.rate)
+        if wait and deadline is not None and now + wait > deadline:
+            raise RateLimitExceeded(
+                'Rate limit exceeded, the next request is due in %.3fs' %
+                wait, wait
+            )
+        return (left - tokens, now), wait
+
+    def reserve(self, tokens=1, deadline=None):
+        """Takes the tokens and returns the seconds to wait until they may be
+        used.
+
+        :param deadline: The time (as of :func:`time.time`) the tokens are
+            needed by at the latest. Nothing is taken and
+            :exc:`RateLimitExceeded` is raised if that is too soon.
+        """
+        with self._lock:
+            state, wait = self.take(
+                (self._tokens, self._stamp), time.time(), tokens, deadline
+            )
+            self._tokens, self._stamp = state
+        return wait
+
+    def acquire(self, tokens=1, deadline=None):
+        "Takes the tokens and waits until they may be used"
+        wait = self.reserve(tokens, deadline)
+        if wait:
+            time.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+    """A :class:`TokenBucket` kept in a file, which is shared by all
+    processes using the same path. The file is locked with :func:`flock`
+    while the bucket is updated, which only takes a moment; waiting for the
+    tokens happens outside of the lock.
+    """
+
+    _format = struct.Struct('dd')
+
+    def __init__(self, path, rate, burst=None):
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+
+    def reserve(self, tokens=1, deadline=None):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, self._format.size)
+            now = time.time()
+            if len(data) == self._format.size:
+                state = self._format.unpack(data)
+            else:
+                state = (self.burst, now)
+            state, wait = self.take(state, now, tokens, deadline)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, self._format.pack(*state))
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+        return wait
+
+
+class RateLimiter(object):
+    """Token buckets per access license and endpoint, see
+    :mod:`ups.ratelimit`.
+
+    :param rate: Requests per second of the endpoints without a budget of
+        their own. Those are not limited if not given.
+    :param burst: Requests which may be sent at once at the default rate
+    :param budgets: A dictionary of the rate, or the (rate, burst) tuple, by
+        endpoint
+    :param directory: The directory to keep the buckets in to share them with
+        other processes. They are kept in memory if not given.
+    """
+
+    def __init__(self, rate=None, burst=None, budgets=None, directory=None):
+        self.budgets = {}
+        for endpoint, budget in (budgets or {}).items():
+            if not isinstance(budget, tuple):
+                budget = (budget, None)
+            self.budgets[endpoint] = budget
+        self.default = (rate, burst) if rate else None
+        self.directory = directory
+        self._buckets = {}
+        self._lock = Lock()
+
+    def create_bucket(self, license_no, endpoint, rate, burst=None):
+        """Returns a new bucket for the license and endpoint. Files are named
+        after a hash of the license, so that it does not show in the file
+        system.
+        """
+        if self.directory is None:
+            return TokenBucket(rate, burst)
+        return FileTokenBucket(os.path.join(self.directory, '%s-%s' % (
+            hashlib.sha1(license_no).hexdigest()[:16], endpoint
+        )), rate, burst)
+
+    def bucket(self, license_no, endpoint):
+        "Returns the bucket of the license and endpoint, None if unlimited"
+        key = (license_no, endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            budget = self.budgets.get(endpoint, self.default)
+            if budget is None:
+                return None
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = self.create_bucket(
+                        license_no, endpoint, *budget
+                    )
+        return bucket
+
+    def reserve(self, license_no, endpoint, deadline=None):
+        """Reserves a request and returns the seconds to wait before sending
+        it, see :meth:`TokenBucket.reserve`
+        """
+        bucket = self.bucket(license_no, endpoint)
+        if bucket is None:
+            return 0.0
+        return bucket.reserve(1, deadline)
+
+    def acquire(self, license_no, endpoint, deadline=None):
+        "Waits until a request may be sent, see :meth:`reserve`"
+        wait = self.reserve(license_no, endpoint, deadline)
+        if wait:
+            time.sleep(wait)
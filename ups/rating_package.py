@@ -19,20 +19,30 @@
 
 
 """
+from copy import deepcopy
+
 from lxml.builder import E
-from lxml import etree, objectify
 
 from base import BaseAPIClient
+from batch import BatchMixin
+from cache import canonical_key
+from decoder import decode_rate
 from shipping_package import ShipmentMixin
 
 
-class RatingService(ShipmentMixin, BaseAPIClient):
+class RatingService(BatchMixin, ShipmentMixin, BaseAPIClient):
     """Implements the Rate Request"""
 
     # Indicates the action to be taken by the XML service.
     RequestAction = E.RequestAction('Rate')
     RequestOption = E.RequestOption('Shop')
 
+    # Decodes the response if the client is typed, see ups.decoder
+    decoder = staticmethod(decode_rate)
+
+    # Requests only read and hence may be hedged, see ups.hedging
+    hedgeable = True
+
     # TransactionReference identifies transactions between client and server.
     TransactionReference = E.TransactionReference(
         E.CustomerContext('unspecified')
@@ -86,38 +96,31 @@ class RatingService(ShipmentMixin, BaseAPIClient):
                                        :meth:`customer_classification`
         :param PickupType: Pickup Type container tag (optional)
         """
+        # The shared elements are copied, since lxml would move them out
+        # of the requests built before
         request = E.Request(
-            cls.RequestAction,
-            kwargs.pop('RequestOption', cls.RequestOption),
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(kwargs.pop('RequestOption', cls.RequestOption)),
+            deepcopy(cls.TransactionReference),
         )
         return E.RatingServiceSelectionRequest(
             request, shipment, *args, **kwargs
         )
 
-    def request(self, rate_request):
+    def cache_key(self, rate_request):
+        """Rates are cached by the canonical form of the
+        RatingServiceSelectionRequest, so the order of its elements does not
+        matter. The URL and the access license are part of the key, since
+        rates depend on the account.
+        """
+        return canonical_key(self.url, self.license_no, rate_request)
+
+    def request(self, rate_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param rate_request: lxml element with data for the rate request
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
         """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(rate_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        # Return request ?
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        return self._request(rate_request, deadline)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+    retry
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Retries and Circuit Breakers
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    UPS has its bad moments: connections are refused, the gateway answers
+    with a 5xx status, or the response is an error of the `Transient`
+    severity. A :class:`RetryPolicy` given to the API clients retries such
+    requests after an exponentially growing, jittered pause, while errors
+    which would only occur again, like an invalid address, are raised at
+    once::
+
+        policy = RetryPolicy(attempts=3)
+        rating_api = RatingService(
+            license_no, user_id, password, True, retry_policy=policy
+        )
+
+    ShipmentConfirm, ShipmentAccept and ShipmentVoid are not
+    :attr:`~ups.base.BaseAPIClient.idempotent`: sent twice, they may create
+    two shipments or fail a void which succeeded. Their requests are only
+    retried if UPS answered with an error, or if they failed before they
+    were sent: the connection was refused, the host name could not be
+    resolved or UPS answered with a 503 status. Requests which timed out
+    or lost their connection after they were sent are not, since UPS may
+    well have carried them out. A pooled connection which the server closed
+    while it was idle is replaced by the connection pool itself, as long as
+    the request could not be written to it.
+
+    When UPS is down retrying only adds to the pile of waiting threads. The
+    policy hence keeps a :class:`CircuitBreaker` per endpoint URL, which
+    opens after a number of transient failures in a row. While it is open
+    requests to the endpoint fail with :exc:`CircuitOpenError` at once.
+    After a while a few probe requests are let through, and the first one
+    which succeeds closes the breaker again.
+
+    Share one policy between the clients to share the breakers.
+"""
+from __future__ import with_statement
+
+import errno
+import httplib
+import random
+import socket
+import time
+import urllib2
+from threading import Lock
+
+from async_pool import Future
+from base import PyUPSException
+from deadline import DeadlineExceeded
+from ratelimit import RateLimitExceeded
+
+
+#: UPS error codes which are worth a retry even if UPS does not mark them
+#: as transient: general process failure and the license and authorization
+#: systems being unavailable
+TRANSIENT_CODES = frozenset(['20001', '250050', '250052'])
+
+#: Errors of connections which failed before anything was sent
+UNSENT_ERRNOS = frozenset([
+    errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH,
+])
+
+#: Errors raised before a request left the process, which hence tell
+#: nothing about the health of UPS
+LOCAL_ERRORS = (DeadlineExceeded, RateLimitExceeded)
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+
+class CircuitOpenError(PyUPSException):
+    "Raised for requests to an endpoint whose circuit breaker is open"
+
+
+def error_code(exc):
+    """Returns the severity and the code of the UPS error a
+    :exc:`~ups.base.PyUPSException` was raised for, (None, None) if it
+    was not raised for one.
+
+    >>> error_code(PyUPSException('Hard-111210:Unavailable', None, None))
+    ('Hard', '111210')
+    >>> error_code(PyUPSException('Something else', None, None))
+    (None, None)
+    """
+    message = exc.args[0] if exc.args else ''
+    if not isinstance(message, basestring) or ':' not in message:
+        return None, None
+    severity, dash, code = message.split(':', 1)[0].partition('-')
+    if not dash:
+        return None, None
+    return severity, code
+
+
+def unsent(exc):
+    """Returns True if the request which failed with the exception surely
+    never reached UPS, or UPS refused it without carrying it out
+
+    >>> unsent(urllib2.URLError(socket.error(errno.ECONNREFUSED, 'Refused')))
+    True
+    >>> unsent(urllib2.URLError(socket.gaierror(-2, 'Name not known')))
+    True
+    >>> unsent(urllib2.URLError(socket.timeout('timed out')))
+    False
+    """
+    if isinstance(exc, urllib2.HTTPError):
+        return exc.code == 503
+    if isinstance(exc, urllib2.URLError):
+        exc = exc.reason
+    if isinstance(exc, socket.gaierror):
+        return True
+    return isinstance(exc, socket.error) and bool(exc.args) and \
+        exc.args[0] in UNSENT_ERRNOS
+
+
+class CircuitBreaker(object):
+    """Counts the transient failures of the requests to an endpoint in a row,
+    and fails requests fast while there were too many, see :mod:`ups.retry`.
+
+    :param failure_threshold: Transient failures in a row which open the
+        breaker
+    :param reset_timeout: Seconds the breaker stays open before it lets
+        probe requests through
+    :param probes: Number of probe requests in flight at the same time
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, probes=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._probing = 0
+        self._lock = Lock()
+
+    def allow(self):
+        """Raises :exc:`CircuitOpenError` if a request must not be sent now,
+        otherwise the request must be followed by a call of :meth:`record`.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(
+                        'Circuit breaker is open', None, None
+                    )
+                self.state, self._probing = HALF_OPEN, 0
+            if self.state == HALF_OPEN:
+                if self._probing >= self.probes:
+                    raise CircuitOpenError(
+                        'Circuit breaker is probing', None, None
+                    )
+                self._probing += 1
+
+    def record(self, failed):
+        "Records whether a request which was allowed failed transiently"
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing -= 1
+            if not failed:
+                self.state, self.failures = CLOSED, 0
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state, self._opened_at = OPEN, time.time()
+
+    def release(self):
+        "Forgets a request which was allowed but never finished"
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing -= 1
+
+
+class _NoBreaker(object):
+    "Stands in for the breaker of endpoints which have none"
+
+    def allow(self):
+        pass
+
+    def record(self, failed):
+        pass
+
+    def release(self):
+        pass
+
+
+class RetryPolicy(object):
+    """Decides which failed requests are retried and when, and keeps the
+    circuit breakers of the endpoints, see :mod:`ups.retry`.
+
+    :param attempts: Attempts made in total, including the first
+    :param backoff: Seconds to pause at most before the first retry, the
+        pause doubles with every retry. The actual pause is a random part
+        of it, so that clients which failed at once do not retry at once.
+    :param max_backoff: Upper limit of the pause
+    :param transient_codes: UPS error codes which are retried
+    :param failure_threshold: See :class:`CircuitBreaker`. Endpoints have
+        no breaker if it is None.
+    :param reset_timeout: See :class:`CircuitBreaker`
+    :param probes: See :class:`CircuitBreaker`
+    """
+
+    def __init__(self, attempts=3, backoff=0.1, max_backoff=2,
+                 transient_codes=TRANSIENT_CODES, failure_threshold=5,
+                 reset_timeout=30, probes=1):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.transient_codes = frozenset(transient_codes)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self._breakers = {}
+        self._lock = Lock()
+
+    def is_transient(self, exc, idempotent=True):
+        """Returns True if the request which failed with the exception may
+        well succeed if it is sent again
+
+        :param idempotent: False if sending the request twice may carry it
+            out twice, in which case failures after it was sent are not
+            retried, see :func:`unsent`
+        """
+        if isinstance(exc, LOCAL_ERRORS):
+            return False
+        if not idempotent and not isinstance(exc, PyUPSException):
+            return unsent(exc)
+        if isinstance(exc, urllib2.HTTPError):
+            return exc.code >= 500
+        if isinstance(exc, (urllib2.URLError, socket.error,
+                            httplib.HTTPException)):
+            return True
+        if isinstance(exc, PyUPSException):
+            severity, code = error_code(exc)
+            return severity == 'Transient' or code in self.transient_codes
+        return False
+
+    def pause(self, retry):
+        "Returns the seconds to pause before the given retry, counted from 0"
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** retry)
+        )
+
+    def _retry_pause(self, retry, deadline):
+        """Returns the pause before the given retry, or None if the attempts
+        are used up or the deadline would pass before the retry is sent
+        """
+        if retry >= self.attempts:
+            return None
+        pause = self.pause(retry - 1)
+        if deadline is not None and deadline.remaining() <= pause:
+            return None
+        return pause
+
+    def breaker(self, url):
+        """Returns the circuit breaker of the endpoint, one which lets every
+        request through if :attr:`failure_threshold` is None
+        """
+        if self.failure_threshold is None:
+            return _NoBreaker()
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(url, CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.probes
+                ))
+        return breaker
+
+    def _failed(self, breaker, exc, idempotent=True):
+        """Records the outcome of an attempt with the breaker and returns
+        True if it is retried. Attempts which failed locally, without
+        reaching UPS, are not recorded.
+        """
+        if exc is None:
+            breaker.record(False)
+            return False
+        if isinstance(exc, LOCAL_ERRORS):
+            breaker.release()
+            return False
+        breaker.record(self.is_transient(exc))
+        return self.is_transient(exc, idempotent)
+
+    def call(self, url, attempt, args=(), deadline=None, idempotent=True):
+        """Calls `attempt` with the arguments until it succeeds, fails for
+        good, the attempts are used up or the
+        :class:`~ups.deadline.Deadline` would pass, and returns its result.
+
+        :param idempotent: See :meth:`is_transient`
+        """
+        breaker = self.breaker(url)
+        for retry in range(1, self.attempts + 1):
+            breaker.allow()
+            try:
+                result = attempt(*args)
+            except Exception, exc:
+                pause = None
+                if self._failed(breaker, exc, idempotent):
+                    pause = self._retry_pause(retry, deadline)
+                if pause is None:
+                    raise
+            else:
+                self._failed(breaker, None)
+                return result
+            time.sleep(pause)
+
+    def call_async(self, url, attempt, schedule, args=(), deadline=None,
+                   idempotent=True):
+        """Non-blocking counterpart of :meth:`call`, where `attempt` returns
+        a :class:`~ups.async_pool.Future`. Returns a future for the outcome
+        of the last attempt.
+
+        :param schedule: A callable which is given a delay, a callback and
+            its arguments and calls the callback after the delay
+        """
+        future = Future()
+        breaker = self.breaker(url)
+
+        def start(retry):
+            if future.done():
+                return
+            try:
+                breaker.allow()
+                sent = attempt(*args)
+            except Exception, exc:
+                return future.set_exception(exc)
+            future.add_done_callback(
+                lambda future: future.cancelled() and sent.cancel()
+            )
+            sent.add_done_callback(lambda sent: done(sent, retry))
+
+        def done(sent, retry):
+            if sent.cancelled():
+                breaker.release()
+                return future.cancel()
+            exc = sent.exception()
+            if exc is None:
+                self._failed(breaker, None)
+                return future.set_result(sent.result())
+            pause = None
+            if self._failed(breaker, exc, idempotent):
+                pause = self._retry_pause(retry, deadline)
+            if pause is None:
+                future.set_exception(exc)
+            else:
+                schedule(pause, start, retry + 1)
+
+        start(1)
+        return future
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+    shipping_engine
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Shipping Engine
+    ~~~~~~~~~~~~~~~
+
+    A shipment takes two round trips to UPS, a ShipmentConfirm and then a
+    ShipmentAccept of its digest, and a wave of thousands of shipments sent
+    one after the other spends nearly all of its time waiting on them. The
+    :class:`ShippingEngine` pipelines the two: a pool of confirm workers
+    confirms shipments and queues their digests for a pool of accept
+    workers, so both stages keep UPS busy at the same time::
+
+        pool = ConnectionPool(maxsize=32)
+        engine = ShippingEngine(
+            ShipmentConfirm(license_no, user_id, password, True, pool=pool),
+            ShipmentAccept(license_no, user_id, password, True, pool=pool),
+            confirm_workers=16, accept_workers=16,
+        )
+
+        def shipped(outcome):
+            if outcome.error is not None:
+                print outcome.index, outcome.stage, outcome.error
+            else:
+                print outcome.index, outcome.results.identification_number
+
+        stats = engine.ship(confirm_requests, shipped)
+
+    The callback is given a :class:`ShipmentOutcome` as soon as each
+    shipment is accepted, or has failed, in the order they complete. It
+    runs on the thread which called :meth:`ShippingEngine.ship`, so it may
+    take its time, e.g. to write the labels.
+
+    All queues are bounded: the input is consumed lazily, at most
+    `queue_size` confirmed shipments wait for an accept worker, and at most
+    `queue_size` outcomes wait for the callback. A slow stage hence slows
+    down the stages before it instead of piling up shipments in memory.
+    Share a connection pool with room for the workers of both stages
+    between the two clients, so that neither stage reconnects.
+
+    A shipment whose confirm failed is not accepted. One whose accept
+    failed keeps its digest, which can be accepted again later. If the
+    callback raises, the engine stops: the shipments in flight are
+    finished, those not accepted yet are dropped, and the error is raised.
+"""
+from __future__ import with_statement
+
+import time
+from Queue import Queue
+from threading import Lock, Thread
+
+from batch import BatchStats
+from deadline import Deadline
+from decoder import ShipmentResults
+from shipping_package import ShipmentConfirm, ShipmentAccept
+
+CONFIRM = 'confirm'
+ACCEPT = 'accept'
+
+
+class ShipmentOutcome(object):
+    """The outcome of a shipment sent by a :class:`ShippingEngine`
+
+    :param index: Position of the shipment in the input
+    :param request: The ShipmentConfirm request element
+    :param digest: The digest of the confirmed shipment, None if confirming
+        it failed
+    :param response: What ShipmentAccept returned, None if the shipment
+        failed
+    :param error: The exception the shipment failed with, None if it was
+        accepted
+    :param stage: The stage the shipment failed in, `confirm` or `accept`,
+        None if it was accepted
+    :param latency: Seconds from sending the confirm until the shipment was
+        accepted or failed
+    """
+
+    __slots__ = (
+        'index', 'request', 'digest', 'response', 'error', 'stage',
+        'latency', 'started',
+    )
+
+    def __init__(self, index, request):
+        self.index = index
+        self.request = request
+        self.digest = None
+        self.response = None
+        self.error = None
+        self.stage = None
+        self.latency = None
+        self.started = None
+
+    def __repr__(self):
+        if self.error is None:
+            return '<ShipmentOutcome %d ok>' % self.index
+        return '<ShipmentOutcome %d %s %r>' % (
+            self.index, self.stage, self.error
+        )
+
+    @property
+    def results(self):
+        """The :class:`~ups.decoder.ShipmentResults` of the accepted
+        shipment, with its charges and the tracking numbers and labels of
+        its packages, whether the accept client is typed or not. None if the
+        shipment failed.
+        """
+        response = self.response
+        if isinstance(response, tuple):
+            response = response[1]
+        if response is None or isinstance(response, ShipmentResults):
+            return response
+        return ShipmentResults.from_element(response.ShipmentResults)
+
+    @property
+    def tracking_numbers(self):
+        "The tracking numbers of the packages of the accepted shipment"
+        results = self.results
+        return results and [
+            package.tracking_number for package in results.packages
+        ]
+
+    def fail(self, stage, error):
+        "Records the error the shipment failed with in the stage"
+        self.stage = stage
+        self.error = error
+        return self.done()
+
+    def done(self):
+        "Sets the latency of the shipment, once it is done"
+        self.latency = time.time() - self.started
+        return self
+
+
+class ShippingEngine(object):
+    """Pipelines the confirms and accepts of many shipments, see
+    :mod:`ups.shipping_engine`
+
+    :param confirm_api: The :class:`~ups.shipping_package.ShipmentConfirm`
+        client the shipments are confirmed with
+    :param accept_api: The :class:`~ups.shipping_package.ShipmentAccept`
+        client the confirmed shipments are accepted with
+    :param confirm_workers: Number of confirms in flight at the same time
+    :param accept_workers: Number of accepts in flight at the same time
+    :param queue_size: Number of shipments which wait between the stages at
+        most, defaults to twice the number of accept workers
+    :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by which
+        each wave passed to :meth:`ship` must be finished
+    """
+
+    def __init__(self, confirm_api, accept_api, confirm_workers=8,
+                 accept_workers=8, queue_size=None, deadline=None):
+        self.confirm_api = confirm_api
+        self.accept_api = accept_api
+        self.confirm_workers = confirm_workers
+        self.accept_workers = accept_workers
+        self.queue_size = queue_size or 2 * accept_workers
+        self.deadline = deadline
+
+    def ship(self, requests, callback=None):
+        """Confirms and accepts the shipments and calls the callback with
+        the :class:`ShipmentOutcome` of each of them as it completes.
+        Returns the :class:`~ups.batch.BatchStats` of the wave once all of
+        them are done, which are also logged.
+
+        :param requests: An iterable of ShipmentConfirm request elements,
+            as passed to :meth:`~ups.shipping_package.ShipmentConfirm.request`
+        :param callback: A callable which is given each
+            :class:`ShipmentOutcome`
+        """
+        start = time.time()
+        latencies, errors = [], 0
+        wave = _Wave(self, requests)
+        wave.start()
+        try:
+            for outcome in wave.outcomes():
+                latencies.append(outcome.latency)
+                errors += outcome.error is not None
+                if callback is not None:
+                    callback(outcome)
+        finally:
+            wave.stop()
+        stats = BatchStats(latencies, errors, time.time() - start)
+        self.confirm_api.logger.info("Shipping wave finished: %s", stats)
+        return stats
+
+
+class _Wave(object):
+    "The stages and queues of a call of :meth:`ShippingEngine.ship`"
+
+    def __init__(self, engine, requests):
+        self.engine = engine
+        self.requests = requests
+        self.deadline = Deadline.of(engine.deadline)
+        self.stopped = False
+        self.finished = False
+        self.error = None
+
+        self._confirms = Queue(engine.queue_size)
+        self._accepts = Queue(engine.queue_size)
+        self._outcomes = Queue(engine.queue_size)
+        self._running = {
+            CONFIRM: engine.confirm_workers, ACCEPT: engine.accept_workers,
+        }
+        self._lock = Lock()
+
+    def start(self):
+        engine = self.engine
+        threads = [Thread(target=self._feed)] + [
+            Thread(target=self._confirm) for i in range(engine.confirm_workers)
+        ] + [
+            Thread(target=self._accept) for i in range(engine.accept_workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+    def _feed(self):
+        "Puts the shipments on the confirm queue as there is room"
+        try:
+            for index, request in enumerate(self.requests):
+                if self.stopped:
+                    break
+                self._confirms.put(ShipmentOutcome(index, request))
+        except Exception, exc:
+            self.error = exc
+        for i in range(self.engine.confirm_workers):
+            self._confirms.put(None)
+
+    def _exit(self, stage, queue, workers):
+        """Lets the workers of the next stage go once the last worker of the
+        stage exits
+        """
+        with self._lock:
+            self._running[stage] -= 1
+            last = not self._running[stage]
+        if last:
+            for i in range(workers):
+                queue.put(None)
+
+    def _confirm(self):
+        "Confirms shipments and queues them for acceptance"
+        while True:
+            outcome = self._confirms.get()
+            if outcome is None:
+                return self._exit(
+                    CONFIRM, self._accepts, self.engine.accept_workers
+                )
+            if self.stopped:
+                continue
+            outcome.started = time.time()
+            try:
+                outcome.digest = ShipmentConfirm.extract_digest(
+                    self.engine.confirm_api.request(
+                        outcome.request, self.deadline
+                    )
+                )
+            except Exception, exc:
+                self._outcomes.put(outcome.fail(CONFIRM, exc))
+            else:
+                self._accepts.put(outcome)
+
+    def _accept(self):
+        "Accepts confirmed shipments"
+        while True:
+            outcome = self._accepts.get()
+            if outcome is None:
+                return self._exit(ACCEPT, self._outcomes, 1)
+            if self.stopped:
+                continue
+            try:
+                outcome.response = self.engine.accept_api.request(
+                    ShipmentAccept.shipment_accept_request_type(
+                        outcome.digest
+                    ), self.deadline
+                )
+            except Exception, exc:
+                self._outcomes.put(outcome.fail(ACCEPT, exc))
+            else:
+                self._outcomes.put(outcome.done())
+
+    def outcomes(self):
+        "Yields the outcomes as they complete"
+        while True:
+            outcome = self._outcomes.get()
+            if outcome is None:
+                self.finished = True
+                if self.error is not None:
+                    raise self.error
+                return
+            yield outcome
+
+    def stop(self):
+        """Stops the wave, and waits for the shipments in flight, unless
+        all of them are done already
+        """
+        if self.finished:
+            return
+        self.stopped = True
+        while self._outcomes.get() is not None:
+            pass
+        self.finished = True
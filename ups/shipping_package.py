@@ -202,15 +202,24 @@
     python object. See UPS documentation for more details on what is included
     in a response.
 
+    Labels make the response to a shipment with many packages large. Use
+    :meth:`ShipmentAccept.request_labels` to write them to files while the
+    response is received instead, see :mod:`ups.labels`.
+
 """
 from __future__ import with_statement
 
+import time
+from copy import deepcopy
 from threading import Lock
 
-from lxml import etree, objectify
+from lxml import etree
 from lxml.builder import E
 
 from base import BaseAPIClient, not_implemented_yet
+from decoder import decode_shipment_accept
+from labels import LabelTarget
+from deadline import Deadline
 
 
 _logger_lock = Lock()
@@ -575,6 +584,10 @@ class ShipmentConfirm(ShipmentMixin, BaseAPIClient):
     # the address entered is correct to avoid an address correction fee.
     RequestOption = E.RequestOption('nonvalidate')
 
+    # Requests create a shipment and are only retried if they were not
+    # sent, see ups.retry
+    idempotent = False
+
     # TransactionReference identifies transactions between client and server.
     TransactionReference = E.TransactionReference(
         E.CustomerContext('unspecified')
@@ -684,10 +697,12 @@ class ShipmentConfirm(ShipmentMixin, BaseAPIClient):
         """
 
         # /ShipmentConfirmRequest/Request
+        # The shared elements are copied, since lxml would move them out
+        # of the requests built before
         request = E.Request(
-            cls.RequestAction,
-            cls.RequestOption,
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(cls.RequestOption),
+            deepcopy(cls.TransactionReference),
         )
 
         # Guess the LabelSpecification if nothing is provided
@@ -732,34 +747,16 @@ class ShipmentConfirm(ShipmentMixin, BaseAPIClient):
             'ShipConfirm']
         )
 
-    def request(self, shipment_confirm_request):
+    def request(self, shipment_confirm_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param shipment_confirm_request: lxml element with data for the
             shipment_confirm_request
-
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
         """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(shipment_confirm_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        # Return request ?
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        return self._request(shipment_confirm_request, deadline)
 
     @classmethod
     def extract_digest(cls, response):
@@ -776,6 +773,9 @@ class ShipmentAccept(BaseAPIClient):
     # Indicates the action to be taken by the XML service.
     RequestAction = E.RequestAction('ShipAccept')
 
+    # Decodes the response if the client is typed, see ups.decoder
+    decoder = staticmethod(decode_shipment_accept)
+
     # Optional Processing
     # nonvalidate = No address validation.
     # validate = Fail on failed address validation.
@@ -785,6 +785,10 @@ class ShipmentAccept(BaseAPIClient):
     # the address entered is correct to avoid an address correction fee.
     RequestOption = E.RequestOption('nonvalidate')
 
+    # Requests buy the labels and are only retried if they were not sent,
+    # see ups.retry
+    idempotent = False
+
     # TransactionReference identifies transactions between client and server.
     TransactionReference = E.TransactionReference(
         E.CustomerContext('unspecified')
@@ -796,9 +800,9 @@ class ShipmentAccept(BaseAPIClient):
         """
         # /ShipmentAcceptRequest/Request
         request = E.Request(
-            cls.RequestAction,
-            cls.RequestOption,
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(cls.RequestOption),
+            deepcopy(cls.TransactionReference),
         )
 
         # /ShipmentAcceptRequest/ShipmentDigest
@@ -814,32 +818,82 @@ class ShipmentAccept(BaseAPIClient):
             'ShipAccept']
         )
 
-    def request(self, shipment_accept_request):
+    def request(self, shipment_accept_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param shipment_confirm_request: lxml element with data for the
                                          `shipment_confirm_request`.
-        """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(shipment_accept_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
+        """
+        return self._request(shipment_accept_request, deadline)
+
+    def request_labels(self, shipment_accept_request, label_output,
+                       html_output=None, deadline=None):
+        """Sends the request and writes the labels of the packages to their
+        output while the response is received, see :mod:`ups.labels`.
+        Returns a :class:`~ups.decoder.ShipmentResults` whose packages tell
+        where their labels went, whether the client is typed or not.
+
+        Responses are never cached, nor shared with concurrent requests.
+
+        :param shipment_accept_request: lxml element with data for the
+                                        `shipment_accept_request`.
+        :param label_output: A path or callable the labels are written to
+        :param html_output: A path or callable the HTML labels are written
+                            to. They are skipped if not given.
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished. The labels are
+                         written while the response is received, so it
+                         bounds writing them as well.
+        """
+        deadline = Deadline.of(deadline)
+        sample = self._start(shipment_accept_request)
+        full_request = self._serialize(shipment_accept_request, sample)
+        args = (full_request, label_output, html_output, deadline, sample)
+        try:
+            if self.retry_policy is None:
+                results = self._stream(*args)
+            else:
+                results = self.retry_policy.call(
+                    self.url, self._stream, args, deadline, self.idempotent
+                )
+        except Exception, exc:
+            self._finish(sample, exc)
+            raise
+        self._finish(sample)
+
+        if self.debug:
+            self.logger.debug("Response Streamed: %s", results)
+        return results
+
+    def _stream(self, full_request, label_output, html_output=None,
+                deadline=None, sample=None):
+        """Sends the full request once, like `_attempt`, and writes the
+        labels while the response is received
+        """
+        wait = self.throttle(deadline)
+        if wait:
+            time.sleep(wait)
+        attempt = self._sample(full_request, sample)
+        target = LabelTarget(label_output, html_output, full_request)
+        parser = etree.XMLParser(
+            target=target, resolve_entities=False, huge_tree=True
+        )
+        transport = self.transport or self.pool
+        try:
+            self._timed(
+                attempt, 'network', transport.urlopen, self.url, full_request,
+                None, deadline and deadline.timeout(transport.timeout),
+                parser.feed, deadline
+            )
+            results = self._timed(attempt, 'parse', parser.close)
+        finally:
+            target.close_files()
+        if attempt is not None:
+            attempt.record()
+        return results
 
 
 class ShipmentVoid(BaseAPIClient):
@@ -850,6 +904,10 @@ class ShipmentVoid(BaseAPIClient):
 
     RequestOption = E.RequestOption('')
 
+    # A void sent again fails for the shipment voided by the first, so
+    # requests are only retried if they were not sent, see ups.retry
+    idempotent = False
+
     # TransactionReference identifies transactions between client and server.
     TransactionReference = E.TransactionReference(
         E.CustomerContext('unspecified')
@@ -861,9 +919,9 @@ class ShipmentVoid(BaseAPIClient):
 
         # /ShipmentVoidRequest/Request
         request = E.Request(
-            cls.RequestAction,
-            cls.RequestOption,
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(cls.RequestOption),
+            deepcopy(cls.TransactionReference),
         )
 
         expanded_void_shipment = [
@@ -885,32 +943,16 @@ class ShipmentVoid(BaseAPIClient):
             'Void']
         )
 
-    def request(self, shipment_void_request):
+    def request(self, shipment_void_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param shipment_void_request: lxml element with data for the
                                       `shipment_void_request`.
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
         """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(shipment_void_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        return self._request(shipment_void_request, deadline)
 
 
 if __name__ == '__main__':
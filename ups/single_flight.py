@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    single_flight
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Request Coalescing
+    ~~~~~~~~~~~~~~~~~~
+
+    A store front often asks UPS the very same question several times within
+    a few milliseconds, for example when several widgets render the same
+    cart. With a :class:`SingleFlight` given to the API clients, identical
+    requests which are in flight at the same time share one call to UPS and
+    one parsed response::
+
+        single_flight = SingleFlight()
+        rating_api = RatingService(
+            license_no, user_id, password, True, single_flight=single_flight
+        )
+
+    Requests are identical if the URL and the serialized XML document are
+    byte for byte the same. The same :class:`SingleFlight` may be shared by
+    several clients, and by their blocking and non-blocking requests alike.
+
+    .. note::
+        All callers get the very same response object, so it should be
+        treated as read-only.
+"""
+from __future__ import with_statement
+
+import hashlib
+from threading import Lock
+
+from async_pool import Future
+
+
+def fingerprint(url, data):
+    """Returns the key identical requests are coalesced under
+
+    >>> fingerprint('https://x/Rate', '<a/>') == fingerprint('https://x/Rate',
+    ...     '<a/>')
+    True
+    >>> fingerprint('https://x/Rate', '<a/>') == fingerprint('https://x/AV',
+    ...     '<a/>')
+    False
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha1(url + '\0' + data).hexdigest()
+
+
+def _follow_into(source, target):
+    "Resolves the target future with the outcome of the source future"
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _follow(future):
+    """Returns a new future which resolves with the given one. Cancelling it
+    only detaches the caller, the shared call goes on for the others.
+    """
+    follower = Future()
+    future.add_done_callback(lambda future: _follow_into(future, follower))
+    return follower
+
+
+class SingleFlight(object):
+    """Keeps track of the calls in flight, so that identical calls made in
+    the meantime wait for the same result instead of making their own.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+        #: Number of calls which were made, and which were coalesced
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _join(self, key):
+        """Returns the future of the call in flight for the key and False, or
+        a new future and True if the caller has to make the call.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.calls += 1
+            return future, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def call(self, key, function, *args):
+        """Calls the function in the calling thread, unless an identical call
+        is in flight already, in which case its outcome is waited for and
+        returned (or raised) instead.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = function(*args)
+        except Exception, exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._forget(key, future)
+
+    def call_async(self, key, function, *args):
+        """Non-blocking counterpart of :meth:`call`. The function must return
+        a :class:`~ups.async_pool.Future`, and a future following the shared
+        call is returned.
+        """
+        future, leader = self._join(key)
+        if leader:
+            try:
+                started = function(*args)
+            except Exception, exc:
+                self._forget(key, future)
+                future.set_exception(exc)
+                raise
+            future.add_done_callback(lambda f: self._forget(key, f))
+            started.add_done_callback(
+                lambda started: _follow_into(started, future)
+            )
+        return _follow(future)
@@ -13,6 +13,26 @@ from .test_address_validation import TestAddressValidation
 from .test_rating_package import TestRatingPackage
 from .test_worldship_xml import TestWorldShipXML
 from .test_time_in_transit import TestTimeInTransit
+from .test_pool import TestConnectionPool
+from .test_async_pool import TestFuture, TestAsyncConnectionPool
+from .test_batch import TestBatch
+from .test_single_flight import TestSingleFlight
+from .test_cache import TestTTLCache, TestRatingCache, \
+    TestAddressValidationCache, TestTimeInTransitCache
+from .test_logging import TestLogging
+from .test_decoder import TestDecoder
+from .test_labels import TestLabels
+from .test_label_pipeline import TestLabelPipeline
+from .test_ratelimit import TestRateLimiter
+from .test_retry import TestRetry
+from .test_hedging import TestHedging
+from .test_deadline import TestDeadline
+from .test_fake_server import TestFakeServer
+from .test_cassette import TestCassette
+from .test_metrics import TestMetrics
+from .test_tracing import TestTracing
+from .test_shipping_engine import TestShippingEngine
+from .test_journal import TestJournal
 
 
 def suite():
@@ -23,5 +43,30 @@ def suite():
         unittest.TestLoader().loadTestsFromTestCase(TestRatingPackage),
         unittest.TestLoader().loadTestsFromTestCase(TestWorldShipXML),
         unittest.TestLoader().loadTestsFromTestCase(TestTimeInTransit),
+        unittest.TestLoader().loadTestsFromTestCase(TestConnectionPool),
+        unittest.TestLoader().loadTestsFromTestCase(TestFuture),
+        unittest.TestLoader().loadTestsFromTestCase(TestAsyncConnectionPool),
+        unittest.TestLoader().loadTestsFromTestCase(TestBatch),
+        unittest.TestLoader().loadTestsFromTestCase(TestSingleFlight),
+        unittest.TestLoader().loadTestsFromTestCase(TestTTLCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestRatingCache),
+        unittest.TestLoader().loadTestsFromTestCase(
+            TestAddressValidationCache
+        ),
+        unittest.TestLoader().loadTestsFromTestCase(TestTimeInTransitCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestLogging),
+        unittest.TestLoader().loadTestsFromTestCase(TestDecoder),
+        unittest.TestLoader().loadTestsFromTestCase(TestLabels),
+        unittest.TestLoader().loadTestsFromTestCase(TestLabelPipeline),
+        unittest.TestLoader().loadTestsFromTestCase(TestRateLimiter),
+        unittest.TestLoader().loadTestsFromTestCase(TestRetry),
+        unittest.TestLoader().loadTestsFromTestCase(TestHedging),
+        unittest.TestLoader().loadTestsFromTestCase(TestDeadline),
+        unittest.TestLoader().loadTestsFromTestCase(TestFakeServer),
+        unittest.TestLoader().loadTestsFromTestCase(TestCassette),
+        unittest.TestLoader().loadTestsFromTestCase(TestMetrics),
+        unittest.TestLoader().loadTestsFromTestCase(TestTracing),
+        unittest.TestLoader().loadTestsFromTestCase(TestShippingEngine),
+        unittest.TestLoader().loadTestsFromTestCase(TestJournal),
     ])
     return suite
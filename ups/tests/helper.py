@@ -7,9 +7,53 @@
     :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Limited
     :license: AGPL, see LICENSE for more details.
 """
+import os
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+from ups.cassette import Cassette, REDACTED, REPLAY
 from ups.shipping_package import ShipmentConfirm
 
 
+#: Mode of the cassettes the tests talking to UPS run through, see
+#: :mod:`ups.cassette`. They talk to the UPS sandbox if it is not set, e.g.
+#: `UPS_CASSETTE=record` records the responses of the sandbox and
+#: `UPS_CASSETTE=replay` runs the tests offline.
+CASSETTE_MODE = os.environ.get('UPS_CASSETTE')
+
+#: The directory of the cassettes. Those committed are synthetic, recorded
+#: from :class:`~ups.fake_server.FakeUPS` (see the README in it), record
+#: them again from the sandbox to replay what UPS answers.
+CASSETTES = os.path.join(os.path.dirname(__file__), 'cassettes')
+
+#: The environment the UPS credentials are taken from. Replayed tests do
+#: without them, since the cassettes hold none.
+UPS_ENVIRON = os.environ
+if CASSETTE_MODE == REPLAY:
+    UPS_ENVIRON = dict.fromkeys([
+        'UPS_LICENSE_NO', 'UPS_SHIPPER_NO', 'UPS_USER_ID', 'UPS_PASSWORD',
+    ], REDACTED)
+    UPS_ENVIRON.update(os.environ)
+
+_cassettes = {}
+
+
+def cassette(name):
+    """Returns the :class:`~ups.cassette.Cassette` of the given name in the
+    :data:`CASSETTE_MODE`, or None if the tests talk to UPS itself
+    """
+    if CASSETTE_MODE is None:
+        return None
+    if name not in _cassettes:
+        if CASSETTE_MODE != REPLAY and not os.path.isdir(CASSETTES):
+            os.makedirs(CASSETTES)
+        _cassettes[name] = Cassette(
+            os.path.join(CASSETTES, name + '.cassette'), CASSETTE_MODE
+        )
+    return _cassettes[name]
+
+
 class ShippingPackageHelper(object):
     """A convenient helper class to execute the boiler plate code which gener-
     ates the TestCode data to keep the Test Suites more readable and easy to
@@ -173,3 +217,66 @@ class ShippingPackageHelper(object):
             )
         else:
             raise Exception("Type %s is not supported" % type)
+
+
+class LocalServer(object):
+    """A tiny HTTP/1.1 server running in a background thread which answers
+    every POST with a canned body. It counts the TCP connections it accepts,
+    which lets the tests check that connections are really reused.
+
+    :param body: The body returned for every request, or a callable which
+        gets the request path and body and returns the response body.
+    """
+
+    def __init__(self, body='<Response/>', status=200):
+        local_server = self
+        self.body = body
+        self.status = status
+        self.connections = 0
+        self.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                local_server.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers['Content-Length']))
+                local_server.requests.append((self.path, data))
+                body = local_server.body
+                if callable(body):
+                    body = body(self.path, data)
+                self.send_response(local_server.status)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self):
+        "The base URL of the server, use it as the sandbox base_url"
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        thread = Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.01}
+        )
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -7,13 +7,13 @@
     :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
     :license: AGPL, see LICENSE for more details.
 """
-import os
 import logging
 
 import unittest2 as unittest
 from lxml import etree
 
 from ups.address_validation import AddressValidation
+from helper import UPS_ENVIRON, cassette
 
 
 class TestAddressValidation(unittest.TestCase):
@@ -25,13 +25,13 @@ class TestAddressValidation(unittest.TestCase):
     def setUpClass(self):
         """Check if the variables for initialising the test case is available
         in the environment"""
-        assert 'UPS_LICENSE_NO' in os.environ, \
+        assert 'UPS_LICENSE_NO' in UPS_ENVIRON, \
             "UPS_LICENSE_NO not given. Hint:Use export UPS_LICENSE_NO=<number>"
-        assert 'UPS_SHIPPER_NO' in os.environ, \
+        assert 'UPS_SHIPPER_NO' in UPS_ENVIRON, \
             "UPS_SHIPPER_NO not given. Hint:Use export UPS_SHIPPER_NO=<number>"
-        assert 'UPS_USER_ID' in os.environ, \
+        assert 'UPS_USER_ID' in UPS_ENVIRON, \
             "UPS_USER_ID not given. Hint:Use export UPS_USER_ID=<user_id>"
-        assert 'UPS_PASSWORD' in os.environ, \
+        assert 'UPS_PASSWORD' in UPS_ENVIRON, \
             "UPS_PASSWORD not given. Hint:Use export UPS_PASSWORD=<password>"
 
     def setUp(self):
@@ -39,10 +39,11 @@ class TestAddressValidation(unittest.TestCase):
         """
         logging.disable(logging.DEBUG)
         self.address_validation = AddressValidation(
-            os.environ['UPS_LICENSE_NO'],
-            os.environ['UPS_USER_ID'],
-            os.environ['UPS_PASSWORD'],
-            True            # Test must be performed in sandbox anyway
+            UPS_ENVIRON['UPS_LICENSE_NO'],
+            UPS_ENVIRON['UPS_USER_ID'],
+            UPS_ENVIRON['UPS_PASSWORD'],
+            True,           # Test must be performed in sandbox anyway
+            transport=cassette('address_validation'),
         )
 
     def test_010_address_validation_true(self):
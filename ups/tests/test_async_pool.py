@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+    test_async_pool
+
+    Test suite for the non-blocking connection pool and the async requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import time
+import urllib2
+
+import unittest2 as unittest
+
+from ups.async_pool import AsyncConnectionPool, EventLoop, Future, \
+    CancelledError, TimeoutError
+from ups.base import PyUPSException
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+ERROR_RESPONSE = """<RatingServiceSelectionResponse>
+  <Response>
+    <ResponseStatusCode>0</ResponseStatusCode>
+    <Error>
+      <ErrorSeverity>Hard</ErrorSeverity>
+      <ErrorCode>250003</ErrorCode>
+      <ErrorDescription>Invalid Access License number</ErrorDescription>
+    </Error>
+  </Response>
+</RatingServiceSelectionResponse>"""
+
+
+class TestFuture(unittest.TestCase):
+    """
+    Test the :class:`Future`
+    """
+
+    def test_0010_result(self):
+        "Callbacks are called and the result is returned"
+        future = Future()
+        called = []
+        future.add_done_callback(called.append)
+        self.assertFalse(future.done())
+        with self.assertRaises(TimeoutError):
+            future.result(timeout=0.01)
+        future.set_result(42)
+        self.assertEqual(future.result(), 42)
+        self.assertEqual(called, [future])
+        self.assertFalse(future.set_result(43))
+
+    def test_0020_exception_and_cancel(self):
+        "Exceptions are raised and cancelled futures say so"
+        future = Future()
+        future.set_exception(ValueError('x'))
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        with self.assertRaises(ValueError):
+            future.result()
+
+        future = Future()
+        self.assertTrue(future.cancel())
+        self.assertTrue(future.cancelled())
+        with self.assertRaises(CancelledError):
+            future.result()
+
+
+class TestAsyncConnectionPool(unittest.TestCase):
+    """
+    Test the :class:`AsyncConnectionPool` against a local server
+    """
+
+    def setUp(self):
+        self.server = LocalServer(
+            lambda path, data: '<Response>%s</Response>' % data
+        ).start()
+        self.loop = EventLoop().start()
+
+    def tearDown(self):
+        self.loop.stop()
+        self.server.stop()
+
+    def test_0010_many_in_flight(self):
+        "Many concurrent requests share a few keep-alive connections"
+        pool = AsyncConnectionPool(self.loop, max_connections=4)
+        futures = [
+            pool.urlopen(self.server.url + '/Rate', str(i))
+            for i in range(200)
+        ]
+        self.assertEqual(
+            [f.result(timeout=10) for f in futures],
+            ['<Response>%d</Response>' % i for i in range(200)]
+        )
+        self.assertTrue(self.server.connections <= 4)
+
+        # Sequential requests reuse the idle connections
+        connections = self.server.connections
+        for i in range(5):
+            pool.urlopen(self.server.url + '/Rate', 'x').result(timeout=10)
+        self.assertEqual(self.server.connections, connections)
+        pool.close()
+
+    def test_0020_http_error(self):
+        "HTTP errors fail the future like urllib2 raises them"
+        self.server.status = 500
+        pool = AsyncConnectionPool(self.loop)
+        with self.assertRaises(urllib2.HTTPError):
+            pool.urlopen(self.server.url + '/Rate', 'x').result(timeout=10)
+
+    def test_0030_timeout(self):
+        "Requests which are not answered in time fail with a timeout"
+        self.server.body = lambda path, data: time.sleep(0.5) or 'late'
+        pool = AsyncConnectionPool(self.loop, timeout=0.1)
+        with self.assertRaises(urllib2.URLError):
+            pool.urlopen(self.server.url + '/Rate', 'x').result(timeout=10)
+
+    def test_0040_connection_refused(self):
+        "Unreachable servers fail the future with a URLError"
+        url = self.server.url
+        self.server.stop()
+        pool = AsyncConnectionPool(self.loop)
+        with self.assertRaises(urllib2.URLError):
+            pool.urlopen(url + '/Rate', 'x').result(timeout=10)
+        self.server = LocalServer().start()
+
+    def test_0050_cancel(self):
+        "A cancelled request frees its connection for the next one"
+        self.server.body = lambda path, data: time.sleep(0.2) or data
+        pool = AsyncConnectionPool(self.loop, max_connections=1)
+        slow = pool.urlopen(self.server.url + '/Rate', 'slow')
+        queued = pool.urlopen(self.server.url + '/Rate', 'queued')
+        slow.cancel()
+        self.assertEqual(queued.result(timeout=10), 'queued')
+
+    def test_0060_request_async(self):
+        "request_async resolves to the parsed response or raises the error"
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': self.server.url}
+
+        api = LocalRatingService(
+            'license', 'user', 'pass', True,
+            async_pool=AsyncConnectionPool(self.loop)
+        )
+        self.server.body = '<RatingServiceSelectionResponse/>'
+        request = RatingService.rating_request_type(
+            RatingService.shipper_type(Name='Openlabs')
+        )
+        response = api.request_async(request).result(timeout=10)
+        self.assertEqual(response.tag, 'RatingServiceSelectionResponse')
+
+        self.server.body = ERROR_RESPONSE
+        with self.assertRaises(PyUPSException):
+            api.request_async(request).result(timeout=10)
+
+    def test_0070_no_resend(self):
+        "A request lost after it was written to an idle connection fails"
+
+        def body(path, data):
+            if data == 'lost':
+                raise ValueError('Connection dropped')
+            return data
+        self.server.body = body
+        self.server.server.handle_error = lambda request, address: None
+
+        pool = AsyncConnectionPool(self.loop)
+        pool.urlopen(self.server.url + '/Ship', 'data').result(timeout=10)
+        with self.assertRaises(urllib2.URLError):
+            pool.urlopen(self.server.url + '/Ship', 'lost').result(timeout=10)
+        self.assertEqual(
+            [data for path, data in self.server.requests], ['data', 'lost']
+        )
+        pool.close()
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestFuture),
+        unittest.TestLoader().loadTestsFromTestCase(TestAsyncConnectionPool),
+    ])
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
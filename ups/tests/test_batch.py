@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+    test_batch
+
+    Test suite for the batch requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import random
+import time
+
+import unittest2 as unittest
+
+from ups.base import PyUPSException
+from ups.address_validation import AddressValidation
+from helper import LocalServer
+
+
+ERROR_RESPONSE = """<AddressValidationResponse>
+  <Response>
+    <ResponseStatusCode>0</ResponseStatusCode>
+    <Error>
+      <ErrorSeverity>Hard</ErrorSeverity>
+      <ErrorCode>20002</ErrorCode>
+      <ErrorDescription>Invalid postal code</ErrorDescription>
+    </Error>
+  </Response>
+</AddressValidationResponse>"""
+
+
+def respond(path, data):
+    "Answers with the postal code after a random delay, fails for 00000"
+    time.sleep(random.random() * 0.01)
+    if '<PostalCode>00000</PostalCode>' in data:
+        return ERROR_RESPONSE
+    postal_code = data.split('<PostalCode>')[1].split('<')[0]
+    return (
+        '<AddressValidationResponse><PostalCode>%s</PostalCode>'
+        '</AddressValidationResponse>' % postal_code
+    )
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Test :meth:`BatchMixin.request_many`
+    """
+
+    def setUp(self):
+        self.server = LocalServer(respond).start()
+
+        class LocalAddressValidation(AddressValidation):
+            base_url = {'sandbox': self.server.url}
+
+        self.api = LocalAddressValidation('license', 'user', 'pass', True)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def get_requests(self, count):
+        for i in xrange(count):
+            yield AddressValidation.request_type(
+                CountryCode='US', PostalCode='%05d' % i
+            )
+
+    def test_0010_ordered(self):
+        "Results are yielded in input order with errors captured"
+        batch = self.api.request_many(self.get_requests(50), workers=8)
+        results = list(batch)
+        self.assertEqual([r.index for r in results], range(50))
+        self.assertTrue(isinstance(results[0].error, PyUPSException))
+        for result in results[1:]:
+            self.assertEqual(result.error, None)
+            self.assertEqual(
+                result.response.PostalCode.text, '%05d' % result.index
+            )
+        self.assertEqual(batch.stats.count, 50)
+        self.assertEqual(batch.stats.errors, 1)
+        # Requests built ahead of the window keep all their elements
+        for path, data in self.server.requests:
+            self.assertTrue('<RequestAction>AV</RequestAction>' in data)
+        self.assertTrue(batch.stats.p50 <= batch.stats.p99)
+        self.assertTrue(batch.stats.throughput > 0)
+
+    def test_0020_as_completed(self):
+        "Unordered batches yield every result exactly once"
+        batch = self.api.request_many(
+            self.get_requests(50), workers=8, ordered=False
+        )
+        self.assertEqual(sorted(r.index for r in batch), range(50))
+        self.assertEqual(batch.stats.count, 50)
+
+    def test_0030_stop_early(self):
+        "Breaking out of a batch stops sending the remaining requests"
+        batch = self.api.request_many(self.get_requests(1000), workers=2)
+        for result in batch:
+            if result.index == 5:
+                break
+        time.sleep(0.1)
+        self.assertTrue(len(self.server.requests) < 100)
+        self.assertEqual(batch.stats, None)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestBatch)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
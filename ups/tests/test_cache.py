@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+    test_cache
+
+    Test suite for the response caches
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import unittest2 as unittest
+from lxml.builder import E
+
+from ups.async_pool import AsyncConnectionPool, EventLoop
+from ups.cache import TTLCache, SQLiteCache, canonical_key
+from ups.rating_package import RatingService
+from ups.address_validation import AddressValidation
+from ups.time_in_transit import TimeInTransit
+from helper import LocalServer
+
+
+class TestTTLCache(unittest.TestCase):
+    """
+    Test the :class:`TTLCache`
+    """
+
+    def test_0010_lru(self):
+        "The least recently used entries are evicted"
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {
+            'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1,
+            'evictions': 1, 'expirations': 0,
+        })
+
+    def test_0020_ttl(self):
+        "Entries expire after the time to live, or sooner at the given time"
+        cache = TTLCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, expires=time.time() + 0.05)
+        short = TTLCache(ttl=0.05)
+        short.set('a', 1, expires=time.time() + 60)
+        time.sleep(0.1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(short.get('a'), None)
+
+    def test_0030_canonical_key(self):
+        "Keys do not depend on the order of the elements"
+        self.assertEqual(
+            canonical_key('url', E.Shipment(E.A('1'), E.B(E.C('2')))),
+            canonical_key('url', E.Shipment(E.B(E.C('2')), E.A('1'))),
+        )
+        self.assertNotEqual(
+            canonical_key('url', E.Shipment(E.A('1'))),
+            canonical_key('other', E.Shipment(E.A('1'))),
+        )
+        self.assertNotEqual(
+            canonical_key('url', E.Shipment(E.A('<B>2</B>'))),
+            canonical_key('url', E.Shipment(E.A(E.B('2')))),
+        )
+
+
+class TestRatingCache(unittest.TestCase):
+    """
+    Test the cache in front of the :class:`RatingService`
+    """
+
+    def setUp(self):
+        self.server = LocalServer('<RatingServiceSelectionResponse/>').start()
+        self.loop = EventLoop().start()
+        self.cache = TTLCache()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': self.server.url}
+
+        self.api = LocalRatingService(
+            'license', 'user', 'pass', True, cache=self.cache,
+            async_pool=AsyncConnectionPool(self.loop),
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.loop.stop()
+        self.server.stop()
+
+    def get_request(self, **kwargs):
+        return RatingService.rating_request_type(
+            RatingService.ship_to_type(**kwargs)
+        )
+
+    def test_0010_hit(self):
+        "Repeated rate requests are answered from the cache"
+        response = self.api.request(
+            self.get_request(CompanyName='Apple', AttentionName='Tim')
+        )
+        self.assertTrue(
+            self.api.request(
+                self.get_request(AttentionName='Tim', CompanyName='Apple')
+            ) is response
+        )
+        self.assertTrue(
+            self.api.request_async(
+                self.get_request(CompanyName='Apple', AttentionName='Tim')
+            ).result(timeout=10) is response
+        )
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_0020_miss(self):
+        "Different requests are sent to UPS"
+        self.api.request_async(
+            self.get_request(CompanyName='Apple')
+        ).result(timeout=10)
+        self.api.request(self.get_request(CompanyName='Apple'))
+        self.api.request(self.get_request(CompanyName='Google'))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.cache.misses, 2)
+
+
+class TestAddressValidationCache(unittest.TestCase):
+    """
+    Test the :class:`SQLiteCache` in front of the :class:`AddressValidation`
+    """
+
+    def setUp(self):
+        self.server = LocalServer(
+            '<AddressValidationResponse><Quality>1.0</Quality>'
+            '</AddressValidationResponse>'
+        ).start()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'av.sqlite')
+
+        class LocalAddressValidation(AddressValidation):
+            base_url = {'sandbox': self.server.url}
+
+        self.api_class = LocalAddressValidation
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def get_api(self, **kwargs):
+        return self.api_class(
+            'license', 'user', 'pass', True,
+            cache=SQLiteCache(self.path, **kwargs)
+        )
+
+    def test_0010_persistent(self):
+        "Validation results survive a restart and ignore spelling"
+        api = self.get_api()
+        api.request(AddressValidation.request_type(
+            CountryCode='US', City='Miami', StateProvinceCode='FL',
+            PostalCode='33101'
+        ))
+        api.cache.close()
+
+        api = self.get_api()
+        response = api.request(AddressValidation.request_type(
+            CountryCode='us', City=' MIAMI ', StateProvinceCode='fl',
+            PostalCode='33101'
+        ))
+        self.assertEqual(response.Quality, 1.0)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(api.cache.stats()['hits'], 1)
+        self.assertEqual(
+            api.cache._connection().execute(
+                'PRAGMA journal_mode'
+            ).fetchone()[0], 'wal'
+        )
+
+    def test_0020_expiry(self):
+        "Expired validation results are fetched again"
+        api = self.get_api(ttl=0.05)
+        request = AddressValidation.request_type(
+            CountryCode='US', PostalCode='33101'
+        )
+        api.request(request)
+        time.sleep(0.1)
+        api.request(request)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(api.cache.expirations, 1)
+        api.cache.set('stale', '<x/>', expires=time.time() - 1)
+        self.assertEqual(api.cache.purge(), 1)
+        api.cache.set('capped', '<x/>', expires=time.time() + 60)
+        time.sleep(0.1)
+        self.assertEqual(api.cache.get('capped'), None)
+
+    def test_0030_preload(self):
+        "Preloaded validation results are served without a request"
+        api = self.get_api()
+        requests = [
+            AddressValidation.request_type(
+                CountryCode='US', PostalCode='%05d' % i
+            ) for i in range(100)
+        ]
+        api.preload_cache(
+            (request, '<AddressValidationResponse><Quality>0.5</Quality>'
+             '</AddressValidationResponse>') for request in requests
+        )
+        self.assertEqual(len(api.cache), 100)
+        self.assertEqual(api.request(requests[42]).Quality, 0.5)
+        self.assertEqual(len(self.server.requests), 0)
+
+        api = self.api_class('license', 'user', 'pass', True)
+        with self.assertRaises(ValueError):
+            api.preload_cache([])
+
+    def test_0040_typed(self):
+        "Typed results cannot be kept in the database"
+        with self.assertRaises(ValueError):
+            self.api_class(
+                'license', 'user', 'pass', True,
+                cache=SQLiteCache(self.path), typed=True
+            )
+
+
+class TestTimeInTransitCache(unittest.TestCase):
+    """
+    Test the cache in front of the :class:`TimeInTransit`
+    """
+
+    def setUp(self):
+        self.server = LocalServer('<TimeInTransitResponse/>').start()
+        self.cache = TTLCache()
+
+        class LocalTimeInTransit(TimeInTransit):
+            base_url = {'sandbox': self.server.url}
+
+        self.api = LocalTimeInTransit(
+            'license', 'user', 'pass', True, cache=self.cache
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def get_request(self, to_city='Aachen', pickup_date=None, **kwargs):
+        if pickup_date is None:
+            pickup_date = (datetime.now() + timedelta(days=1)).strftime(
+                '%Y%m%d'
+            )
+        return TimeInTransit.time_in_transit_request_type(
+            TimeInTransit.transit_to_type(
+                PoliticalDivision2=to_city, CountryCode='DE',
+            ),
+            TimeInTransit.transit_from_type(
+                PostcodePrimaryLow='45150', CountryCode='MX',
+            ),
+            PickupDate=pickup_date, **kwargs
+        )
+
+    def test_0010_lane(self):
+        "Requests for the same lane and day are answered from the cache"
+        response = self.api.request(self.get_request())
+        self.assertTrue(
+            self.api.request(self.get_request(to_city=' aachen')) is response
+        )
+        self.api.request(self.get_request(to_city='Berlin'))
+        self.api.request(self.get_request(
+            pickup_date=(datetime.now() + timedelta(days=2)).strftime('%Y%m%d')
+        ))
+        self.api.request(self.get_request(MaximumListSize='5'))
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_0020_expiry(self):
+        "Entries expire at the end of the pickup day"
+        request = self.get_request(pickup_date='20141020')
+        self.assertEqual(
+            datetime.fromtimestamp(self.api.cache_expiry(request)),
+            datetime(2014, 10, 21)
+        )
+        self.assertEqual(
+            self.api.cache_key(self.get_request(pickup_date='tomorrow')),
+            None
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests([
+        unittest.TestLoader().loadTestsFromTestCase(TestTTLCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestRatingCache),
+        unittest.TestLoader().loadTestsFromTestCase(
+            TestAddressValidationCache
+        ),
+        unittest.TestLoader().loadTestsFromTestCase(TestTimeInTransitCache),
+    ])
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
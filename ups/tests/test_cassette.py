@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    test_cassette
+
+    Test suite for recording and replaying responses
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import urllib2
+import zlib
+
+import unittest2 as unittest
+
+from ups.cassette import Cassette, CassetteMiss, RECORD, REPLAY, ONCE
+from ups.fake_server import FakeUPS, Profile
+from ups.time_in_transit import TimeInTransit
+from ups.address_validation import AddressValidation
+
+
+class TestCassette(unittest.TestCase):
+    """
+    Test the :class:`Cassette`
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.cassette')
+        self.fake = FakeUPS(seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def api(self, cassette, password='secret-password'):
+        return TimeInTransit(
+            'secret-license', 'user', password, True, transport=cassette
+        )
+
+    def transit_request(self, pickup_date='20141020'):
+        return TimeInTransit.time_in_transit_request_type(
+            TimeInTransit.transit_to_type(CountryCode='MX'),
+            TimeInTransit.transit_from_type(CountryCode='DE'),
+            PickupDate=pickup_date,
+        )
+
+    def record(self):
+        "Records a response and returns it as XML"
+        cassette = Cassette(self.path, RECORD, self.fake)
+        response = self.api(cassette).request(self.transit_request())
+        cassette.close()
+        return response.TransitResponse.PickupDate.text
+
+    def test_0010_replay(self):
+        "Recorded responses are replayed for the same requests"
+        cassette = Cassette(self.path, REPLAY)
+        with self.assertRaises(CassetteMiss):
+            self.api(cassette).request(self.transit_request())
+        cassette.close()
+        self.assertFalse(os.path.exists(self.path))
+
+        pickup_date = self.record()
+        cassette = Cassette(self.path, REPLAY)
+        self.assertEqual(len(cassette), 1)
+        api = self.api(cassette, password='other')
+        response = api.request(self.transit_request('20991231'))
+        self.assertEqual(response.TransitResponse.PickupDate, pickup_date)
+        response = api.request_async(self.transit_request()).result(5)
+        self.assertEqual(response.TransitResponse.PickupDate, pickup_date)
+        self.assertEqual(cassette.hits, 2)
+        self.assertEqual(self.fake.answered, 1)
+
+        other = TimeInTransit.time_in_transit_request_type(
+            TimeInTransit.transit_to_type(CountryCode='US'),
+            TimeInTransit.transit_from_type(CountryCode='DE'),
+            PickupDate='20141020',
+        )
+        with self.assertRaises(CassetteMiss):
+            api.request(other)
+        self.assertEqual(cassette.misses, 1)
+
+    def test_0020_redacted(self):
+        "Credentials are not written to the cassette"
+        self.record()
+        rows = sqlite3.connect(self.path).execute(
+            'SELECT request, body FROM cassette'
+        ).fetchall()
+        self.assertEqual(len(rows), 1)
+        request = zlib.decompress(rows[0][0])
+        self.assertTrue('<TimeInTransitRequest>' in request)
+        self.assertTrue('<Password>REDACTED</Password>' in request)
+        self.assertFalse('secret' in request)
+
+    def test_0030_errors(self):
+        "HTTP errors are recorded, missing responses recorded once"
+        self.fake = FakeUPS(AV=Profile(http_error_rate=1))
+        cassette = Cassette(self.path, ONCE, self.fake)
+        api = AddressValidation(
+            'license', 'user', 'pass', True, transport=cassette
+        )
+        request = AddressValidation.request_type(CountryCode='US')
+        for i in range(2):
+            with self.assertRaises(urllib2.HTTPError) as context:
+                api.request(request)
+            self.assertEqual(context.exception.code, 503)
+        future = self.api(cassette).request_async(self.transit_request())
+        future.result(5)
+        self.api(cassette).request(self.transit_request())
+        self.assertEqual(cassette.recorded, 2)
+        self.assertEqual(cassette.hits, 2)
+        self.assertEqual(self.fake.answered, 2)
+
+    def test_0040_fast(self):
+        "Replaying takes no time"
+        self.record()
+        cassette = Cassette(self.path, REPLAY)
+        api = self.api(cassette)
+        request = self.transit_request()
+        for i in range(1000):
+            api.request(request)
+        self.assertEqual(cassette.hits, 1000)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestCassette)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    test_deadline
+
+    Test suite for the deadlines of calls
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import socket
+import time
+import urllib2
+from threading import Thread
+
+import unittest2 as unittest
+
+from ups.deadline import Deadline, DeadlineExceeded
+from ups.ratelimit import RateLimiter, RateLimitExceeded
+from ups.retry import RetryPolicy
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+def trickle(listener, pause, chunks):
+    """Answers the first request to the listening socket with the chunks,
+    pausing before each of them
+    """
+    conn = listener.accept()[0]
+    request = ''
+    while '\r\n\r\n' not in request:
+        request += conn.recv(4096)
+    head, body = request.split('\r\n\r\n', 1)
+    length = int(head.lower().split('content-length:')[1].split()[0])
+    while len(body) < length:
+        body += conn.recv(4096)
+    try:
+        for chunk in chunks:
+            time.sleep(pause)
+            conn.sendall(chunk)
+    except socket.error:
+        pass
+    conn.close()
+
+
+class TestDeadline(unittest.TestCase):
+    """
+    Test the deadlines of requests and batches
+    """
+
+    def setUp(self):
+        self.delay = 0
+        self.status = 200
+
+        def answer(path, data):
+            time.sleep(self.delay)
+            self.server.status = self.status
+            return '<RatingServiceSelectionResponse/>'
+
+        self.server = LocalServer(answer).start()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': self.server.url}
+
+        self.api = LocalRatingService('license', 'user', 'pass', True)
+        self.request = RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def assertFailsWithin(self, seconds, exception, function, *args):
+        start = time.time()
+        with self.assertRaises(exception):
+            function(*args)
+        self.assertTrue(time.time() - start < seconds)
+
+    def test_0010_timeout(self):
+        "Requests time out by their deadline"
+        self.delay = 0.5
+        self.assertFailsWithin(
+            0.3, urllib2.URLError, self.api.request, self.request, 0.1
+        )
+        self.assertFailsWithin(
+            0.3, urllib2.URLError,
+            self.api.request_async(self.request, 0.1).result, 5
+        )
+
+    def test_0020_passed(self):
+        "Requests are not sent once their deadline has passed"
+        deadline = Deadline(0.05)
+        self.api.request(self.request, deadline)
+        time.sleep(0.05)
+        with self.assertRaises(DeadlineExceeded):
+            self.api.request(self.request, deadline)
+        with self.assertRaises(DeadlineExceeded):
+            self.api.request_async(self.request, deadline).result(timeout=5)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_0030_retries(self):
+        "Retries stop once the deadline would pass"
+        self.status = 503
+        self.api.retry_policy = RetryPolicy(
+            attempts=100, backoff=0.05, max_backoff=0.05,
+            failure_threshold=None,
+        )
+        # The last attempt fails with its 503, or by the deadline
+        self.assertFailsWithin(
+            0.4, urllib2.URLError, self.api.request, self.request, 0.2
+        )
+        self.assertTrue(1 < len(self.server.requests) < 100)
+
+    def test_0040_rate_limit(self):
+        "Requests do not wait for the rate limiter beyond their deadline"
+        self.api.rate_limiter = RateLimiter(budgets={'Rate': (1, 1)})
+        self.api.request(self.request)
+        self.assertFailsWithin(
+            0.1, RateLimitExceeded, self.api.request, self.request, 0.5
+        )
+
+    def test_0050_batch(self):
+        "Requests of a batch fail once the deadline of the batch passed"
+        self.delay = 0.05
+        start = time.time()
+        batch = self.api.request_many(
+            [self.request] * 10, workers=1, deadline=0.12
+        )
+        errors = [result.error for result in batch]
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(errors[0], None)
+        self.assertTrue(isinstance(errors[-1], DeadlineExceeded))
+        self.assertTrue(len(self.server.requests) < 5)
+
+    def test_0060_trickle(self):
+        "Responses which trickle in are read by the deadline"
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        body = '<RatingServiceSelectionResponse/>'
+        thread = Thread(target=trickle, args=(listener, 0.2, [
+            'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body),
+            body[:10], body[10:],
+        ]))
+        thread.daemon = True
+        thread.start()
+        self.api.base_url = {
+            'sandbox': 'http://127.0.0.1:%d' % listener.getsockname()[1]
+        }
+        self.assertFailsWithin(
+            0.45, DeadlineExceeded, self.api.request, self.request, 0.3
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestDeadline)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    test_decoder
+
+    Test suite for the typed response decoder
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+from datetime import date
+
+import unittest2 as unittest
+from lxml import objectify
+
+from ups.base import PyUPSException
+from ups.decoder import decode_rate, decode_time_in_transit, \
+    decode_address_validation, decode_shipment_accept, RatedShipment
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+def fixture(name):
+    "Returns the recorded response of the given name"
+    path = os.path.join(os.path.dirname(__file__), 'fixtures', name)
+    with open(path) as file:
+        return file.read()
+
+
+class TestDecoder(unittest.TestCase):
+    """
+    Test the decoders on recorded responses
+    """
+
+    def test_0010_rate(self):
+        "Rated shipments agree with the objectified response"
+        xml = fixture('rate_shop.xml')
+        rated_shipments = decode_rate(xml)
+        objectified = objectify.fromstring(xml).RatedShipment
+        self.assertEqual(len(rated_shipments), len(objectified))
+        for rated_shipment, element in zip(rated_shipments, objectified):
+            self.assertEqual(
+                rated_shipment.service_code, element.Service.Code.text
+            )
+            self.assertEqual(
+                rated_shipment.total_charges,
+                element.TotalCharges.MonetaryValue.pyval
+            )
+        self.assertEqual(rated_shipments[0].guaranteed_days_to_delivery, 3)
+        self.assertEqual(rated_shipments[0].negotiated_total, 36.58)
+        self.assertEqual(rated_shipments[2].guaranteed_days_to_delivery, None)
+        self.assertEqual(rated_shipments[2].billing_weight_unit, 'LBS')
+        self.assertEqual(len(rated_shipments[0].warnings), 1)
+        self.assertFalse(hasattr(rated_shipments[0], '__dict__'))
+        self.assertEqual(
+            [RatedShipment.from_element(element) for element in objectified],
+            rated_shipments
+        )
+
+    def test_0020_time_in_transit(self):
+        "Transit services come with typed arrival estimates"
+        response = decode_time_in_transit(fixture('time_in_transit.xml'))
+        self.assertEqual(response.pickup_date, date(2014, 10, 20))
+        self.assertEqual(
+            [s.service_code for s in response.services],
+            ['01', '05', '28', '19']
+        )
+        expedited = response.services[-1]
+        self.assertFalse(expedited.guaranteed)
+        self.assertEqual(expedited.business_transit_days, 5)
+        self.assertEqual(expedited.arrival_date, date(2014, 10, 27))
+
+    def test_0030_address_validation(self):
+        "Address candidates are decoded in rank order"
+        results = decode_address_validation(fixture('address_validation.xml'))
+        self.assertEqual([r.rank for r in results], [1, 2, 3])
+        self.assertEqual(results[1].city, 'MIAMI BEACH')
+        self.assertEqual(results[2].quality, 0.95)
+
+    def test_0040_shipment_accept(self):
+        "Shipment results hold the tracking numbers and labels"
+        results = decode_shipment_accept(fixture('shipment_accept.xml'))
+        self.assertEqual(results.identification_number, '1Z2220060292690500')
+        self.assertEqual(results.total_charges, 39.13)
+        self.assertEqual(
+            [p.tracking_number for p in results.packages],
+            ['1Z22200602926905', '1Z22200602926906']
+        )
+        self.assertEqual(results.packages[0].label_format, 'GIF')
+        self.assertTrue(results.packages[0].label().startswith('GIF89a'))
+
+    def test_0050_error(self):
+        "Errors are raised like for objectified responses"
+        with self.assertRaises(PyUPSException) as context:
+            decode_rate(fixture('error.xml'), 'request')
+        self.assertEqual(
+            context.exception.args[:2], (
+                'Hard-111210:The requested service is unavailable between '
+                'the selected locations.', 'request'
+            )
+        )
+
+    def test_0060_typed_client(self):
+        "Typed clients return the decoded response"
+        server = LocalServer(fixture('rate_shop.xml')).start()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': server.url}
+
+        try:
+            api = LocalRatingService(
+                'license', 'user', 'pass', True, typed=True
+            )
+            request = RatingService.rating_request_type(
+                RatingService.ship_to_type(CompanyName='Apple')
+            )
+            rated_shipments = api.request(request)
+            api.close()
+        finally:
+            server.stop()
+        self.assertEqual(len(rated_shipments), 7)
+        self.assertTrue(isinstance(rated_shipments[0], RatedShipment))
+        self.assertEqual(rated_shipments, decode_rate(fixture('rate_shop.xml')))
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestDecoder)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
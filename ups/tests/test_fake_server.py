@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+    test_fake_server
+
+    Test suite for the transports and the fake UPS
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+import urllib2
+
+import unittest2 as unittest
+
+from ups.address_validation import AddressValidation
+from ups.base import PyUPSException
+from ups.fake_server import FakeUPS, FakeUPSServer, Profile
+from ups.rating_package import RatingService
+from ups.retry import RetryPolicy, error_code
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept, \
+    ShipmentVoid
+from ups.time_in_transit import TimeInTransit
+from helper import ShippingPackageHelper as Helper
+
+
+def confirm_request(packages=2):
+    "Returns a ShipmentConfirm request for the number of packages"
+    return ShipmentConfirm.shipment_confirm_request_type(
+        Helper.get_shipper('123456', "GB"),
+        Helper.get_ship_to("GB"),
+        Helper.get_ship_from("GB"),
+        Helper.get_payment_info(AccountNumber='123456'),
+        ShipmentConfirm.service_type(Code='11'),
+        *[Helper.get_package("GB") for i in range(packages)]
+    )
+
+
+class TestFakeServer(unittest.TestCase):
+    """
+    Test the :class:`FakeUPS` as transport and over HTTP
+    """
+
+    def setUp(self):
+        self.fake = FakeUPS(seed=1)
+
+    def api(self, api_class, **kwargs):
+        "Returns a typed client of the API which sends to the fake"
+        kwargs.setdefault('transport', self.fake)
+        return api_class('license', 'user', 'pass', True, typed=True, **kwargs)
+
+    def rating_request(self):
+        return RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+
+    def test_0010_endpoints(self):
+        "All six endpoints answer in-process"
+        rates = self.api(RatingService).request(self.rating_request())
+        self.assertEqual(len(rates), 12)
+
+        candidates = self.api(AddressValidation).request(
+            AddressValidation.request_type(City='Miami', CountryCode='US')
+        )
+        self.assertEqual(candidates[0].city, 'MIAMI')
+        self.assertEqual(len(candidates), 3)
+        candidates = self.api(AddressValidation).request(
+            AddressValidation.request_type(
+                City='Miami', CountryCode='US', PostalCode='33101'
+            )
+        )
+        self.assertEqual(
+            [candidate.quality for candidate in candidates], [1.0]
+        )
+
+        transit = self.api(TimeInTransit).request(
+            TimeInTransit.time_in_transit_request_type(
+                TimeInTransit.transit_to_type(CountryCode='MX'),
+                TimeInTransit.transit_from_type(CountryCode='DE'),
+                PickupDate='20141020',
+            )
+        )
+        self.assertEqual(transit.pickup_date.isoformat(), '2014-10-20')
+        self.assertEqual(len(transit.services), 6)
+
+        confirmed = self.api(ShipmentConfirm).request(confirm_request(3))
+        results = self.api(ShipmentAccept).request(
+            ShipmentAccept.shipment_accept_request_type(
+                ShipmentConfirm.extract_digest(confirmed)
+            )
+        )
+        self.assertEqual(len(results.packages), 3)
+        self.assertEqual(
+            len(set(package.tracking_number for package in results.packages)),
+            3
+        )
+        self.assertTrue(results.packages[0].label().startswith('GIF89a'))
+
+        voided = ShipmentVoid(
+            'license', 'user', 'pass', True, transport=self.fake
+        ).request(ShipmentVoid.void_shipment_request_type(
+            results.identification_number,
+            [package.tracking_number for package in results.packages]
+        ))
+        self.assertEqual(len(voided.PackageLevelResults), 3)
+        self.assertEqual(self.fake.answered, 7)
+
+    def test_0020_profiles(self):
+        "Endpoints answer with the errors and sizes of their profiles"
+        self.fake = FakeUPS(
+            Rate=Profile(error_rate=1),
+            AV=Profile(http_error_rate=1),
+            ShipAccept=Profile(size=1000),
+            ShipConfirm=Profile(size=4000),
+        )
+        with self.assertRaises(PyUPSException) as context:
+            self.api(RatingService).request(self.rating_request())
+        self.assertTrue(context.exception.args[0].startswith('Transient'))
+        with self.assertRaises(urllib2.HTTPError) as context:
+            self.api(AddressValidation).request(
+                AddressValidation.request_type(CountryCode='US')
+            )
+        self.assertEqual(context.exception.code, 503)
+
+        confirmed = self.api(ShipmentConfirm).request(confirm_request(1))
+        self.assertEqual(len(confirmed.ShipmentDigest.text), 4000)
+        results = self.api(ShipmentAccept).request(
+            ShipmentAccept.shipment_accept_request_type(
+                confirmed.ShipmentDigest.text
+            )
+        )
+        self.assertEqual(len(results.packages[0].label()), 1000)
+        with self.assertRaises(PyUPSException) as context:
+            self.api(ShipmentAccept).request(
+                ShipmentAccept.shipment_accept_request_type('invalid')
+            )
+        self.assertEqual(error_code(context.exception), ('Hard', '128001'))
+        with self.assertRaises(PyUPSException) as context:
+            self.api(ShipmentConfirm).request(confirm_request(0))
+        self.assertEqual(error_code(context.exception), ('Hard', '121210'))
+
+        # Other errors of the builders are not mistaken for UPS errors
+        with self.assertRaises(ValueError):
+            self.api(TimeInTransit).request(
+                TimeInTransit.time_in_transit_request_type(
+                    TimeInTransit.transit_to_type(CountryCode='MX'),
+                    TimeInTransit.transit_from_type(CountryCode='DE'),
+                    PickupDate='2014XXXX',
+                )
+            )
+
+    def test_0030_latency(self):
+        "Responses take their latency, and time out by the deadline"
+        self.fake = FakeUPS(Profile(latency=0.1))
+        api = self.api(RatingService)
+        start = time.time()
+        api.request(self.rating_request())
+        future = api.request_async(self.rating_request())
+        self.assertFalse(future.done())
+        self.assertEqual(len(future.result(timeout=5)), 12)
+        self.assertTrue(time.time() - start >= 0.2)
+
+        with self.assertRaises(urllib2.URLError):
+            api.request(self.rating_request(), deadline=0.05)
+        with self.assertRaises(urllib2.URLError):
+            api.request_async(
+                self.rating_request(), deadline=0.05
+            ).result(timeout=5)
+
+        self.fake = FakeUPS(Rate=Profile(error_rate=1))
+        api = self.api(RatingService, retry_policy=RetryPolicy(
+            attempts=3, backoff=0, failure_threshold=None
+        ))
+        with self.assertRaises(PyUPSException):
+            api.request_async(self.rating_request()).result(timeout=5)
+        self.assertEqual(self.fake.answered, 3)
+
+    def test_0040_server(self):
+        "The fake is served over HTTP, labels can be streamed from it"
+        directory = tempfile.mkdtemp()
+        with FakeUPSServer(self.fake) as server:
+            confirm_api = self.api(ShipmentConfirm, transport=None)
+            accept_api = self.api(ShipmentAccept, transport=None)
+            confirm_api.base_url = accept_api.base_url = server.base_url
+            try:
+                digest = ShipmentConfirm.extract_digest(
+                    confirm_api.request(confirm_request(2))
+                )
+                results = accept_api.request_labels(
+                    ShipmentAccept.shipment_accept_request_type(digest),
+                    os.path.join(directory, '%(index)s.%(format)s')
+                )
+                self.assertEqual(
+                    sorted(os.listdir(directory)), ['0.gif', '1.gif']
+                )
+                self.assertEqual(results.packages[1].label_size, 20000)
+            finally:
+                confirm_api.close()
+                accept_api.close()
+                shutil.rmtree(directory)
+        self.assertEqual(self.fake.answered, 2)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestFakeServer)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+    test_hedging
+
+    Test suite for hedged requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import time
+
+import unittest2 as unittest
+
+from ups.deadline import Deadline, DeadlineExceeded
+from ups.hedging import HedgePolicy
+from ups.rating_package import RatingService
+from ups.shipping_package import ShipmentAccept, ShipmentVoid
+from helper import LocalServer
+
+
+class TestHedging(unittest.TestCase):
+    """
+    Test the :class:`HedgePolicy`
+    """
+
+    def setUp(self):
+        self.answered = 0
+
+        def answer(path, data):
+            # The first request is stuck on a slow backend
+            self.answered += 1
+            if self.answered == 1:
+                time.sleep(0.5)
+            return '<RatingServiceSelectionResponse/>'
+
+        self.server = LocalServer(answer).start()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': self.server.url}
+
+        self.policy = HedgePolicy(percentile=90, min_samples=5)
+        self.api = LocalRatingService(
+            'license', 'user', 'pass', True, hedge_policy=self.policy
+        )
+        self.request = RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def learn(self, latency=0.1):
+        "Makes the policy believe the endpoint answers within the latency"
+        for i in range(10):
+            self.policy.record(self.api.url, latency)
+
+    def test_0010_delay(self):
+        "Requests are hedged once enough latencies are known"
+        self.assertEqual(self.policy.delay(self.api.url), None)
+        for latency in range(1, 11):
+            self.policy.record(self.api.url, latency / 100.0)
+        self.assertEqual(self.policy.delay(self.api.url), 0.09)
+        self.policy.min_delay = 0.2
+        self.assertEqual(self.policy.delay(self.api.url), 0.2)
+
+    def test_0020_hedge(self):
+        "Slow requests are answered by their hedge"
+        self.learn()
+        start = time.time()
+        self.api.request(self.request)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(self.policy.hedged, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+        future = self.api.request_async(self.request)
+        self.assertEqual(
+            future.result(timeout=5).tag, 'RatingServiceSelectionResponse'
+        )
+        self.assertEqual(self.policy.hedged, 1)
+
+    def test_0030_budget(self):
+        "Requests are not hedged once the budget is spent"
+        self.policy = self.api.hedge_policy = HedgePolicy(
+            min_samples=5, budget=0.1, max_budget=0
+        )
+        self.learn()
+        start = time.time()
+        self.api.request(self.request)
+        self.assertTrue(time.time() - start >= 0.5)
+        self.assertEqual(self.policy.hedged, 0)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_0040_not_hedgeable(self):
+        "Requests which change shipments are never hedged"
+        for api_class in (ShipmentAccept, ShipmentVoid):
+            api = api_class(
+                'license', 'user', 'pass', True, hedge_policy=self.policy
+            )
+            self.assertFalse(api.hedging)
+        self.assertTrue(self.api.hedging)
+
+    def test_0050_deadline(self):
+        "Hedges are given what is left of the deadline when they are sent"
+        self.server.body = lambda path, data: time.sleep(1) or '<x/>'
+        self.learn(0.25)
+        start = time.time()
+        with self.assertRaises(DeadlineExceeded):
+            self.api.request(self.request, Deadline(0.5))
+        # The hedge sent after 0.25s would run until 0.75s on a timeout of
+        # its own
+        self.assertTrue(time.time() - start < 0.7)
+        self.assertEqual(self.policy.hedged, 1)
+
+        # No hedge is sent once the deadline passed
+        self.learn(0.5)
+        with self.assertRaises(DeadlineExceeded):
+            self.api.request(self.request, Deadline(0.3))
+        time.sleep(0.3)
+        self.assertEqual(self.policy.hedged, 1)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestHedging)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
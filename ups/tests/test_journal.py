@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    test_journal
+
+    Test suite for the shipment journal
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+from threading import Thread
+
+import unittest2 as unittest
+
+from ups.base import PyUPSException
+from ups.fake_server import FakeUPS, Profile
+from ups.journal import Journal, IdempotentShipper, ShipmentInDoubt, \
+    ShipmentInProgress, CONFIRMED, ACCEPTING, ACCEPTED, ACCEPT_FAILED, UNKNOWN
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept
+from test_fake_server import confirm_request
+
+
+class TestJournal(unittest.TestCase):
+    """
+    Test the :class:`Journal` and the :class:`IdempotentShipper`
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.sqlite')
+        self.journal = Journal(self.path)
+        self.fake = FakeUPS(seed=1)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def shipper(self, return_xml=False, **kwargs):
+        "Returns a shipper whose clients send to the fake"
+        return IdempotentShipper(
+            ShipmentConfirm(
+                'license', 'user', 'pass', False, return_xml,
+                transport=self.fake
+            ),
+            ShipmentAccept(
+                'license', 'user', 'pass', False, return_xml,
+                transport=self.fake
+            ),
+            self.journal, **kwargs
+        )
+
+    def restart(self):
+        "Reopens the journal, as a new process would"
+        self.journal.close()
+        self.journal = Journal(self.path)
+
+    def test_0010_idempotent(self):
+        "A shipment is shipped once per key"
+        results = self.shipper().ship('order-1', confirm_request(2))
+        self.assertEqual(len(results.packages), 2)
+        self.assertEqual(self.fake.answered, 2)
+
+        self.restart()
+        self.assertEqual(
+            self.shipper().ship('order-1', confirm_request(2)), results
+        )
+        self.assertEqual(self.fake.answered, 2)
+
+        entry = self.journal.get('order-1')
+        self.assertEqual(entry.step, ACCEPTED)
+        self.assertEqual(
+            entry.identification_number, results.identification_number
+        )
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(self.journal.get('order-2'), None)
+        self.assertEqual(self.journal.unfinished(), [])
+
+        results = self.shipper(return_xml=True).ship(
+            'order-2', confirm_request(1)
+        )
+        self.assertEqual(
+            self.journal.get('order-2').identification_number,
+            results.identification_number
+        )
+
+    def test_0020_resume(self):
+        "Confirmed shipments are accepted after a restart, not confirmed"
+        shipper = self.shipper()
+        for key in ('order-1', 'order-2'):
+            shipper._confirm(key, confirm_request(1))
+        self.restart()
+
+        unfinished = self.journal.unfinished()
+        self.assertEqual(
+            [entry.key for entry in unfinished], ['order-1', 'order-2']
+        )
+        self.assertEqual(unfinished[0].step, CONFIRMED)
+        for entry in unfinished:
+            results = self.shipper().resume(entry.key)
+            self.assertEqual(
+                results.identification_number, entry.identification_number
+            )
+        self.assertEqual(self.fake.answered, 4)
+        self.assertEqual(self.journal.unfinished(), [])
+
+        with self.assertRaises(ValueError):
+            self.shipper().resume('order-3')
+
+    def test_0030_in_doubt(self):
+        "Accepts without an answer are reconciled, failed ones retried"
+        self.fake = FakeUPS(
+            ShipAccept=Profile(latency=1), seed=1, timeout=0.05
+        )
+        with self.assertRaises(Exception):
+            self.shipper().ship('order-1', confirm_request(1))
+        entry = self.journal.get('order-1')
+        self.assertEqual(entry.step, UNKNOWN)
+        self.assertTrue(entry.in_doubt)
+        self.assertEqual(entry.attempts, 1)
+
+        # A worker which died while accepting leaves the same doubt
+        self.journal.append('order-1', ACCEPTING, detail='2')
+        self.assertTrue(self.journal.get('order-1').in_doubt)
+        with self.assertRaises(ShipmentInDoubt):
+            self.shipper().ship('order-1')
+        self.assertEqual(self.journal.get('order-1').attempts, 2)
+
+        reconciled = []
+        self.fake = FakeUPS(ShipAccept=Profile(error_rate=1), seed=1)
+        shipper = self.shipper(reconcile=reconciled.append)
+        with self.assertRaises(PyUPSException):
+            shipper.ship('order-1')
+        self.assertEqual([doubt.key for doubt in reconciled], ['order-1'])
+        entry = self.journal.get('order-1')
+        self.assertEqual(entry.step, ACCEPT_FAILED)
+        self.assertEqual(entry.attempts, 3)
+        self.assertFalse(entry.in_doubt)
+
+        self.fake = FakeUPS(seed=1)
+        results = self.shipper(reconcile=reconciled.append).ship('order-1')
+        self.assertEqual(
+            results.identification_number, entry.identification_number
+        )
+        self.assertEqual(len(reconciled), 1)
+        self.assertEqual(self.fake.answered, 1)
+        self.assertEqual(self.journal.get('order-1').attempts, 4)
+
+        self.fake = FakeUPS(
+            ShipAccept=Profile(latency=1), seed=1, timeout=0.05
+        )
+        with self.assertRaises(Exception):
+            self.shipper().ship('order-2', confirm_request(1))
+        self.fake = FakeUPS(seed=1)
+        self.assertTrue(
+            self.shipper(reaccept=True).ship('order-2').identification_number
+        )
+        self.assertEqual(self.journal.get('order-2').step, ACCEPTED)
+
+    def test_0040_group_commit(self):
+        "Concurrent appends are committed together"
+        def append(thread):
+            for i in range(500):
+                self.journal.append(
+                    'order-%d-%d' % (thread, i), CONFIRMED, 'digest', 'id'
+                )
+
+        threads = [Thread(target=append, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.journal.appended, 4000)
+        self.assertTrue(self.journal.commits < 4000, self.journal.commits)
+
+        self.restart()
+        unfinished = self.journal.unfinished()
+        self.assertEqual(len(unfinished), 4000)
+        self.assertEqual(unfinished[0].digest, 'digest')
+        self.journal.append_async('order-0-0', ACCEPTED, data=None)
+        self.restart()
+        self.assertEqual(len(self.journal.unfinished()), 3999)
+
+    def test_0050_claims(self):
+        "A key is shipped by one call at a time"
+        self.fake = FakeUPS(ShipConfirm=Profile(latency=0.1), seed=1)
+        outcomes = []
+
+        def ship():
+            try:
+                outcomes.append(
+                    self.shipper().ship('order-1', confirm_request(1))
+                )
+            except ShipmentInProgress, exc:
+                outcomes.append(exc)
+
+        threads = [Thread(target=ship) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            sorted(type(outcome).__name__ for outcome in outcomes),
+            ['ShipmentInProgress', 'ShipmentResults']
+        )
+        self.assertEqual(self.fake.answered, 2)
+        self.assertEqual(self.journal.get('order-1').attempts, 1)
+        self.assertTrue(self.journal.claim('order-1', 1))
+
+        # Claims are released, and lapse after their lease
+        token = self.journal.claim('order-2', 0.01)
+        self.assertTrue(token)
+        self.assertEqual(self.journal.claim('order-2', 0.01), None)
+        time.sleep(0.02)
+        self.assertTrue(self.journal.claim('order-2', 0.01))
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestJournal)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+    test_label_pipeline
+
+    Test suite for processing labels on a pool of processes
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import unittest2 as unittest
+from lxml import objectify
+
+from ups.decoder import decode_shipment_accept
+from ups.label_pipeline import LabelPipeline, LabelError
+from test_decoder import fixture
+from test_labels import large_shipment
+
+
+def reverse(data, label_format):
+    "Converts a label by reversing it"
+    return data[::-1], 'rev'
+
+
+def slow(data, label_format):
+    "Converts a label slowly"
+    time.sleep(0.2)
+    return data, label_format
+
+
+def die(data, label_format):
+    "Kills the process converting the label"
+    os._exit(1)
+
+
+class TestLabelPipeline(unittest.TestCase):
+    """
+    Test the :class:`LabelPipeline`
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(
+            self.directory, '%(tracking_number)s.%(format)s'
+        )
+        self.response = fixture('shipment_accept.xml')
+        self.labels = dict(
+            (package.tracking_number, package.label())
+            for package in decode_shipment_accept(self.response).packages
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def test_0010_typed(self):
+        "Labels of typed responses are written by tracking number"
+        with LabelPipeline(self.output, processes=2) as pipeline:
+            futures = pipeline.submit(
+                decode_shipment_accept(self.response)
+            )
+        self.assertEqual(futures.keys(), sorted(self.labels))
+        for tracking_number, future in futures.items():
+            path = future.result(timeout=5)
+            self.assertEqual(path, os.path.join(
+                self.directory, tracking_number + '.gif'
+            ))
+            self.assertEqual(self.read(path), self.labels[tracking_number])
+
+    def test_0020_objectified(self):
+        "Labels of objectified responses are converted"
+        with LabelPipeline(self.output, reverse, processes=2) as pipeline:
+            futures = pipeline.submit(objectify.fromstring(self.response))
+        for tracking_number, future in futures.items():
+            path = future.result(timeout=5)
+            self.assertTrue(path.endswith('.rev'))
+            self.assertEqual(
+                self.read(path), self.labels[tracking_number][::-1]
+            )
+
+    def test_0030_backpressure(self):
+        "Submitting blocks while too many labels are pending"
+        pipeline = LabelPipeline(
+            self.output, slow, processes=1, max_pending=1
+        )
+        try:
+            start = time.time()
+            futures = pipeline.submit(
+                decode_shipment_accept(large_shipment(3))
+            )
+            self.assertTrue(time.time() - start >= 0.35)
+            self.assertEqual(
+                [f.done() for f in futures.values()], [True, True, False]
+            )
+        finally:
+            pipeline.close()
+        self.assertTrue(all(f.done() for f in futures.values()))
+
+    def test_0040_error(self):
+        "Errors of a label fail its future only"
+        output = os.path.join(self.directory, '%(index)s', 'label')
+        os.mkdir(os.path.join(self.directory, '1'))
+        with LabelPipeline(output, processes=1) as pipeline:
+            first, second = pipeline.submit(
+                decode_shipment_accept(self.response)
+            ).values()
+        self.assertTrue(isinstance(first.exception(timeout=5), IOError))
+        self.assertEqual(
+            second.result(timeout=5),
+            os.path.join(self.directory, '1', 'label')
+        )
+        with self.assertRaises(ValueError):
+            pipeline.submit(decode_shipment_accept(self.response))
+
+    def test_0050_lost(self):
+        "Labels whose process died fail and free their place in the queue"
+        with self.assertRaises(ValueError):
+            LabelPipeline(self.output, lambda data, label_format: data)
+
+        pipeline = LabelPipeline(
+            self.output, die, processes=1, max_pending=1
+        )
+        try:
+            futures = pipeline.submit(
+                decode_shipment_accept(large_shipment(3))
+            )
+            for future in futures.values():
+                self.assertTrue(
+                    isinstance(future.exception(timeout=5), LabelError)
+                )
+        finally:
+            pipeline.close()
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLabelPipeline)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+    test_labels
+
+    Test suite for streaming the labels of accepted shipments
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+from copy import deepcopy
+from StringIO import StringIO
+
+import unittest2 as unittest
+from lxml import etree
+
+from ups.base import PyUPSException
+from ups.decoder import decode_shipment_accept
+from ups.labels import StreamedPackage
+from ups.ratelimit import RateLimiter, RateLimitExceeded
+from ups.retry import RetryPolicy, CircuitOpenError
+from ups.shipping_package import ShipmentAccept
+from helper import LocalServer
+from test_decoder import fixture
+
+
+def large_shipment(count):
+    "Returns a ShipmentAccept response with count packages"
+    root = etree.fromstring(fixture('shipment_accept.xml'))
+    results = root.find('ShipmentResults')
+    packages = results.findall('PackageResults')
+    for package in packages:
+        results.remove(package)
+    for index in range(count):
+        package = deepcopy(packages[index % len(packages)])
+        package.find('TrackingNumber').text = '1Z222006029%05d' % index
+        results.append(package)
+    return etree.tostring(root)
+
+
+class TestLabels(unittest.TestCase):
+    """
+    Test :meth:`ShipmentAccept.request_labels`
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def request_labels(self, response, *args, **kwargs):
+        "Streams the labels of the response to the given output"
+        server = LocalServer(response).start()
+
+        class LocalShipmentAccept(ShipmentAccept):
+            base_url = {'sandbox': server.url}
+
+        try:
+            api = LocalShipmentAccept('license', 'user', 'pass', True)
+            api.pool.chunk_size = kwargs.pop('chunk_size', 64 * 1024)
+            return api.request_labels(
+                ShipmentAccept.shipment_accept_request_type('digest'),
+                *args, **kwargs
+            )
+        finally:
+            api.close()
+            server.stop()
+
+    def test_0010_paths(self):
+        "Labels of a large shipment are written to the formatted paths"
+        response = large_shipment(50)
+        results = self.request_labels(
+            response, os.path.join(
+                self.directory, '%(index)s-%(tracking_number)s.%(format)s'
+            )
+        )
+        decoded = decode_shipment_accept(response)
+        self.assertEqual(results.total_charges, decoded.total_charges)
+        self.assertEqual(
+            results.identification_number, decoded.identification_number
+        )
+        self.assertEqual(len(results.packages), 50)
+        for index, package in enumerate(results.packages):
+            expected = decoded.packages[index]
+            self.assertTrue(isinstance(package, StreamedPackage))
+            self.assertEqual(package.tracking_number, expected.tracking_number)
+            self.assertEqual(package.label, os.path.join(
+                self.directory,
+                '%d-%s.gif' % (index, expected.tracking_number)
+            ))
+            with open(package.label, 'rb') as file:
+                self.assertEqual(file.read(), expected.label())
+            self.assertEqual(package.label_size, len(expected.label()))
+            self.assertEqual(package.html_label, None)
+
+    def test_0020_files(self):
+        "Labels split over many chunks are written to the returned files"
+        files = {}
+
+        def output(tracking_number, label_format):
+            self.assertEqual(label_format, 'GIF')
+            files[tracking_number] = StringIO()
+            return files[tracking_number]
+
+        html = []
+        response = fixture('shipment_accept.xml')
+        results = self.request_labels(
+            response, output,
+            lambda *args: html.append(StringIO()) or html[-1],
+            chunk_size=1000,
+        )
+        decoded = decode_shipment_accept(response)
+        for package, expected in zip(results.packages, decoded.packages):
+            label = files[package.tracking_number]
+            self.assertTrue(package.label is label)
+            self.assertFalse(label.closed)
+            self.assertEqual(label.getvalue(), expected.label())
+            self.assertEqual(
+                package.html_label.getvalue(),
+                expected.html_image.decode('base64')
+            )
+        self.assertEqual(len(html), 2)
+
+    def test_0030_error(self):
+        "Errors are raised and no label is written"
+        with self.assertRaises(PyUPSException) as context:
+            self.request_labels(
+                fixture('error.xml'),
+                os.path.join(self.directory, '%(tracking_number)s')
+            )
+        self.assertTrue(context.exception.args[0].startswith('Hard-111210:'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_0035_truncated(self):
+        "A label cut off by a broken response is not left behind"
+        response = large_shipment(3)
+        start = response.index('<GraphicImage>')
+        for i in range(2):
+            start = response.index('<GraphicImage>', start + 1)
+        with self.assertRaises(etree.XMLSyntaxError):
+            self.request_labels(
+                response[:start + 100],
+                os.path.join(self.directory, '%(index)s.%(format)s')
+            )
+        # The labels written whole are kept
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '0.gif', '1.gif'
+        ])
+
+    def test_0040_policies(self):
+        "Labels are requested within the rate limit and circuit breaker"
+        responses = [fixture('shipment_accept.xml')]
+        server = LocalServer(lambda path, data: responses[0]).start()
+        self.addCleanup(server.stop)
+
+        class LocalShipmentAccept(ShipmentAccept):
+            base_url = {'sandbox': server.url}
+
+        api = LocalShipmentAccept(
+            'license', 'user', 'pass', True,
+            rate_limiter=RateLimiter(budgets={'ShipAccept': (1, 1)}),
+            retry_policy=RetryPolicy(attempts=1, failure_threshold=1),
+        )
+        self.addCleanup(api.close)
+        request = ShipmentAccept.shipment_accept_request_type('digest')
+        output = os.path.join(self.directory, '%(tracking_number)s')
+
+        api.request_labels(request, output)
+        with self.assertRaises(RateLimitExceeded):
+            api.request_labels(request, output, deadline=0.5)
+        self.assertEqual(len(server.requests), 1)
+
+        api.rate_limiter = None
+        responses[0] = fixture('error.xml').replace('Hard', 'Transient')
+        with self.assertRaises(PyUPSException):
+            api.request_labels(request, output)
+        with self.assertRaises(CircuitOpenError):
+            api.request_labels(request, output)
+        self.assertEqual(len(server.requests), 2)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLabels)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    test_logging
+
+    Test suite for the logging of the API clients
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import logging
+
+import unittest2 as unittest
+
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+class TestLogging(unittest.TestCase):
+    """
+    Test the logger of the :class:`BaseAPIClient`
+    """
+
+    def setUp(self):
+        self.server = LocalServer('<RatingServiceSelectionResponse/>').start()
+        self.global_logger = logging.getLogger('PyUPS')
+        self.global_logger_class = self.global_logger.__class__
+        self.global_handlers = list(self.global_logger.handlers)
+        # The suites which talk to UPS disable debug logging
+        logging.disable(logging.NOTSET)
+
+        class LocalRatingService(RatingService):
+            base_url = {
+                'sandbox': self.server.url,
+                'production': self.server.url,
+            }
+
+            built = 0
+
+            def build_request(self, request_element, pretty=False):
+                self.built += 1
+                return super(LocalRatingService, self).build_request(
+                    request_element, pretty
+                )
+
+        self.api_class = LocalRatingService
+
+    def tearDown(self):
+        self.server.stop()
+        self.global_logger.setLevel(logging.NOTSET)
+
+    def get_request(self):
+        return RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+
+    def test_0010_global_logger(self):
+        "Clients leave the logger of the logging module untouched"
+        clients = [
+            self.api_class('license', 'user', 'pass', True) for i in range(3)
+        ]
+        self.assertEqual(len(set(id(c.logger) for c in clients)), 3)
+        self.assertTrue(
+            self.global_logger.__class__ is self.global_logger_class
+        )
+        self.assertEqual(self.global_logger.handlers, self.global_handlers)
+        self.assertTrue(clients[0].logger.parent is self.global_logger)
+
+    def test_0020_production(self):
+        "Without debug logging nothing is formatted for the log"
+        api = self.api_class('license', 'user', 'pass', False)
+        self.assertFalse(api.debug)
+        api.request(self.get_request())
+        self.assertEqual(api.built, 1)
+        self.assertTrue(api._logger is None)
+
+    def test_0030_application_debug(self):
+        "Debug logging enabled by the application is picked up on reset"
+        api = self.api_class('license', 'user', 'pass', False)
+        self.global_logger.setLevel(logging.DEBUG)
+        self.assertFalse(api.debug)
+        api.reset_logger()
+        self.assertTrue(api.debug)
+        api.request(self.get_request())
+        self.assertEqual(api.built, 2)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLogging)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+    test_metrics
+
+    Test suite for the metrics of the requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import urllib2
+from threading import Thread
+
+import unittest2 as unittest
+
+from ups.address_validation import AddressValidation
+from ups.base import PyUPSException
+from ups.cache import TTLCache
+from ups.fake_server import FakeUPS, Profile
+from ups.metrics import Metrics
+from ups.rating_package import RatingService
+from ups.retry import RetryPolicy
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept
+from test_fake_server import confirm_request
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test the :class:`Metrics` of the API clients
+    """
+
+    def setUp(self):
+        self.fake = FakeUPS(seed=1)
+        self.metrics = Metrics()
+
+    def api(self, api_class, **kwargs):
+        "Returns a client of the API which sends to the fake"
+        return api_class(
+            'license', 'user', 'pass', True, transport=self.fake,
+            metrics=self.metrics, **kwargs
+        )
+
+    def rating_request(self):
+        with self.metrics.timed('Rate', 'build'):
+            return RatingService.rating_request_type(
+                RatingService.ship_to_type(CompanyName='Apple')
+            )
+
+    def test_0010_phases(self):
+        "Requests are counted, and their phases timed, logging in debug mode"
+        api = self.api(RatingService, cache=TTLCache())
+        api.request(self.rating_request())
+        api.request(self.rating_request())
+        api.request_async(
+            self.rating_request(), deadline=5
+        ).result(timeout=5)
+
+        rate = self.metrics.snapshot()['Rate']
+        self.assertEqual(rate['requests'], {'ok': 1, 'cached': 2})
+        self.assertTrue(rate['request_bytes']['ok'] > 100)
+        self.assertTrue(rate['response_bytes']['ok'] > 1000)
+        self.assertEqual(rate['response_bytes']['cached'], 0)
+        self.assertEqual(rate['errors'], {})
+        self.assertEqual(
+            sorted(rate['phases']),
+            ['build', 'log', 'network', 'parse', 'serialize']
+        )
+        self.assertEqual(rate['phases']['build']['ok']['count'], 3)
+        for phase in ('serialize', 'network', 'parse'):
+            histogram = rate['phases'][phase]['ok']
+            self.assertEqual(histogram['count'], 1)
+            self.assertEqual(histogram['buckets'][-1], (float('inf'), 1))
+            self.assertTrue(0 < histogram['sum'] < 1)
+
+    def test_0020_outcomes(self):
+        "Failed requests are counted by their outcome and error code"
+        self.fake = FakeUPS(
+            Rate=Profile(error_rate=1), AV=Profile(http_error_rate=1),
+            ShipConfirm=Profile(latency=0.2),
+        )
+        api = self.api(RatingService, retry_policy=RetryPolicy(
+            attempts=3, backoff=0, failure_threshold=None
+        ))
+        with self.assertRaises(PyUPSException):
+            api.request(self.rating_request())
+        with self.assertRaises(PyUPSException):
+            api.request_async(self.rating_request()).result(timeout=5)
+        with self.assertRaises(urllib2.HTTPError):
+            self.api(AddressValidation).request(
+                AddressValidation.request_type(CountryCode='US')
+            )
+        with self.assertRaises(urllib2.URLError):
+            self.api(ShipmentConfirm).request(
+                confirm_request(1), deadline=0.05
+            )
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['Rate']['requests'], {'ups_error': 6})
+        self.assertEqual(snapshot['Rate']['errors'], {'20001': 6})
+        self.assertEqual(
+            snapshot['Rate']['phases']['parse']['ups_error']['count'], 6
+        )
+        self.assertEqual(
+            snapshot['Rate']['phases']['serialize']['ups_error']['count'], 2
+        )
+        self.assertEqual(snapshot['AV']['requests'], {'http_error': 1})
+        self.assertEqual(snapshot['ShipConfirm']['requests'], {'timeout': 1})
+        self.assertEqual(
+            sorted(snapshot['ShipConfirm']['phases']),
+            ['log', 'network', 'serialize']
+        )
+
+    def test_0030_labels(self):
+        "Streamed labels are timed"
+        directory = tempfile.mkdtemp()
+        try:
+            digest = ShipmentConfirm.extract_digest(
+                self.api(ShipmentConfirm).request(confirm_request(2))
+            )
+            self.api(ShipmentAccept).request_labels(
+                ShipmentAccept.shipment_accept_request_type(digest),
+                os.path.join(directory, '%(index)s.%(format)s')
+            )
+        finally:
+            shutil.rmtree(directory)
+        accept = self.metrics.snapshot()['ShipAccept']
+        self.assertEqual(accept['requests'], {'ok': 1})
+        self.assertEqual(
+            sorted(accept['phases']),
+            ['log', 'network', 'parse', 'serialize']
+        )
+
+    def test_0040_export(self):
+        "Recording from many threads loses nothing, Prometheus adds it up"
+        def record():
+            for i in xrange(1000):
+                self.metrics.record(
+                    'Rate', 'ok', [('network', 0.2)], 700, 4000
+                )
+                self.metrics.record('Rate', 'ups_error', [], 700, 500, '111')
+
+        threads = [Thread(target=record) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rate = self.metrics.snapshot()['Rate']
+        self.assertEqual(rate['requests'], {'ok': 8000, 'ups_error': 8000})
+        self.assertEqual(rate['request_bytes']['ok'], 5600000)
+        self.assertEqual(rate['errors'], {'111': 8000})
+
+        lines = self.metrics.prometheus().splitlines()
+        for line in [
+            '# TYPE ups_requests_total counter',
+            'ups_requests_total{endpoint="Rate",outcome="ok"} 8000',
+            'ups_response_bytes_total{endpoint="Rate",outcome="ups_error"} '
+            '4000000',
+            'ups_errors_total{endpoint="Rate",code="111"} 8000',
+            '# TYPE ups_phase_seconds histogram',
+            'ups_phase_seconds_bucket{endpoint="Rate",phase="network",'
+            'outcome="ok",le="0.1"} 0',
+            'ups_phase_seconds_bucket{endpoint="Rate",phase="network",'
+            'outcome="ok",le="0.25"} 8000',
+            'ups_phase_seconds_count{endpoint="Rate",phase="network",'
+            'outcome="ok"} 8000',
+        ]:
+            self.assertTrue(line in lines, line)
+
+    def test_0050_exited_threads(self):
+        "The shards of threads which exited are added up, not kept"
+        def record():
+            self.metrics.record('Rate', 'ok', [('network', 0.2)], 700, 4000)
+
+        for i in xrange(100):
+            thread = Thread(target=record)
+            thread.start()
+            thread.join()
+        record()
+        # That of this thread, and maybe of the last one, whose locals may
+        # be dropped only after it was joined
+        self.assertTrue(len(self.metrics._shards) <= 2)
+
+        rate = self.metrics.snapshot()['Rate']
+        self.assertEqual(rate['requests'], {'ok': 101})
+        self.assertEqual(rate['response_bytes'], {'ok': 404000})
+        self.assertEqual(rate['phases']['network']['ok']['count'], 101)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestMetrics)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
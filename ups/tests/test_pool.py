@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    test_pool
+
+    Test suite for the keep-alive connection pool
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import time
+import urllib2
+
+import unittest2 as unittest
+
+from ups.pool import ConnectionPool
+from ups.address_validation import AddressValidation
+from helper import LocalServer
+
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    Test the :class:`ConnectionPool` against a local server
+    """
+
+    def setUp(self):
+        self.server = LocalServer('<Response>OK</Response>').start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_0010_reuse_connection(self):
+        "Sequential requests to a host share one connection"
+        with ConnectionPool() as pool:
+            for i in range(5):
+                self.assertEqual(
+                    pool.urlopen(self.server.url + '/Rate', 'data'),
+                    '<Response>OK</Response>'
+                )
+            self.assertEqual(pool.idle_count(self.server.url), 1)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_0020_idle_eviction(self):
+        "Connections idle for too long are not reused"
+        pool = ConnectionPool(idle_timeout=0.05)
+        pool.urlopen(self.server.url + '/AV', 'data')
+        time.sleep(0.1)
+        self.assertEqual(pool.evict_idle(), 1)
+        self.assertEqual(pool.idle_count(), 0)
+        pool.urlopen(self.server.url + '/AV', 'data')
+        self.assertEqual(self.server.connections, 2)
+        pool.close()
+
+    def test_0030_pool_size(self):
+        "No more than maxsize idle connections are kept per host"
+        pool = ConnectionPool(maxsize=1)
+        conn = pool._new_connection(pool.pool_key(self.server.url), 10)
+        pool._put_connection(pool.pool_key(self.server.url), conn)
+        pool._put_connection(
+            pool.pool_key(self.server.url),
+            pool._new_connection(pool.pool_key(self.server.url), 10)
+        )
+        self.assertEqual(pool.idle_count(self.server.url), 1)
+        pool.close()
+        self.assertEqual(pool.idle_count(), 0)
+        with self.assertRaises(urllib2.URLError):
+            pool.urlopen(self.server.url, 'data')
+
+    def test_0040_http_error(self):
+        "HTTP errors are raised like urllib2 raises them"
+        self.server.status = 500
+        with ConnectionPool() as pool:
+            with self.assertRaises(urllib2.HTTPError):
+                pool.urlopen(self.server.url + '/Rate', 'data')
+
+    def test_0050_stale_connection(self):
+        "A connection dropped by the server is replaced transparently"
+        with ConnectionPool() as pool:
+            pool.urlopen(self.server.url + '/Rate', 'data')
+            conn, last_used = pool._idle[pool.pool_key(self.server.url)][0]
+            conn.sock.close()
+            self.assertEqual(
+                pool.urlopen(self.server.url + '/Rate', 'data'),
+                '<Response>OK</Response>'
+            )
+
+    def test_0060_client_uses_pool(self):
+        "API clients send all their requests through the pool"
+
+        class LocalAddressValidation(AddressValidation):
+            base_url = {'sandbox': self.server.url}
+
+        with LocalAddressValidation('license', 'user', 'pass', True) as api:
+            for i in range(3):
+                api.request(
+                    AddressValidation.request_type(
+                        CountryCode='US', PostalCode='33101'
+                    )
+                )
+            self.assertEqual(api.pool.idle_count(), 1)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests[0][0], '/AV')
+        self.assertTrue(
+            'AddressValidationRequest' in self.server.requests[0][1]
+        )
+
+    def test_0070_shared_pool(self):
+        "A shared pool is left open when a client is closed"
+        pool = ConnectionPool()
+        api = AddressValidation('license', 'user', 'pass', True, pool=pool)
+        api.close()
+        self.assertFalse(pool.closed)
+        pool.close()
+
+    def test_0080_no_resend(self):
+        "A request lost after it was written to an idle connection is raised"
+
+        def body(path, data):
+            if data == 'lost':
+                raise ValueError('Connection dropped')
+            return '<Response>OK</Response>'
+        self.server.body = body
+        self.server.server.handle_error = lambda request, address: None
+
+        with ConnectionPool() as pool:
+            pool.urlopen(self.server.url + '/Ship', 'data')
+            with self.assertRaises(urllib2.URLError):
+                pool.urlopen(self.server.url + '/Ship', 'lost')
+        self.assertEqual(
+            [data for path, data in self.server.requests], ['data', 'lost']
+        )
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestConnectionPool)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
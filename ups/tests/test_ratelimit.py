@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    test_ratelimit
+
+    Test suite for the rate limiter
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+
+import unittest2 as unittest
+
+from ups.ratelimit import TokenBucket, RateLimiter, RateLimitExceeded
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+def reserve_many(directory):
+    "Reserves five requests from a limiter sharing the directory"
+    limiter = RateLimiter(rate=10, burst=10, directory=directory)
+    return [limiter.reserve('license', 'Rate') for i in range(5)]
+
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    Test the :class:`RateLimiter` and its token buckets
+    """
+
+    def test_0010_bucket(self):
+        "Requests beyond the burst wait for the rate"
+        bucket = TokenBucket(50, 5)
+        self.assertEqual([bucket.reserve() for i in range(5)], [0] * 5)
+        waits = [bucket.reserve() for i in range(3)]
+        self.assertAlmostEqual(waits[0], 0.02, delta=0.005)
+        self.assertAlmostEqual(waits[2], 0.06, delta=0.005)
+
+    def test_0020_deadline(self):
+        "Requests which would wait beyond their deadline fail fast"
+        bucket = TokenBucket(1, 1)
+        bucket.reserve(deadline=time.time())
+        with self.assertRaises(RateLimitExceeded) as context:
+            bucket.reserve(deadline=time.time() + 0.5)
+        self.assertAlmostEqual(context.exception.wait, 1, delta=0.05)
+        self.assertAlmostEqual(
+            bucket.reserve(deadline=time.time() + 2), 1, delta=0.05
+        )
+
+    def test_0030_budgets(self):
+        "Each license and endpoint has its own budget"
+        limiter = RateLimiter(budgets={'Rate': (10, 1), 'ShipAccept': (1, 2)})
+        self.assertEqual(limiter.reserve('a', 'Rate'), 0)
+        self.assertEqual(limiter.reserve('b', 'Rate'), 0)
+        self.assertTrue(limiter.reserve('a', 'Rate') > 0)
+        self.assertEqual(limiter.reserve('a', 'ShipAccept'), 0)
+        self.assertEqual(limiter.reserve('a', 'ShipAccept'), 0)
+        self.assertTrue(limiter.reserve('a', 'ShipAccept') > 0.9)
+        self.assertTrue(limiter.bucket('a', 'AV') is None)
+        self.assertEqual(limiter.reserve('a', 'AV'), 0)
+
+    def test_0040_processes(self):
+        "Limiters sharing a directory share their budgets across processes"
+        directory = tempfile.mkdtemp()
+        pool = Pool(4)
+        try:
+            waits = sum(pool.map(reserve_many, [directory] * 4), [])
+            self.assertTrue(waits.count(0) >= 10)
+            self.assertAlmostEqual(max(waits), 1.0, delta=0.2)
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(directory)
+
+    def test_0050_client(self):
+        "Clients wait for the limiter, or fail fast"
+        server = LocalServer('<RatingServiceSelectionResponse/>').start()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': server.url}
+
+        limiter = RateLimiter(budgets={'Rate': (20, 1)})
+        api = LocalRatingService(
+            'license', 'user', 'pass', True, rate_limiter=limiter
+        )
+        request = RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+        try:
+            start = time.time()
+            api.request(request)
+            futures = [api.request_async(request) for i in range(2)]
+            for future in futures:
+                future.result(timeout=5)
+            self.assertTrue(time.time() - start >= 0.09)
+
+            api.rate_limit_wait = 0
+            with self.assertRaises(RateLimitExceeded):
+                api.request(request)
+            self.assertTrue(isinstance(
+                api.request_async(request).exception(timeout=5),
+                RateLimitExceeded
+            ))
+            self.assertEqual(len(server.requests), 3)
+        finally:
+            api.close()
+            server.stop()
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestRateLimiter)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
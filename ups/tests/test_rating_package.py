@@ -13,7 +13,6 @@
     :copyright: (c) 2011 by Openlabs Technologies & Consulting (P) Limited
     :license: AGPL, see LICENSE for more details.
 """
-import os
 import logging
 
 import unittest2 as unittest
@@ -21,7 +20,7 @@ from lxml import etree
 from lxml.builder import E
 
 from ups.rating_package import RatingService
-from helper import ShippingPackageHelper as Helper
+from helper import ShippingPackageHelper as Helper, UPS_ENVIRON, cassette
 
 
 class TestRatingPackage(unittest.TestCase):
@@ -33,25 +32,26 @@ class TestRatingPackage(unittest.TestCase):
     def setUpClass(self):
         """Check if the variables for initialising the test case is available
         in the environment"""
-        assert 'UPS_LICENSE_NO' in os.environ, \
+        assert 'UPS_LICENSE_NO' in UPS_ENVIRON, \
             "UPS_LICENSE_NO not given. Hint:Use export UPS_LICENSE_NO=<number>"
-        assert 'UPS_SHIPPER_NO' in os.environ, \
+        assert 'UPS_SHIPPER_NO' in UPS_ENVIRON, \
             "UPS_SHIPPER_NO not given. Hint:Use export UPS_SHIPPER_NO=<number>"
-        assert 'UPS_USER_ID' in os.environ, \
+        assert 'UPS_USER_ID' in UPS_ENVIRON, \
             "UPS_USER_ID not given. Hint:Use export UPS_USER_ID=<user_id>"
-        assert 'UPS_PASSWORD' in os.environ, \
+        assert 'UPS_PASSWORD' in UPS_ENVIRON, \
             "UPS_PASSWORD not given. Hint:Use export UPS_PASSWORD=<password>"
 
     def setUp(self):
         """Initialise a ShipmentConfirm and ShipmentAccept class each.
         """
         logging.disable(logging.DEBUG)
-        self.shipper_number = os.environ['UPS_SHIPPER_NO']
+        self.shipper_number = UPS_ENVIRON['UPS_SHIPPER_NO']
         self.rating_api = RatingService(
-            os.environ['UPS_LICENSE_NO'],
-            os.environ['UPS_USER_ID'],
-            os.environ['UPS_PASSWORD'],
-            True            # Test must be performed in sandbox anyway
+            UPS_ENVIRON['UPS_LICENSE_NO'],
+            UPS_ENVIRON['UPS_USER_ID'],
+            UPS_ENVIRON['UPS_PASSWORD'],
+            True,           # Test must be performed in sandbox anyway
+            transport=cassette('rating_package'),
         )
 
     def test_rate_fetching(self):
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+    test_retry
+
+    Test suite for retries and circuit breakers
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import socket
+import time
+import urllib2
+
+import unittest2 as unittest
+
+from ups.base import PyUPSException
+from ups.deadline import DeadlineExceeded
+from ups.pool import ConnectionPool
+from ups.ratelimit import RateLimitExceeded
+from ups.retry import RetryPolicy, CircuitBreaker, CircuitOpenError, \
+    CLOSED, OPEN, HALF_OPEN
+from ups.rating_package import RatingService
+from helper import LocalServer
+from test_decoder import fixture
+
+SUCCESS = '<RatingServiceSelectionResponse/>'
+
+
+class Responses(object):
+    """Answers the requests of a :class:`LocalServer` with the given
+    (status, body) pairs in turn, and with the last one ever after. A third
+    item of a pair are seconds to wait before answering.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.server = LocalServer(self).start()
+
+    def __call__(self, path, data):
+        status, body = self.responses[0][:2]
+        if len(self.responses[0]) > 2:
+            time.sleep(self.responses[0][2])
+        if len(self.responses) > 1:
+            self.responses.pop(0)
+        self.server.status = status
+        return body
+
+
+class TestRetry(unittest.TestCase):
+    """
+    Test the :class:`RetryPolicy` and the :class:`CircuitBreaker`
+    """
+
+    def setUp(self):
+        self.policy = RetryPolicy(
+            attempts=3, backoff=0.001, failure_threshold=3,
+            reset_timeout=0.05,
+        )
+        self.request = RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def get_api(self, *responses, **kwargs):
+        """Returns a client talking to a server with the responses, which
+        is not idempotent if `idempotent=False` is given
+        """
+        server = Responses(*responses).server
+        self.servers.append(server)
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': server.url}
+            idempotent = kwargs.pop('idempotent', True)
+
+        api = LocalRatingService(
+            'license', 'user', 'pass', True, retry_policy=self.policy,
+            **kwargs
+        )
+        self.addCleanup(api.close)
+        return api, server
+
+    def test_0010_transient(self):
+        "Server errors and transient UPS errors are retried"
+        transient = fixture('error.xml').replace('Hard', 'Transient')
+        api, server = self.get_api(
+            (503, 'Unavailable'), (200, transient), (200, SUCCESS)
+        )
+        self.assertEqual(api.request(self.request).tag, SUCCESS[1:-2])
+        self.assertEqual(len(server.requests), 3)
+
+        api, server = self.get_api((502, 'Bad Gateway'), (200, SUCCESS))
+        api.request_async(self.request).result(timeout=5)
+        self.assertEqual(len(server.requests), 2)
+
+    def test_0020_permanent(self):
+        "Errors which would occur again are raised at once"
+        api, server = self.get_api((200, fixture('error.xml')))
+        with self.assertRaises(PyUPSException):
+            api.request(self.request)
+        api, server = self.get_api((400, 'Bad Request'))
+        with self.assertRaises(urllib2.HTTPError):
+            api.request_async(self.request).result(timeout=5)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_0030_attempts(self):
+        "The last error is raised once the attempts are used up"
+        api, server = self.get_api((500, 'Error'))
+        with self.assertRaises(urllib2.HTTPError):
+            api.request(self.request)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_0040_breaker(self):
+        "Breakers open on failures in a row and close on a probe"
+        self.policy.attempts = 1
+        api, server = self.get_api(
+            (500, 'Error'), (500, 'Error'), (500, 'Error'), (200, SUCCESS)
+        )
+        for i in range(3):
+            with self.assertRaises(urllib2.HTTPError):
+                api.request(self.request)
+        breaker = self.policy.breaker(api.url)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            api.request(self.request)
+        self.assertTrue(isinstance(
+            api.request_async(self.request).exception(timeout=5),
+            CircuitOpenError
+        ))
+        self.assertEqual(len(server.requests), 3)
+
+        time.sleep(0.05)
+        api.request(self.request)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(len(server.requests), 4)
+
+    def test_0050_half_open(self):
+        "Half open breakers let the given number of probes through"
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.allow()
+        breaker.record(True)
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.01)
+        breaker.allow()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.allow()
+        breaker.record(True)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_0060_not_idempotent(self):
+        "Requests which may have been carried out are not retried"
+        pool = ConnectionPool(timeout=0.2)
+        self.addCleanup(pool.close)
+        api, server = self.get_api(
+            (200, SUCCESS, 0.5), (200, SUCCESS), idempotent=False, pool=pool
+        )
+        with self.assertRaises(urllib2.URLError):
+            api.request(self.request)
+        self.assertEqual(len(server.requests), 1)
+
+        api, server = self.get_api((502, 'Bad Gateway'), idempotent=False)
+        with self.assertRaises(urllib2.HTTPError):
+            api.request_async(self.request).result(timeout=5)
+        self.assertEqual(len(server.requests), 1)
+
+        # UPS did not carry out refused requests
+        transient = fixture('error.xml').replace('Hard', 'Transient')
+        api, server = self.get_api(
+            (503, 'Unavailable'), (200, transient), (200, SUCCESS),
+            idempotent=False
+        )
+        api.request(self.request)
+        self.assertEqual(len(server.requests), 3)
+
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        api.base_url = {
+            'sandbox': 'http://127.0.0.1:%d' % listener.getsockname()[1]
+        }
+        listener.close()
+        with self.assertRaises(urllib2.URLError):
+            api.request(self.request)
+        self.assertEqual(self.policy.breaker(api.url).failures, 3)
+
+    def test_0070_local_errors(self):
+        "Errors raised before a request was sent leave the breaker alone"
+        breaker = self.policy.breaker('http://ups')
+        for i in range(3):
+            breaker.allow()
+            breaker.record(True)
+        time.sleep(0.05)
+        for exc in (RateLimitExceeded('Limited', 1),
+                    DeadlineExceeded()):
+            def attempt():
+                raise exc
+            with self.assertRaises(type(exc)):
+                self.policy.call('http://ups', attempt)
+            self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.allow()
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestRetry)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+    test_shipping_engine
+
+    Test suite for the pipelined shipping engine
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import time
+
+import unittest2 as unittest
+
+from ups.base import PyUPSException
+from ups.fake_server import FakeUPS, Profile
+from ups.shipping_engine import ShippingEngine
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept
+from test_fake_server import confirm_request
+
+
+class TestShippingEngine(unittest.TestCase):
+    """
+    Test the :class:`ShippingEngine`
+    """
+
+    def setUp(self):
+        self.fake = FakeUPS(seed=1)
+
+    def engine(self, typed=False, **kwargs):
+        "Returns an engine whose clients send to the fake"
+        return ShippingEngine(
+            ShipmentConfirm(
+                'license', 'user', 'pass', False, transport=self.fake
+            ),
+            ShipmentAccept(
+                'license', 'user', 'pass', False, transport=self.fake,
+                typed=typed
+            ),
+            **kwargs
+        )
+
+    def test_0010_pipeline(self):
+        "Shipments are confirmed and accepted concurrently"
+        self.fake = FakeUPS(Profile(latency=0.02), seed=1)
+        outcomes = []
+        start = time.time()
+        stats = self.engine(
+            typed=True, confirm_workers=8, accept_workers=8
+        ).ship((confirm_request(1 + i % 2) for i in range(40)),
+               outcomes.append)
+        elapsed = time.time() - start
+
+        # 80 round trips of 20ms each take 1.6s one after the other
+        self.assertTrue(elapsed < 0.8, elapsed)
+        self.assertEqual(stats.count, 40)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(
+            sorted(outcome.index for outcome in outcomes), range(40)
+        )
+        tracking_numbers = set()
+        for outcome in outcomes:
+            self.assertEqual(outcome.error, None)
+            self.assertTrue(outcome.digest)
+            self.assertEqual(
+                len(outcome.tracking_numbers), 1 + outcome.index % 2
+            )
+            self.assertTrue(outcome.results.total_charges > 0)
+            self.assertTrue(outcome.latency >= 0.04)
+            tracking_numbers.update(outcome.tracking_numbers)
+        self.assertEqual(len(tracking_numbers), 60)
+
+    def test_0020_failures(self):
+        "Failed shipments are reported with the stage they failed in"
+        self.fake = FakeUPS(
+            ShipConfirm=Profile(error_rate=0.5),
+            ShipAccept=Profile(error_rate=1),
+            seed=1,
+        )
+        outcomes = []
+        stats = self.engine().ship(
+            (confirm_request(1) for i in range(20)), outcomes.append
+        )
+        self.assertEqual(stats.errors, 20)
+        stages = [outcome.stage for outcome in outcomes]
+        self.assertEqual(len(stages), 20)
+        self.assertTrue(0 < stages.count('confirm') < 20)
+        for outcome in outcomes:
+            self.assertTrue(isinstance(outcome.error, PyUPSException))
+            self.assertEqual(outcome.results, None)
+            self.assertEqual(
+                outcome.digest is None, outcome.stage == 'confirm'
+            )
+
+    def test_0030_bounded(self):
+        "The input is consumed as the callback keeps up, which may stop it"
+        consumed, delivered = [], []
+
+        def requests():
+            for i in range(1000):
+                consumed.append(i)
+                yield confirm_request(1)
+
+        engine = self.engine(
+            confirm_workers=2, accept_workers=2, queue_size=3
+        )
+
+        def slow(outcome):
+            time.sleep(0.01)
+            delivered.append(outcome)
+            self.assertTrue(outcome.results.identification_number)
+            # The three queues, the workers, and what the feeder and the
+            # callback hold
+            self.assertTrue(len(consumed) <= len(delivered) + 3 * 3 + 4 + 2)
+            if len(delivered) == 20:
+                raise ValueError('Stop')
+
+        with self.assertRaises(ValueError):
+            engine.ship(requests(), slow)
+        self.assertTrue(len(consumed) < 50)
+
+        stats = engine.ship(confirm_request(1) for i in range(5))
+        self.assertEqual(stats.count, 5)
+
+    def test_0040_request_bodies(self):
+        "Every request sent by the workers carries its shared elements"
+        bodies = []
+        respond = self.fake.respond
+
+        def record(endpoint, data):
+            bodies.append((endpoint, data))
+            return respond(endpoint, data)
+        self.fake.respond = record
+
+        # Built ahead of time, while the workers build the accept requests
+        requests = [confirm_request(1 + i % 2) for i in range(20)]
+        stats = self.engine(confirm_workers=4, accept_workers=4).ship(
+            requests
+        )
+        self.assertEqual(stats.errors, 0)
+
+        self.assertEqual(len(bodies), 40)
+        for endpoint, data in bodies:
+            self.assertTrue(
+                endpoint in ('ShipConfirm', 'ShipAccept'), endpoint
+            )
+            self.assertTrue('<RequestAction>' in data, endpoint)
+            self.assertTrue('<RequestOption>' in data, endpoint)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestShippingEngine)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+    test_single_flight
+
+    Test suite for the coalescing of identical requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import time
+from threading import Event, Thread
+
+import unittest2 as unittest
+
+from ups.async_pool import AsyncConnectionPool, EventLoop
+from ups.single_flight import SingleFlight
+from ups.rating_package import RatingService
+from helper import LocalServer
+
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Test the :class:`SingleFlight` with the API clients
+    """
+
+    def setUp(self):
+        self.answer = Event()
+
+        def held_response(path, data):
+            "Answers once the test lets it, so that requests overlap"
+            self.answer.wait(5)
+            return '<RatingServiceSelectionResponse/>'
+
+        self.server = LocalServer(held_response).start()
+        self.loop = EventLoop().start()
+        self.single_flight = SingleFlight()
+
+        class LocalRatingService(RatingService):
+            base_url = {'sandbox': self.server.url}
+
+        self.api = LocalRatingService(
+            'license', 'user', 'pass', True,
+            async_pool=AsyncConnectionPool(self.loop),
+            single_flight=self.single_flight,
+        )
+
+    def tearDown(self):
+        self.answer.set()
+        self.api.close()
+        self.loop.stop()
+        self.server.stop()
+
+    def get_request(self, code='03'):
+        return RatingService.rating_request_type(
+            RatingService.service_type(Code=code)
+        )
+
+    def test_0010_threads(self):
+        "Identical requests from several threads share one call"
+        responses = []
+
+        def rate():
+            responses.append(self.api.request(self.get_request()))
+
+        threads = [Thread(target=rate) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        # Answer once every thread has joined the call of the first one
+        start = time.time()
+        while self.single_flight.coalesced < 9 and time.time() - start < 5:
+            time.sleep(0.01)
+        self.answer.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(responses), 10)
+        self.assertTrue(all(r is responses[0] for r in responses))
+        self.assertEqual(self.single_flight.coalesced, 9)
+        self.assertEqual(len(self.single_flight), 0)
+
+    def test_0020_async(self):
+        "Identical async requests share one call, others do not"
+        futures = [
+            self.api.request_async(self.get_request()) for i in range(10)
+        ] + [self.api.request_async(self.get_request('01'))]
+        self.answer.set()
+        responses = [f.result(timeout=10) for f in futures]
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(all(r is responses[0] for r in responses[:10]))
+        self.assertFalse(responses[10] is responses[0])
+
+    def test_0030_sequential(self):
+        "Requests which do not overlap are not coalesced"
+        self.answer.set()
+        self.api.request(self.get_request())
+        self.api.request(self.get_request())
+        self.assertEqual(len(self.server.requests), 2)
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSingleFlight)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -7,13 +7,13 @@
     :copyright: (c) 2011 by COM.lounge GmbH
     :license: AGPL, see LICENSE for more details.
 """
-import os
 import logging
 from datetime import datetime
 
 import unittest2 as unittest
 
 from ups.time_in_transit import TimeInTransit
+from helper import UPS_ENVIRON, cassette
 
 
 class TestTimeInTransit(unittest.TestCase):
@@ -25,11 +25,11 @@ class TestTimeInTransit(unittest.TestCase):
     def setUpClass(self):
         """Check if the variables for initialising the test case is available
         in the environment"""
-        assert 'UPS_LICENSE_NO' in os.environ, \
+        assert 'UPS_LICENSE_NO' in UPS_ENVIRON, \
             "UPS_LICENSE_NO not given. Hint:Use export UPS_LICENSE_NO=<number>"
-        assert 'UPS_USER_ID' in os.environ, \
+        assert 'UPS_USER_ID' in UPS_ENVIRON, \
             "UPS_USER_ID not given. Hint:Use export UPS_USER_ID=<user_id>"
-        assert 'UPS_PASSWORD' in os.environ, \
+        assert 'UPS_PASSWORD' in UPS_ENVIRON, \
             "UPS_PASSWORD not given. Hint:Use export UPS_PASSWORD=<password>"
 
     def setUp(self):
@@ -37,10 +37,11 @@ class TestTimeInTransit(unittest.TestCase):
         """
         logging.disable(logging.DEBUG)
         self.time_in_transit_api = TimeInTransit(
-            os.environ['UPS_LICENSE_NO'],
-            os.environ['UPS_USER_ID'],
-            os.environ['UPS_PASSWORD'],
-            True            # Test must be performed in sandbox anyway
+            UPS_ENVIRON['UPS_LICENSE_NO'],
+            UPS_ENVIRON['UPS_USER_ID'],
+            UPS_ENVIRON['UPS_PASSWORD'],
+            True,           # Test must be performed in sandbox anyway
+            transport=cassette('time_in_transit'),
         )
 
     def test_time_in_transit(self):
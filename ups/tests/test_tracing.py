@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+    test_tracing
+
+    Test suite for the tracing of the requests
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import unittest2 as unittest
+
+from ups.base import PyUPSException
+from ups.cache import TTLCache
+from ups.fake_server import FakeUPS, Profile
+from ups.metrics import Metrics
+from ups.rating_package import RatingService
+from ups.retry import RetryPolicy
+from ups.shipping_package import ShipmentConfirm, ShipmentAccept
+from ups.tracing import Tracer, OpenTracingTracer
+from test_fake_server import confirm_request
+
+
+class FakeSpan(object):
+    "Records what is done to it, like a span of OpenTracing"
+
+    def __init__(self, name, parent, attributes, start_time):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.start_time = start_time
+        self.end_time = None
+        self.exceptions = []
+
+    def set_tag(self, key, value):
+        self.attributes[key] = value
+
+    def log_kv(self, key_values):
+        self.exceptions.append(key_values['error.object'])
+
+    def finish(self, finish_time=None):
+        self.end_time = finish_time or 1
+
+
+class FakeOpenTracing(object):
+    "Stands in for a tracer of OpenTracing"
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, operation_name, child_of=None, tags=None,
+                   start_time=None):
+        span = FakeSpan(operation_name, child_of, tags, start_time)
+        self.spans.append(span)
+        return span
+
+    def children(self, span):
+        return [child for child in self.spans if child.parent is span]
+
+
+class TestTracing(unittest.TestCase):
+    """
+    Test the spans of the :class:`Tracer`
+    """
+
+    def setUp(self):
+        self.fake = FakeUPS(seed=1)
+        self.opentracing = FakeOpenTracing()
+        self.tracer = OpenTracingTracer(self.opentracing)
+
+    def api(self, api_class, **kwargs):
+        "Returns a client of the API which sends to the fake"
+        kwargs.setdefault('tracer', self.tracer)
+        return api_class(
+            'license', 'user', 'pass', True, transport=self.fake, **kwargs
+        )
+
+    def rating_request(self):
+        return RatingService.rating_request_type(
+            RatingService.ship_to_type(CompanyName='Apple')
+        )
+
+    def test_0010_spans(self):
+        "A call has a span, whose children are its phases"
+        metrics = Metrics()
+        digest = ShipmentConfirm.extract_digest(
+            self.api(ShipmentConfirm, metrics=metrics).request(
+                confirm_request(3)
+            )
+        )
+        root = self.opentracing.spans[0]
+        self.assertEqual(root.name, 'UPS ShipConfirm')
+        self.assertEqual(root.parent, None)
+        self.assertEqual(root.attributes['ups.endpoint'], 'ShipConfirm')
+        self.assertEqual(root.attributes['ups.sandbox'], True)
+        self.assertEqual(root.attributes['ups.packages'], 3)
+        self.assertEqual(root.attributes['ups.attempts'], 1)
+        self.assertEqual(root.attributes['ups.outcome'], 'ok')
+        self.assertTrue(root.attributes['ups.request_bytes'] > 1000)
+        self.assertTrue(root.attributes['ups.response_bytes'] > 100)
+        self.assertTrue(root.end_time)
+
+        children = self.opentracing.children(root)
+        self.assertEqual(
+            [child.name for child in children],
+            ['serialize', 'log', 'network', 'parse']
+        )
+        for previous, child in zip(children, children[1:]):
+            self.assertTrue(previous.end_time <= child.start_time)
+            self.assertTrue(child.start_time <= child.end_time)
+            self.assertEqual(child.attributes, {'ups.attempt': 1})
+        self.assertEqual(
+            metrics.snapshot()['ShipConfirm']['requests'], {'ok': 1}
+        )
+
+        directory = tempfile.mkdtemp()
+        try:
+            self.api(ShipmentAccept).request_labels(
+                ShipmentAccept.shipment_accept_request_type(digest),
+                os.path.join(directory, '%(index)s.%(format)s')
+            )
+        finally:
+            shutil.rmtree(directory)
+        root = self.opentracing.spans[5]
+        self.assertEqual(root.name, 'UPS ShipAccept')
+        self.assertEqual(root.attributes['ups.outcome'], 'ok')
+        self.assertEqual(
+            [child.name for child in self.opentracing.children(root)],
+            ['serialize', 'log', 'network', 'parse']
+        )
+
+    def test_0020_failures(self):
+        "Attempts are told apart, failed calls carry their error"
+        self.fake = FakeUPS(Rate=Profile(error_rate=1))
+        api = self.api(RatingService, retry_policy=RetryPolicy(
+            attempts=2, backoff=0, failure_threshold=None
+        ))
+        with self.assertRaises(PyUPSException):
+            api.request(self.rating_request())
+
+        root = self.opentracing.spans[0]
+        self.assertEqual(root.attributes['ups.outcome'], 'ups_error')
+        self.assertEqual(root.attributes['ups.error_code'], '20001')
+        self.assertEqual(root.attributes['ups.attempts'], 2)
+        self.assertEqual(len(root.exceptions), 1)
+        self.assertEqual(root.attributes['error'], True)
+        self.assertTrue(root.end_time)
+        self.assertEqual([
+            (child.name, child.attributes['ups.attempt'])
+            for child in self.opentracing.children(root)
+        ], [
+            ('serialize', 1), ('log', 1), ('network', 1), ('parse', 1),
+            ('network', 2), ('parse', 2),
+        ])
+
+    def test_0030_cached(self):
+        "Calls answered from the cache have a span without phases"
+        api = self.api(RatingService, cache=TTLCache())
+        api.request(self.rating_request())
+        api.request_async(self.rating_request()).result(timeout=5)
+        root = self.opentracing.spans[-1]
+        self.assertEqual(root.name, 'UPS Rate')
+        self.assertEqual(root.attributes['ups.cached'], True)
+        self.assertEqual(root.attributes['ups.outcome'], 'ok')
+        self.assertEqual(self.opentracing.children(root), [])
+        self.assertEqual(self.fake.answered, 1)
+
+    def test_0035_async(self):
+        "Async calls end their span once done, or cancelled"
+        api = self.api(RatingService)
+        api.request_async(self.rating_request()).result(timeout=5)
+        root = self.opentracing.spans[0]
+        for i in range(50):
+            if root.end_time:
+                break
+            time.sleep(0.01)
+        self.assertEqual(root.attributes['ups.outcome'], 'ok')
+        self.assertEqual(
+            [child.name for child in self.opentracing.children(root)],
+            ['serialize', 'log', 'network', 'parse']
+        )
+
+        self.fake = FakeUPS(Rate=Profile(latency=0.2))
+        spans = len(self.opentracing.spans)
+        future = self.api(RatingService).request_async(self.rating_request())
+        self.assertTrue(future.cancel())
+        root = self.opentracing.spans[spans]
+        self.assertEqual(root.name, 'UPS Rate')
+        self.assertTrue(root.end_time)
+        self.assertEqual(root.attributes['ups.outcome'], 'cancelled')
+        self.assertEqual(root.exceptions, [])
+
+    def test_0040_noop(self):
+        "The default tracer traces nothing"
+        for tracer in (None, Tracer()):
+            api = self.api(RatingService, tracer=tracer)
+            response = api.request(self.rating_request())
+            self.assertEqual(len(response.RatedShipment), 12)
+            response = api.request_async(self.rating_request()).result(5)
+            self.assertEqual(len(response.RatedShipment), 12)
+        self.assertEqual(self.opentracing.spans, [])
+
+
+def suite():
+    "Create a test suite and return it for better manageability"
+    suite = unittest.TestSuite()
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestTracing)
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
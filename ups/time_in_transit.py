@@ -10,23 +10,34 @@
 """
 from __future__ import with_statement
 
+import time
+from copy import deepcopy
+from datetime import datetime, timedelta
 from threading import Lock
 
-from lxml import etree, objectify
 from lxml.builder import E
 
 from base import BaseAPIClient
+from batch import BatchMixin
+from cache import canonical_form, canonical_key
+from decoder import decode_time_in_transit
 
 
 _logger_lock = Lock()
 
 
-class TimeInTransit(BaseAPIClient):
+class TimeInTransit(BatchMixin, BaseAPIClient):
     """Implements the TimeInTransitRequest"""
 
     # Indicates the action to be taken by the XML service.
     RequestAction = E.RequestAction('TimeInTransit')
 
+    # Decodes the response if the client is typed, see ups.decoder
+    decoder = staticmethod(decode_time_in_transit)
+
+    # Requests only read and hence may be hedged, see ups.hedging
+    hedgeable = True
+
     # Optional Processing
     # nonvalidate = No address validation.
     # validate = Fail on failed address validation.
@@ -61,10 +72,12 @@ class TimeInTransit(BaseAPIClient):
         """
 
         # /TimeInTransitRequest/Request
+        # The shared elements are copied, since lxml would move them out
+        # of the requests built before
         request = E.Request(
-            cls.RequestAction,
-            cls.RequestOption,
-            cls.TransactionReference,
+            deepcopy(cls.RequestAction),
+            deepcopy(cls.RequestOption),
+            deepcopy(cls.TransactionReference),
         )
 
         elements = cls.make_elements([
@@ -157,34 +170,72 @@ class TimeInTransit(BaseAPIClient):
             'TimeInTransit']
         )
 
-    def request(self, time_in_transit_request):
+    @staticmethod
+    def pickup_date(time_in_transit_request):
+        """Returns the PickupDate of the request as a :class:`datetime`, or
+        None if it is missing or malformed.
+        """
+        try:
+            return datetime.strptime(
+                time_in_transit_request.findtext('PickupDate').strip(),
+                '%Y%m%d'
+            )
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def lane(time_in_transit_request):
+        """Returns the origin and destination of the request, as a tuple of
+        the normalized (tag, value) pairs of both AddressArtifactFormat
+        elements.
+        """
+        return tuple(
+            tuple(sorted(
+                (child.tag, ' '.join((child.text or '').upper().split()))
+                for child in time_in_transit_request.iterfind(
+                    '%s/AddressArtifactFormat/*' % tag
+                )
+            ))
+            for tag in ('TransitFrom', 'TransitTo')
+        )
+
+    def cache_key(self, time_in_transit_request):
+        """Transit times are cached by lane, pickup date and the remaining
+        options of the request (weight, value, pickup time and so on).
+        Requests without a valid PickupDate are not cached.
+        """
+        pickup_date = self.pickup_date(time_in_transit_request)
+        if pickup_date is None:
+            return None
+        options = sorted(
+            canonical_form(child) for child in time_in_transit_request
+            if child.tag not in (
+                'Request', 'TransitFrom', 'TransitTo', 'PickupDate'
+            )
+        )
+        return canonical_key(
+            self.url, repr(self.lane(time_in_transit_request)),
+            pickup_date.strftime('%Y%m%d %a'), *options
+        )
+
+    def cache_expiry(self, time_in_transit_request):
+        """Cached transit times expire at the end of the pickup day (local
+        time), after which the delivery promise has to be asked for again.
+        """
+        end_of_day = self.pickup_date(time_in_transit_request) + \
+            timedelta(days=1)
+        return time.mktime(end_of_day.timetuple())
+
+    def request(self, time_in_transit_request, deadline=None):
         """Calls up UPS and send the request. Get the returned response
         and return an element built out of it.
 
         :param time_in_transit_request: lxml element with data for the
             time_in_transit_request
-
+        :param deadline: Seconds or a :class:`~ups.deadline.Deadline` by
+                         which the call must be finished.
         """
-        full_request = '\n'.join([
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(self.access_request, pretty_print=True),
-            '<?xml version="1.0" encoding="UTF-8" ?>',
-            etree.tostring(time_in_transit_request, pretty_print=True),
-        ])
-        self.logger.debug("Request XML: %s", full_request)
-
-        # Send the request
-        result = self.send_request(self.url, full_request)
-        self.logger.debug("Response Received: %s", result)
-
-        response = objectify.fromstring(result)
-        self.look_for_error(response, full_request)
-
-        # Return request ?
-        if self.return_xml:
-            return full_request, response
-        else:
-            return response
+        return self._request(time_in_transit_request, deadline)
 
 
 if __name__ == '__main__':
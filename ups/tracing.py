@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    tracing
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Tracing
+    ~~~~~~~
+
+    When a checkout is slow, the metrics of :mod:`ups.metrics` tell which
+    phase is slow on average, while a trace tells where the time of that
+    one checkout went. A :class:`Tracer` given to the API clients emits a
+    span for every call of `request`, `request_async` and
+    :meth:`~ups.shipping_package.ShipmentAccept.request_labels`, with a
+    child span for each of its phases: `serialize`, `log` (pretty-printing
+    the request, in debug mode only), `network` and `parse`. The phases of
+    the attempts of a retried call are all children of its span, told apart
+    by their `ups.attempt` attribute.
+
+    The span of the call has these attributes:
+
+    ================== =======================================================
+    ups.endpoint       The endpoint, e.g. `ShipConfirm`
+    ups.sandbox        True for requests to the sandbox
+    ups.packages       Number of packages of the request, if it has any
+    ups.request_bytes  Bytes of the request sent last
+    ups.response_bytes Bytes of the response received last
+    ups.attempts       Number of attempts made
+    ups.outcome        Outcome of the call, see :data:`ups.metrics.OUTCOMES`
+    ups.error_code     Code of the UPS error the call failed with, if any
+    ups.cached         True if the response came from the cache
+    ================== =======================================================
+
+    Spans are sent to OpenTracing by the :class:`OpenTracingTracer`::
+
+        rating_api = RatingService(
+            license_no, user_id, password, True,
+            tracer=OpenTracingTracer()
+        )
+
+    The span of a call is a child of the active span of the OpenTracing
+    scope manager, if there is one. OpenTracing is used since it supports
+    Python 2, which OpenTelemetry never did; OpenTracing tracers which
+    export to an OpenTelemetry collector can be used with it, and other
+    tracing systems can be adapted by subclassing :class:`Tracer`. Clients
+    without a tracer, which is the default, trace nothing at all.
+"""
+from metrics import CANCELLED, Sample, outcome
+from retry import error_code
+
+
+class Span(object):
+    """A span which records nothing. The spans of a :class:`Tracer` have
+    its methods.
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        "Sets an attribute of the span"
+
+    def record_exception(self, exc):
+        "Records the exception the span failed with"
+
+    def end(self, end_time=None):
+        """Ends the span
+
+        :param end_time: Timestamp the span ended at, now if None
+        """
+
+
+#: The span of the :class:`Tracer` which records nothing
+NOOP_SPAN = Span()
+
+
+class Tracer(object):
+    """A tracer which records nothing. Subclasses send the spans somewhere,
+    like :class:`OpenTracingTracer`.
+    """
+
+    def start_span(self, name, parent=None, attributes=None,
+                   start_time=None):
+        """Returns a started :class:`Span`
+
+        :param parent: The span of which the span is a child, the current
+            span if None
+        :param attributes: A dict of the attributes of the span
+        :param start_time: Timestamp the span started at, now if None
+        """
+        return NOOP_SPAN
+
+    def sample(self, metrics, endpoint, sandbox, request_element):
+        """Starts the span of a call of the request element and returns the
+        :class:`TracedSample` its phases are timed into
+        """
+        attributes = {'ups.endpoint': endpoint, 'ups.sandbox': sandbox}
+        packages = len(request_element.findall('.//Package'))
+        if packages:
+            attributes['ups.packages'] = packages
+        return TracedSample(
+            metrics, endpoint, self,
+            self.start_span('UPS %s' % endpoint, attributes=attributes)
+        )
+
+
+class TracedSample(Sample):
+    """A :class:`~ups.metrics.Sample` which also emits the phases of a call
+    as child spans of its span, see :mod:`ups.tracing`
+
+    :param tracer: The :class:`Tracer` of the spans
+    :param span: The span of the call
+    :param attempt: The number of the attempt the phases belong to
+    """
+
+    __slots__ = ('tracer', 'span', 'attempt')
+
+    def __init__(self, metrics, endpoint, tracer, span, attempt=1):
+        Sample.__init__(self, metrics, endpoint)
+        self.tracer = tracer
+        self.span = span
+        self.attempt = attempt
+
+    def lap(self, phase):
+        started = self.lapped
+        Sample.lap(self, phase)
+        self.tracer.start_span(
+            phase, self.span, {'ups.attempt': self.attempt}, started
+        ).end(self.lapped)
+
+    def record(self, exc=None, phase=None):
+        Sample.record(self, exc, phase)
+        self.span.set_attribute('ups.attempts', self.attempt)
+        self.span.set_attribute('ups.request_bytes', self.request_bytes)
+        self.span.set_attribute('ups.response_bytes', self.response_bytes)
+
+    def retry(self):
+        return TracedSample(
+            self.metrics, self.endpoint, self.tracer, self.span,
+            self.attempt + 1
+        )
+
+    def cached(self):
+        Sample.cached(self)
+        self.span.set_attribute('ups.cached', True)
+        self.finish()
+
+    def finish(self, exc=None):
+        result = outcome(exc)
+        self.span.set_attribute('ups.outcome', result)
+        if exc is not None and result != CANCELLED:
+            code = error_code(exc)[1]
+            if code:
+                self.span.set_attribute('ups.error_code', code)
+            self.span.record_exception(exc)
+        self.span.end()
+
+
+class OpenTracingTracer(Tracer):
+    """Sends the spans to OpenTracing
+
+    :param tracer: The OpenTracing tracer which starts the spans, the global
+        tracer of :mod:`opentracing` if None
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            import opentracing
+            tracer = opentracing.global_tracer()
+        self.tracer = tracer
+
+    def start_span(self, name, parent=None, attributes=None,
+                   start_time=None):
+        return OpenTracingSpan(self.tracer.start_span(
+            name, child_of=parent and parent.span, tags=attributes,
+            start_time=start_time
+        ))
+
+
+class OpenTracingSpan(Span):
+    """A :class:`Span` of the :class:`OpenTracingTracer`. Exceptions are
+    recorded the way OpenTracing specifies for errors.
+    """
+
+    __slots__ = ('span', )
+
+    def __init__(self, span):
+        self.span = span
+
+    def set_attribute(self, key, value):
+        self.span.set_tag(key, value)
+
+    def record_exception(self, exc):
+        self.span.set_tag('error', True)
+        self.span.log_kv({
+            'event': 'error', 'error.kind': exc.__class__.__name__,
+            'error.object': exc, 'message': unicode(exc),
+        })
+
+    def end(self, end_time=None):
+        self.span.finish(finish_time=end_time)
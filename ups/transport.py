@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+    transport
+
+    :copyright: (c) 2014 by Openlabs Technologies & Consulting (P) Limited
+    :license: AGPL, see LICENSE for more details.
+
+    Transports
+    ~~~~~~~~~~
+
+    The API clients send their requests over the connection pools of
+    :mod:`ups.pool` and :mod:`ups.async_pool` by default. A
+    :class:`Transport` given to a client takes their place, and decides how
+    the XML documents get to UPS, if they get there at all::
+
+        fake = FakeUPS()
+        rating_api = RatingService(
+            license_no, user_id, password, True, transport=fake
+        )
+
+    Transports can be shared by several clients. The clients leave them
+    open, so close them once they are no longer needed.
+
+    Requests sent through a transport are never hedged, since a hedge must
+    be sent over a connection of its own, see :mod:`ups.hedging`.
+"""
+from __future__ import with_statement
+
+from threading import Lock
+
+from pool import ConnectionPool
+from async_pool import AsyncConnectionPool
+
+
+class Transport(object):
+    """The interface of the transports. Subclasses implement both
+    :meth:`urlopen` and :meth:`urlopen_async`, which behave like the
+    `urlopen` methods of :class:`~ups.pool.ConnectionPool` and
+    :class:`~ups.async_pool.AsyncConnectionPool` respectively.
+    """
+
+    #: Default timeout of the requests in seconds
+    timeout = 10
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def loop(self):
+        """The :class:`~ups.async_pool.EventLoop` which runs the callbacks
+        of the futures returned by :meth:`urlopen_async`, and the timers of
+        the clients
+        """
+        raise NotImplementedError
+
+    def urlopen(self, url, data, headers=None, timeout=None, sink=None,
+                deadline=None):
+        """POSTs the data to the url and returns the body of the response,
+        see :meth:`ups.pool.ConnectionPool.urlopen`
+        """
+        raise NotImplementedError
+
+    def urlopen_async(self, url, data, headers=None, timeout=None):
+        """POSTs the data to the url and returns a
+        :class:`~ups.async_pool.Future` for the body of the response, see
+        :meth:`ups.async_pool.AsyncConnectionPool.urlopen`
+        """
+        raise NotImplementedError
+
+    def close(self):
+        "Releases whatever the transport holds on to"
+        pass
+
+
+class PoolTransport(Transport):
+    """Sends the requests over connection pools, just like the clients do
+    without a transport. Meant to be wrapped by other transports which only
+    change a part of the way.
+
+    :param pool: The :class:`~ups.pool.ConnectionPool` to send the requests
+        through, created on first use if not given
+    :param async_pool: The :class:`~ups.async_pool.AsyncConnectionPool` used
+        by :meth:`urlopen_async`, created on first use if not given
+    """
+
+    def __init__(self, pool=None, async_pool=None):
+        self._pool = pool
+        self._async_pool = async_pool
+        self._lock = Lock()
+
+    @property
+    def timeout(self):
+        return self.pool.timeout
+
+    @property
+    def pool(self):
+        "The :class:`~ups.pool.ConnectionPool` of the transport"
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool()
+        return self._pool
+
+    @property
+    def async_pool(self):
+        "The :class:`~ups.async_pool.AsyncConnectionPool` of the transport"
+        if self._async_pool is None:
+            with self._lock:
+                if self._async_pool is None:
+                    self._async_pool = AsyncConnectionPool()
+        return self._async_pool
+
+    @property
+    def loop(self):
+        return self.async_pool.loop
+
+    def urlopen(self, url, data, headers=None, timeout=None, sink=None,
+                deadline=None):
+        return self.pool.urlopen(url, data, headers, timeout, sink, deadline)
+
+    def urlopen_async(self, url, data, headers=None, timeout=None):
+        return self.async_pool.urlopen(url, data, headers, timeout)
+
+    def close(self):
+        "Closes both pools"
+        if self._pool is not None:
+            self._pool.close()
+        if self._async_pool is not None:
+            self._async_pool.close()